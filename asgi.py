@@ -0,0 +1,8 @@
+"""
+Asynchronous Server Gateway Interface (ASGI) entry point
+
+Serve it with any ASGI server, for example: uvicorn asgi:app --port 8080
+"""
+from service.asgi import RecommendationService
+
+app = RecommendationService()
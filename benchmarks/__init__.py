@@ -0,0 +1,7 @@
+"""
+Performance benchmarks for the recommendation service
+
+These are not part of the unit test suite. Run them one at a time, e.g.
+
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_indexes
+"""
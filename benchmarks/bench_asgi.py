@@ -0,0 +1,115 @@
+"""
+Benchmark: requests per second on one core, WSGI (Flask) vs ASGI
+
+Seeds the table and sends the same mix of GET /recommendations/{id} and
+filtered GET /recommendations requests to both apps in this one process.
+The Flask app is called through its test client one request at a time, as
+a sync worker serves them, and the ASGI app is called directly with
+--concurrency requests in flight on a single event loop. Both skip the
+HTTP server, so the numbers compare the apps and their database access.
+
+The ASGI app only pulls ahead when requests wait on the network: run it
+against PostgreSQL to see that, since SQLite answers in process.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_asgi --requests 2000
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from service import config
+from service.asgi import RecommendationService
+from service.common import status
+from service.common.migrations import upgrade_schema
+from service.models import db
+from wsgi import app
+from tests.factories import RecommendationFactory
+
+
+def paths(ids, count):
+    """Returns the request paths of the benchmark"""
+    chooser = random.Random(42)
+    return [
+        f"/recommendations/{chooser.choice(ids)}" if index % 2 else f"/recommendations?name={index % 50}&limit=20"
+        for index in range(count)
+    ]
+
+
+def run_wsgi(requests):
+    """Returns the requests per second of the Flask app"""
+    client = app.test_client()
+    start = time.perf_counter()
+    for path in requests:
+        assert client.get(path).status_code == status.HTTP_200_OK
+    return len(requests) / (time.perf_counter() - start)
+
+
+async def run_asgi(service, requests, concurrency):
+    """Returns the requests per second of the ASGI app"""
+
+    async def call(path):
+        route, _, query = path.partition("?")
+        scope = {"type": "http", "method": "GET", "path": route, "query_string": query.encode(), "headers": []}
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            sent.append(message)
+
+        await service(scope, receive, send)
+        assert sent[0]["status"] == status.HTTP_200_OK
+
+    await service.startup()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(path):
+        async with semaphore:
+            await call(path)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(path) for path in requests))
+    rate = len(requests) / (time.perf_counter() - start)
+    await service.shutdown()
+    return rate
+
+
+def main():
+    """Runs the benchmark and prints the throughput of both apps"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="recommendations to seed")
+    parser.add_argument("--requests", type=int, default=2000, help="requests sent to each app")
+    parser.add_argument("--concurrency", type=int, default=20, help="ASGI requests in flight")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+    app.config["CACHE_BACKEND"] = "none"
+
+    with app.app_context():
+        upgrade_schema(db.engine, db.metadata)
+        client = app.test_client()
+        client.delete("/recommendations", query_string="id_min=0")
+        items = [RecommendationFactory(name=str(index % 50)).serialize() for index in range(args.rows)]
+        ids = client.post("/recommendations/batch", json=items).get_json()["created"]
+        requests = paths(ids, args.requests)
+
+        # neither app may answer from a cache
+        from service.common.cache import cache  # pylint: disable=import-outside-toplevel
+
+        cache.configure({"CACHE_BACKEND": "none"})
+        wsgi_rate = run_wsgi(requests)
+
+        settings = {key: getattr(config, key) for key in dir(config) if key.isupper()}
+        settings.update(SQLALCHEMY_DATABASE_URI=app.config["SQLALCHEMY_DATABASE_URI"], CACHE_BACKEND="none")
+        asgi_rate = asyncio.run(run_asgi(RecommendationService(settings), requests, args.concurrency))
+        client.delete("/recommendations", query_string="id_min=0")
+
+    print(f"WSGI (sequential):         {wsgi_rate:8.0f} requests/s")
+    print(f"ASGI ({args.concurrency:3d} in flight):     {asgi_rate:8.0f} requests/s")
+    print(f"ratio:                     {asgi_rate / wsgi_rate:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
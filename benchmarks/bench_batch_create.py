@@ -0,0 +1,59 @@
+"""
+Benchmark: single-item POST /recommendations vs POST /recommendations/batch
+
+Creates the same number of recommendations through both endpoints with the
+Flask test client and reports the throughput of each.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_batch_create --items 20000
+"""
+import argparse
+import json
+import logging
+import time
+from wsgi import app
+from service.models import db, Recommendation
+from service.common.migrations import upgrade_schema
+from tests.factories import RecommendationFactory
+
+
+def reset():
+    """Empties the Recommendation table"""
+    db.session.query(Recommendation).delete()
+    db.session.commit()
+
+
+def main():
+    """Runs the benchmark and prints the throughput of both paths"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=20000, help="recommendations to create")
+    parser.add_argument("--single-items", type=int, default=2000, help="items sent through the single-item path")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+    client = app.test_client()
+
+    with app.app_context():
+        upgrade_schema(db.engine, db.metadata)
+        items = [RecommendationFactory().serialize() for _ in range(args.items)]
+
+        reset()
+        start = time.perf_counter()
+        for item in items[:args.single_items]:
+            client.post("/recommendations", json=item)
+        single_rate = args.single_items / (time.perf_counter() - start)
+
+        reset()
+        body = "\n".join(json.dumps(item) for item in items)
+        start = time.perf_counter()
+        response = client.post("/recommendations/batch", data=body, content_type="application/x-ndjson")
+        batch_rate = args.items / (time.perf_counter() - start)
+        created = len(response.get_json()["created"])
+        reset()
+
+    print(f"single POST: {single_rate:10.0f} items/s")
+    print(f"batch POST:  {batch_rate:10.0f} items/s ({created} created)")
+    print(f"speedup:     {batch_rate / single_rate:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
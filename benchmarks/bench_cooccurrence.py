@@ -0,0 +1,93 @@
+"""
+Benchmark: the cross-sell co-occurrence job on a large order history
+
+Writes --lines synthetic order lines to a CSV file (unless --path names an
+existing one), then times the two phases of the cross-sell-build job:
+counting the pairs of products bought together in chunks of --chunk-size
+lines, and scoring the top --top-k neighbors of every product. The peak
+memory of the process is printed after each phase, so running it with a
+few sizes shows that memory follows the products and pairs, not the lines.
+
+Orders hold 1 to 8 products drawn with a skew towards popular products.
+With --upsert, the recommendations are also written to DATABASE_URI.
+
+Usage:
+    python -m benchmarks.bench_cooccurrence --lines 10000000
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_cooccurrence --lines 1000000 --upsert
+"""
+import os
+import csv
+import time
+import random
+import logging
+import argparse
+import itertools
+import resource
+from service.common import cooccurrence
+
+
+def write_orders(path, lines, products):
+    """Writes lines of synthetic orders to a CSV file"""
+    rng = random.Random(42)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(products)))
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["order_id", "product_name", "product_id"])
+        written, order = 0, 0
+        while written < lines:
+            order += 1
+            basket = rng.choices(range(products), cum_weights=cum_weights, k=min(rng.randint(1, 8), lines - written))
+            writer.writerows((order, f"product-{product}", product) for product in basket)
+            written += len(basket)
+
+
+def peak_mb():
+    """Returns the peak resident memory of the process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    """Runs the job and prints the time and peak memory of each phase"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1000000, help="order lines to generate")
+    parser.add_argument("--products", type=int, default=50000, help="distinct products to generate")
+    parser.add_argument("--path", default="/tmp/orders.csv", help="order lines file, generated when missing")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="order lines counted at a time")
+    parser.add_argument("--top-k", type=int, default=10, help="neighbors kept per product")
+    parser.add_argument("--metric", choices=cooccurrence.METRICS, default="lift", help="pair score")
+    parser.add_argument("--upsert", action="store_true", help="also write the recommendations to DATABASE_URI")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        start = time.perf_counter()
+        write_orders(args.path, args.lines, args.products)
+        print(f"generate: {time.perf_counter() - start:8.1f} s")
+
+    start = time.perf_counter()
+    lines = cooccurrence.read_order_lines(args.path, "csv", ("order_id", "product_name", "product_id"))
+    counts = cooccurrence.CooccurrenceCounts().count(lines, args.chunk_size)
+    print(
+        f"count:    {time.perf_counter() - start:8.1f} s  peak {peak_mb():7.0f} MB  "
+        f"{counts.lines} lines, {counts.orders} orders, {len(counts.names)} products, {counts.pairs.nnz} pairs"
+    )
+
+    start = time.perf_counter()
+    if args.upsert:
+        from wsgi import app  # pylint: disable=import-outside-toplevel
+        from service.models import db, Recommendation  # pylint: disable=import-outside-toplevel
+        from service.common.migrations import upgrade_schema  # pylint: disable=import-outside-toplevel
+
+        app.logger.setLevel(logging.CRITICAL)
+        with app.app_context():
+            upgrade_schema(db.engine, db.metadata)
+            kept = 0
+            for rows in counts.recommendations(metric=args.metric, top_k=args.top_k):
+                Recommendation.upsert_many(rows)
+                kept += len(rows)
+    else:
+        kept = sum(len(products) for products, _, _ in counts.top_neighbors(args.metric, args.top_k))
+    print(f"score:    {time.perf_counter() - start:8.1f} s  peak {peak_mb():7.0f} MB  {kept} recommendations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark: find_by_* lookup latency with and without secondary indexes
+
+Seeds the Recommendation table, drops the secondary indexes, times each
+lookup, rebuilds the indexes with the same upgrade_schema() used by
+``flask db-migrate`` and times the lookups again.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_indexes --rows 1000000
+"""
+import argparse
+import logging
+import random
+import time
+from statistics import median
+from sqlalchemy import insert, text
+from wsgi import app
+from service.models import db, Recommendation, EnumRecommendationType
+from service.common.migrations import upgrade_schema
+
+NAMES = 10000
+TYPES = [member.name for member in EnumRecommendationType]
+
+
+def seed(rows: int, chunk_size: int = 10000):
+    """Replaces the table contents with rows of synthetic data"""
+    db.session.query(Recommendation).delete()
+    db.session.commit()
+    rng = random.Random(42)
+    for start in range(0, rows, chunk_size):
+        batch = [
+            {
+                "name": f"product-{rng.randrange(NAMES)}",
+                "recommendation_type": rng.choice(TYPES),
+                "recommendation_name": f"product-{rng.randrange(NAMES)}",
+                "recommendation_id": rng.randrange(NAMES * 10),
+                "recommendation_in_stock": rng.random() < 0.5,
+            }
+            for _ in range(min(chunk_size, rows - start))
+        ]
+        db.session.execute(insert(Recommendation.__table__), batch)
+        db.session.commit()
+
+
+def lookups():
+    """Returns the lookups to time as (label, callable) pairs"""
+    return [
+        ("find_by_name", lambda: Recommendation.find_by_name("product-17").all()),
+        ("find_by_type", lambda: Recommendation.find_by_type("ACCESSORY").limit(100).all()),
+        ("find_by_recommendation_name", lambda: Recommendation.find_by_recommendation_name("product-17").all()),
+        ("find_by_recommendation_id", lambda: Recommendation.find_by_recommendation_id(1717).all()),
+        (
+            "find_by_filters(type, in_stock)",
+            lambda: Recommendation.find_by_filters(
+                {"recommendation_type": "UP_SELL", "recommendation_in_stock": True}
+            ).limit(100).all(),
+        ),
+    ]
+
+
+def time_lookups(repeat: int) -> dict:
+    """Returns the median latency in milliseconds of each lookup"""
+    results = {}
+    for label, lookup in lookups():
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            lookup()
+            samples.append((time.perf_counter() - start) * 1000)
+            db.session.expunge_all()
+        results[label] = median(samples)
+    return results
+
+
+def main():
+    """Runs the benchmark and prints a before/after table"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="rows to seed")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per lookup")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+
+    with app.app_context():
+        print(f"Seeding {args.rows} rows ...")
+        seed(args.rows)
+        table = Recommendation.__table__
+        for index in table.indexes:
+            db.session.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        db.session.commit()
+        before = time_lookups(args.repeat)
+
+        start = time.perf_counter()
+        upgrade_schema(db.engine, db.metadata)
+        build_seconds = time.perf_counter() - start
+        after = time_lookups(args.repeat)
+
+    print(f"Index build time: {build_seconds:.1f}s")
+    print(f"{'lookup':35} {'no index (ms)':>14} {'indexed (ms)':>13} {'speedup':>8}")
+    for label, without in before.items():
+        with_index = after[label]
+        print(f"{label:35} {without:14.2f} {with_index:13.2f} {without / with_index:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
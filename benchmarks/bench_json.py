@@ -0,0 +1,47 @@
+"""
+Benchmark: standard library vs orjson JSON provider
+
+Encodes the same list of serialized recommendations with each provider, the
+way a page of GET /recommendations is encoded, and reports the throughput.
+
+Usage:
+    python -m benchmarks.bench_json --items 50000
+"""
+import argparse
+import time
+from flask import Flask
+from service.common import json_provider
+from tests.factories import RecommendationFactory
+
+
+def throughput(provider, items, repeat):
+    """Returns the best items/s and MB/s of several encodes of the items"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = provider.dumps_rows(items)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best, len(body) / best / 1e6
+
+
+def main():
+    """Runs the benchmark and prints the throughput of both providers"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=50000, help="serialized recommendations to encode")
+    parser.add_argument("--repeat", type=int, default=5, help="encodes per provider, the fastest is reported")
+    args = parser.parse_args()
+
+    items = [RecommendationFactory(id=index).serialize() for index in range(args.items)]
+    results = {}
+    for name in ["stdlib", "orjson"]:
+        app = Flask(__name__)
+        app.config["JSON_PROVIDER"] = name
+        json_provider.init_app(app)
+        results[name] = throughput(app.json, items, args.repeat)
+        print(f"{name:7s} {results[name][0]:12.0f} items/s {results[name][1]:8.1f} MB/s")
+
+    print(f"speedup: {results['orjson'][0] / results['stdlib'][0]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: per-request cost of the logging modes
+
+Sends the same GET /recommendations/{id} requests (answered from the
+cache) through the Flask test client with the app logger configured by
+log_handlers.init_logging in each mode, writing to a file the way the
+gunicorn handlers write to stderr, and reports the time per request and
+the overhead over no logging at all. The modes take turns over several
+rounds and the fastest round of each is reported.
+
+--write-latency makes every write to the file wait that many seconds, like
+a stderr pipe whose reader (a container log driver, say) falls behind;
+the queue keeps those waits off the request thread.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_logging --requests 2000 --write-latency 0.0002
+"""
+import argparse
+import logging
+import tempfile
+import time
+from wsgi import app
+from service.common import log_handlers
+from service.models import db
+from service.common.migrations import upgrade_schema
+from tests.factories import RecommendationFactory
+
+MODES = {
+    "no logging": None,
+    "sync text": {"LOG_QUEUE": False, "LOG_FORMAT": "text", "LOG_SAMPLING": ""},
+    "sync json": {"LOG_QUEUE": False, "LOG_FORMAT": "json", "LOG_SAMPLING": ""},
+    "queue text": {"LOG_QUEUE": True, "LOG_FORMAT": "text", "LOG_SAMPLING": ""},
+    "queue json": {"LOG_QUEUE": True, "LOG_FORMAT": "json", "LOG_SAMPLING": ""},
+    "queue text, 10% sampled": {"LOG_QUEUE": True, "LOG_FORMAT": "text", "LOG_SAMPLING": "service=0.1"},
+}
+
+
+class SlowStream:
+    """A file whose writes take a while"""
+
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text):
+        """Writes text after the latency"""
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def flush(self):
+        """Flushes the file"""
+        self.stream.flush()
+
+
+def configure(settings, stream):
+    """Sets up the app logger for a mode"""
+    server_logger = logging.getLogger("bench.gunicorn")
+    server_logger.setLevel(logging.INFO)
+    server_logger.handlers = [logging.StreamHandler(stream)]
+    if settings is None:
+        log_handlers.stop_listener(app)
+        app.logger.handlers = []
+        return
+    app.config.update(settings)
+    log_handlers.init_logging(app, "bench.gunicorn")
+
+
+def time_requests(client, path, count):
+    """Returns the time per request in microseconds"""
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get(path)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    """Runs the benchmark and prints the cost of each mode"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per round")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds of every mode")
+    parser.add_argument("--write-latency", type=float, default=0.0, help="seconds each write to the log takes")
+    args = parser.parse_args()
+
+    with app.app_context():
+        upgrade_schema(db.engine, db.metadata)
+        recommendation = RecommendationFactory()
+        recommendation.create()
+        path = f"/recommendations/{recommendation.id}"
+        client = app.test_client()
+        results = {mode: float("inf") for mode in MODES}
+        with tempfile.TemporaryFile("w") as file:
+            stream = SlowStream(file, args.write_latency)
+            for _ in range(args.rounds):
+                for mode, settings in MODES.items():
+                    configure(settings, stream)
+                    client.get(path)  # warm up, and fill the cache
+                    results[mode] = min(results[mode], time_requests(client, path, args.requests))
+                    # the queued records are written after the timing, off the request thread
+                    log_handlers.stop_listener(app)
+        recommendation.delete()
+
+    print(f"{'mode':26} {'us/request':>11} {'overhead':>9}")
+    for mode, micros in results.items():
+        print(f"{mode:26} {micros:11.1f} {micros - results['no logging']:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
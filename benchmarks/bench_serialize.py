@@ -0,0 +1,82 @@
+"""
+Benchmark: ORM serialize() loop vs the Core row fast path
+
+Seeds the table and serializes every row both ways: loading Recommendation
+objects and calling serialize() on each, and selecting plain rows with
+Recommendation.select_rows() and building the dictionaries from the tuples.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_serialize --rows 50000
+"""
+import argparse
+import logging
+import time
+from wsgi import app
+from service.models import db, Recommendation, EnumRecommendationType
+from service.common.migrations import upgrade_schema
+
+
+def seed(rows):
+    """Replaces the table contents with the given number of rows"""
+    db.session.query(Recommendation).delete()
+    db.session.commit()
+    types = list(EnumRecommendationType)
+    for start in range(0, rows, 10000):
+        db.session.execute(
+            db.insert(Recommendation),
+            [
+                {
+                    "name": f"product-{index % 1000}",
+                    "recommendation_type": types[index % len(types)],
+                    "recommendation_in_stock": index % 2 == 0,
+                    "recommendation_name": f"recommendation-{index}",
+                    "recommendation_id": index,
+                }
+                for index in range(start, min(start + 10000, rows))
+            ],
+        )
+    db.session.commit()
+
+
+def best_of(repeat, function):
+    """Returns the fastest of several timed runs of a function in seconds"""
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    """Runs the benchmark and prints the time taken by both paths"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000, help="rows to seed and serialize")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each path, the fastest is reported")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+
+    with app.app_context():
+        upgrade_schema(db.engine, db.metadata)
+        seed(args.rows)
+        query = Recommendation.query.order_by(Recommendation.id)
+
+        orm = best_of(args.repeat, lambda: [row.serialize() for row in query.all()])
+        core = best_of(
+            args.repeat,
+            lambda: list(Recommendation.serialize_rows(Recommendation.select_rows(query))),
+        )
+        same = [row.serialize() for row in query.all()] == list(
+            Recommendation.serialize_rows(Recommendation.select_rows(query))
+        )
+        db.session.query(Recommendation).delete()
+        db.session.commit()
+
+    print(f"ORM serialize(): {orm * 1000:10.1f} ms for {args.rows} rows")
+    print(f"Core rows:       {core * 1000:10.1f} ms for {args.rows} rows")
+    print(f"speedup:         {orm / core:10.1f}x (identical output: {same})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Benchmark: top-K recommendations of a product by score
+
+Seeds the Recommendation table and times three ways of getting the --top
+highest scoring recommendations of one product and type:
+
+python sort   - read every row of the product and type and pick the best in Python
+sorted query  - ORDER BY score DESC LIMIT without the score index, so the
+                database reads and sorts every matching row
+index order   - the same query once ix_recommendation_name_type_score is
+                built, which reads the first --top entries of the index
+
+and, for comparison, the in-memory adjacency index behind
+GET /products/{name}/recommendations?top=. Each product has about
+--rows / --products recommendations spread over the four types.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_top --rows 1000000
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_top --rows 10000000 --products 1000
+"""
+import heapq
+import argparse
+import logging
+import random
+import time
+from statistics import median
+from sqlalchemy import insert, text
+from wsgi import app
+from service.models import db, Recommendation, EnumRecommendationType
+from service.common.adjacency import adjacency
+from service.common.migrations import upgrade_schema
+
+TYPES = [member.name for member in EnumRecommendationType]
+INDEX = "ix_recommendation_name_type_score"
+
+
+def seed(rows: int, products: int, chunk_size: int = 50000):
+    """Replaces the table contents with rows of synthetic data, without the secondary indexes"""
+    db.session.query(Recommendation).delete()
+    for index in Recommendation.__table__.indexes:
+        db.session.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    db.session.commit()
+    rng = random.Random(42)
+    for start in range(0, rows, chunk_size):
+        batch = [
+            {
+                "name": f"product-{rng.randrange(products)}",
+                "recommendation_type": rng.choice(TYPES),
+                "recommendation_name": f"product-{rng.randrange(products)}",
+                "recommendation_id": rng.randrange(products * 10),
+                "recommendation_in_stock": rng.random() < 0.5,
+                "score": rng.random(),
+            }
+            for _ in range(min(chunk_size, rows - start))
+        ]
+        db.session.execute(insert(Recommendation.__table__), batch)
+        db.session.commit()
+
+
+def top_query(name, top):
+    """Returns the best rows of a product and type through the list query"""
+    query = db.select(*Recommendation.read_columns()).where(
+        *Recommendation.filter_clauses({"name": name, "recommendation_type": "UP_SELL"})
+    )
+    return db.session.execute(Recommendation.page_query(query, top, None, "-score")).all()[:top]
+
+
+def python_sort(name, top):
+    """Returns the best rows of a product and type by sorting them in Python"""
+    query = db.select(*Recommendation.read_columns()).where(
+        *Recommendation.filter_clauses({"name": name, "recommendation_type": "UP_SELL"})
+    )
+    return heapq.nlargest(top, db.session.execute(query).all(), key=lambda row: (row.score, row.id))
+
+
+def time_calls(function, names, top, repeat):
+    """Returns the median latency in milliseconds of a function over the product names"""
+    samples = []
+    for _ in range(repeat):
+        for name in names:
+            start = time.perf_counter()
+            function(name, top)
+            samples.append((time.perf_counter() - start) * 1000)
+    return median(samples)
+
+
+def main():
+    """Runs the benchmark and prints the latency of each way"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="rows to seed")
+    parser.add_argument("--products", type=int, default=1000, help="distinct products the rows belong to")
+    parser.add_argument("--top", type=int, default=10, help="recommendations to return")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per product")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+    # the index builds and the full read of the adjacency index are slow queries on purpose
+    logging.getLogger("flask.app").setLevel(logging.CRITICAL)
+    names = [f"product-{index}" for index in random.Random(7).sample(range(args.products), 20)]
+
+    with app.app_context():
+        print(f"Seeding {args.rows} rows ...")
+        seed(args.rows, args.products)
+        # every index but the score index, so the sorted query can find the product
+        upgrade_schema(db.engine, db.metadata)
+        db.session.execute(text(f"DROP INDEX {INDEX}"))
+        # statistics let the planner pick the name index over the type index
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        results = {
+            "python sort": time_calls(python_sort, names, args.top, args.repeat),
+            "sorted query": time_calls(top_query, names, args.top, args.repeat),
+        }
+
+        start = time.perf_counter()
+        upgrade_schema(db.engine, db.metadata)
+        print(f"Built {INDEX} in {time.perf_counter() - start:.1f}s")
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        results["index order"] = time_calls(top_query, names, args.top, args.repeat)
+
+        adjacency.reset()
+        start = time.perf_counter()
+        adjacency.build()
+        print(f"Built the adjacency index in {time.perf_counter() - start:.1f}s")
+        results["adjacency index"] = time_calls(
+            lambda name, top: adjacency.lookup(name, "UP_SELL", top, top=True), names, args.top, args.repeat
+        )
+
+    baseline = results["python sort"]
+    print(f"{'top ' + str(args.top):20} {'median (ms)':>12} {'speedup':>8}")
+    for label, latency in results.items():
+        print(f"{label:20} {latency:12.3f} {baseline / latency:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Load test: latency percentiles of the service under mixed traffic
+
+Migrates DATABASE_URI and boots wsgi:app under gunicorn against it (or
+targets a running server with --url), seeds it through the batch endpoint
+and sends a weighted mix of scenarios at a fixed --rate for --duration
+seconds:
+
+read    - GET /recommendations/{id}
+filter  - GET /recommendations filtered by name and stock
+restock - a burst of --burst concurrent PUT /recommendations/{id}/restock,
+          where 409 (already in stock) counts as success
+batch   - POST /recommendations/batch of --batch-size items
+
+Requests are sent on a schedule rather than as fast as responses come
+back, and each latency is measured from the time the request was due, so
+a stalled server shows up in the percentiles instead of slowing the test
+down. The p50/p95/p99 latency, throughput and error rate of each endpoint
+are printed as a table and, with --output, written as JSON.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/load.db python -m benchmarks.loadtest --rate 200 --duration 30
+    python -m benchmarks.loadtest --url http://localhost:8080 --mix read=50,filter=20,restock=20,batch=10
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit, urlencode
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+MIXES = {
+    "read-heavy": "read=80,filter=15,restock=4,batch=1",
+    "mixed": "read=50,filter=20,restock=20,batch=10",
+    "write-heavy": "read=20,filter=10,restock=40,batch=30",
+}
+NAMES = 200
+
+
+class Client:  # pylint: disable=too-few-public-methods
+    """Sends requests over one keep-alive connection per thread"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        """Returns the status of a request, reconnecting once if the connection dropped"""
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        for attempt in range(2):
+            if getattr(self.local, "connection", None) is None:
+                self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.local.connection.request(method, path, body=data, headers=headers)
+                response = self.local.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, OSError):
+                self.local.connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+        return None
+
+
+class Recorder:
+    """Collects the latency and outcome of every request by endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        """Stores the outcome of one request"""
+        with self.lock:
+            self.latencies[endpoint].append(seconds * 1000)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def report(self, elapsed):
+        """Returns the percentiles, throughput and error rate of each endpoint"""
+        report = {}
+        every = []
+        for endpoint, latencies in sorted(self.latencies.items()):
+            every.extend(latencies)
+            report[endpoint] = summarize(latencies, self.errors[endpoint], elapsed)
+        report["all"] = summarize(every, sum(self.errors.values()), elapsed)
+        return report
+
+
+def percentile(ordered, fraction):
+    """Returns a percentile of sorted values by the nearest rank"""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies, errors, elapsed):
+    """Returns the statistics of one endpoint"""
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "error_rate": errors / len(ordered) if ordered else 0.0,
+        "throughput_rps": len(ordered) / elapsed,
+        "p50_ms": percentile(ordered, 0.50) if ordered else None,
+        "p95_ms": percentile(ordered, 0.95) if ordered else None,
+        "p99_ms": percentile(ordered, 0.99) if ordered else None,
+        "max_ms": ordered[-1] if ordered else None,
+    }
+
+
+class Scenarios:
+    """The operations of the load test"""
+
+    def __init__(self, client, recorder, ids, args):
+        self.client = client
+        self.recorder = recorder
+        self.ids = ids
+        self.args = args
+
+    def send(self, endpoint, due, method, path, body=None, accept=(200,)):
+        """Sends a request and records its latency since it was due"""
+        # pylint: disable=too-many-arguments
+        try:
+            ok = self.client.request(method, path, body) in accept
+        except (http.client.HTTPException, OSError):
+            ok = False
+        self.recorder.record(endpoint, time.perf_counter() - due, ok)
+
+    def read(self, due, rng):
+        """Reads one recommendation"""
+        self.send("GET /recommendations/{id}", due, "GET", f"/recommendations/{rng.choice(self.ids)}")
+
+    def filter(self, due, rng):
+        """Lists the in stock recommendations of a product"""
+        query = urlencode({"name": f"product-{rng.randrange(NAMES)}", "recommendation_in_stock": "true"})
+        self.send("GET /recommendations?filters", due, "GET", f"/recommendations?{query}")
+
+    def restock(self, due, rng):
+        """Restocks one recommendation"""
+        product_id = rng.choice(self.ids)
+        path = f"/recommendations/{product_id}/restock"
+        self.send("PUT /recommendations/{id}/restock", due, "PUT", path, accept=(200, 409))
+
+    def batch(self, due, rng):
+        """Creates a batch of recommendations"""
+        body = items(rng, self.args.batch_size)
+        self.send("POST /recommendations/batch", due, "POST", "/recommendations/batch", body, accept=(201,))
+
+
+def items(rng, count):
+    """Returns new recommendations to create"""
+    return [
+        {
+            "name": f"product-{rng.randrange(NAMES)}",
+            "recommendation_type": rng.choice(["UP_SELL", "CROSS_SELL", "ACCESSORY"]),
+            "recommendation_name": f"product-{rng.randrange(NAMES)}",
+            "recommendation_id": rng.randrange(NAMES * 10),
+            "recommendation_in_stock": rng.random() < 0.5,
+        }
+        for _ in range(count)
+    ]
+
+
+def parse_mix(mix):
+    """Returns the scenario names and weights of a mix like read=80,filter=20"""
+    mix = MIXES.get(mix, mix)
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("read", "filter", "restock", "batch"):
+            raise SystemExit(f"Unknown scenario: {name}")
+        weights[name] = float(weight)
+    return weights
+
+
+def start_server(port, workers):
+    """Migrates the database, starts gunicorn on a port and waits until it answers"""
+    subprocess.run([sys.executable, "-m", "flask", "--app", "wsgi:app", "db-migrate"], check=True)
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--log-level", "warning", "wsgi:app"],
+        env=dict(os.environ, CACHE_BACKEND=os.getenv("CACHE_BACKEND", "memory")),
+    )
+    client = Client(f"http://127.0.0.1:{port}")
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if client.request("GET", "/health") == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("gunicorn did not start")
+
+
+def seed(client, rows):
+    """Replaces the recommendations with rows of synthetic data and returns their ids"""
+    client.request("DELETE", "/recommendations?id_min=0")
+    rng = random.Random(42)
+    ids = []
+    connection = http.client.HTTPConnection(client.host, client.port, timeout=120)
+    for start in range(0, rows, 1000):
+        connection.request(
+            "POST",
+            "/recommendations/batch",
+            body=json.dumps(items(rng, min(1000, rows - start))),
+            headers={"Content-Type": "application/json"},
+        )
+        ids.extend(json.loads(connection.getresponse().read())["created"])
+    connection.close()
+    return ids
+
+
+def drive(scenarios, weights, rate, duration, concurrency):
+    """Sends the scenarios at the target rate and returns the seconds it took"""
+    rng = random.Random(7)
+    names, values = list(weights), list(weights.values())
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for sent in range(int(rate * duration)):
+            due = start + sent / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = rng.choices(names, values)[0]
+            # a restock operation is a burst of restocks that are all due at once
+            for burst in range(scenarios.args.burst if name == "restock" else 1):
+                pool.submit(getattr(scenarios, name), due, random.Random(sent * 1000 + burst))
+    return time.perf_counter() - start
+
+
+def print_table(report):
+    """Prints the report as a table"""
+    print(f"{'endpoint':36} {'requests':>9} {'rps':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for endpoint, stats in report.items():
+        if not stats["requests"]:
+            continue
+        print(
+            f"{endpoint:36} {stats['requests']:9d} {stats['throughput_rps']:8.1f} {stats['error_rate']:7.1%} "
+            f"{stats['p50_ms']:8.1f} {stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f} {stats['max_ms']:8.1f}"
+        )
+
+
+def main():
+    """Runs the load test and reports the latency of each endpoint"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="server to test instead of starting gunicorn")
+    parser.add_argument("--port", type=int, default=8089, help="port gunicorn listens on")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--rows", type=int, default=10000, help="recommendations to seed")
+    parser.add_argument("--mix", default="read-heavy", help=f"{', '.join(MIXES)} or weights like read=80,batch=20")
+    parser.add_argument("--rate", type=float, default=100, help="operations started per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to send operations for")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight at most")
+    parser.add_argument("--burst", type=int, default=10, help="restocks per restock operation")
+    parser.add_argument("--batch-size", type=int, default=20, help="items per batch create")
+    parser.add_argument("--output", help="file to write the JSON report to")
+    args = parser.parse_args()
+    weights = parse_mix(args.mix)
+
+    server = None if args.url else start_server(args.port, args.workers)
+    try:
+        client = Client(args.url or f"http://127.0.0.1:{args.port}")
+        print(f"Seeding {args.rows} rows ...", file=sys.stderr)
+        ids = seed(client, args.rows)
+        recorder = Recorder()
+        elapsed = drive(Scenarios(client, recorder, ids, args), weights, args.rate, args.duration, args.concurrency)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = recorder.report(elapsed)
+    print_table(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"mix": weights, "rate": args.rate, "duration": elapsed, "endpoints": report}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
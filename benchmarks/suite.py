@@ -0,0 +1,195 @@
+"""
+Benchmark suite: model and route hot paths, with a baseline comparison
+
+Seeds the Recommendation table with RecommendationFactory rows for each
+--sizes dataset, times the model methods and the routes (through the Flask
+test client) and writes the results as JSON. With --baseline, the results
+are compared with an earlier results file and the script exits with status
+1 when any benchmark is more than --threshold slower than its baseline.
+
+Each benchmark runs --number calls per round for --repeat rounds, and the
+median and fastest round are reported per call. The fastest round is the
+one compared, as it is the least disturbed by other work on the machine.
+The read-through cache is off so that reads reach the database.
+DATABASE_URI picks the database, so the same suite runs against SQLite
+locally and PostgreSQL in CI.
+
+Usage:
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.suite --output baseline.json
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.suite --baseline baseline.json
+    DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.suite --sizes 1000,100000,1000000
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+from datetime import datetime, timezone
+from statistics import median
+import factory.random
+import sqlalchemy
+from wsgi import app
+from service.models import db, Recommendation
+from service.common import status
+from service.common.cache import cache
+from service.common.adjacency import adjacency
+from service.common.migrations import upgrade_schema
+from tests.factories import RecommendationFactory
+
+CHUNK_SIZE = 10000
+
+
+def seed(rows):
+    """Replaces the table contents with rows made by RecommendationFactory"""
+    db.session.query(Recommendation).delete()
+    db.session.commit()
+    factory.random.reseed_random(42)
+    for start in range(0, rows, CHUNK_SIZE):
+        batch = []
+        for recommendation in RecommendationFactory.build_batch(min(CHUNK_SIZE, rows - start)):
+            values = recommendation.serialize()
+            del values["id"]
+            batch.append(values)
+        db.session.execute(db.insert(Recommendation), batch)
+        db.session.commit()
+    # the inserts skip the write paths, so the next lookup indexes them
+    adjacency.reset()
+
+
+def model_benchmarks(sample):
+    """Returns the model benchmarks as (name, callable) pairs"""
+    data = sample.serialize()
+    return [
+        ("model.serialize", sample.serialize),
+        ("model.deserialize", lambda: Recommendation().deserialize(data)),
+        ("model.find", lambda: Recommendation.find(sample.id)),
+        ("model.find_by_name", lambda: Recommendation.find_by_name(sample.name).all()),
+        ("model.find_by_type", lambda: Recommendation.find_by_type(sample.recommendation_type.name).limit(100).all()),
+        (
+            "model.find_by_recommendation_name",
+            lambda: Recommendation.find_by_recommendation_name(sample.recommendation_name).limit(100).all(),
+        ),
+        ("model.find_by_recommendation_id", lambda: Recommendation.find_by_recommendation_id(sample.recommendation_id).all()),
+        (
+            "model.find_by_filters",
+            lambda: Recommendation.find_by_filters(
+                {"recommendation_name": [sample.recommendation_name], "recommendation_in_stock": True}
+            ).limit(100).all(),
+        ),
+    ]
+
+
+def route_benchmarks(client, sample):
+    """Returns the route benchmarks as (name, callable) pairs"""
+
+    def get(path, **query):
+        def call():
+            response = client.get(path, query_string=query)
+            assert response.status_code == status.HTTP_200_OK, response.status_code
+
+        return call
+
+    return [
+        ("route.get_recommendation", get(f"/recommendations/{sample.id}")),
+        ("route.list_recommendations", get("/recommendations", limit=100)),
+        ("route.list_by_name", get("/recommendations", name=sample.name)),
+        (
+            "route.list_by_filters",
+            get("/recommendations", recommendation_name=sample.recommendation_name, recommendation_in_stock="true"),
+        ),
+        ("route.list_page_1000", get("/recommendations", limit=1000)),
+        ("route.product_recommendations", get(f"/products/{sample.name}/recommendations")),
+    ]
+
+
+def measure(function, number, repeat):
+    """Returns the median and fastest time per call in microseconds"""
+    function()  # warm up
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+            db.session.expunge_all()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+    return {"median_us": round(median(rounds), 2), "min_us": round(min(rounds), 2)}
+
+
+def run(sizes, number, repeat):
+    """Returns the results of every benchmark for every dataset size"""
+    client = app.test_client()
+    results = {}
+    for size in sizes:
+        print(f"Seeding {size} rows ...", file=sys.stderr)
+        seed(size)
+        sample = db.session.scalars(db.select(Recommendation).limit(1)).one()
+        db.session.expunge(sample)
+        for name, function in model_benchmarks(sample) + route_benchmarks(client, sample):
+            results[f"{name}[{size}]"] = measure(function, number, repeat)
+            print(f"{name}[{size}]: {results[f'{name}[{size}]']['median_us']:.1f} us", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints the fastest round of each benchmark against the baseline and returns the regressions"""
+    regressions = []
+    print(f"{'benchmark':50} {'baseline (us)':>14} {'current (us)':>13} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:50} {'-':>14} {result['min_us']:13.1f} {'new':>8}")
+            continue
+        before = baseline[name]["min_us"]
+        change = result["min_us"] / before - 1
+        flag = " REGRESSION" if change > threshold else ""
+        print(f"{name:50} {before:14.1f} {result['min_us']:13.1f} {change:+7.0%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    """Runs the suite, writes the results and compares them with a baseline"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000", help="comma separated rows to seed, e.g. 1000,100000,1000000")
+    parser.add_argument("--number", type=int, default=50, help="calls per round")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per benchmark")
+    parser.add_argument("--output", help="file to write the results to (default: standard output)")
+    parser.add_argument("--baseline", help="results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.CRITICAL)
+
+    with app.app_context():
+        upgrade_schema(db.engine, db.metadata)
+        cache.configure({"CACHE_BACKEND": "none"})
+        results = run([int(size) for size in args.sizes.split(",")], args.number, args.repeat)
+        report = {
+            "meta": {
+                "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "database": db.engine.dialect.name,
+                "python": platform.python_version(),
+                "sqlalchemy": sqlalchemy.__version__,
+                "number": args.number,
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Gunicorn configuration
+
+Gunicorn reads this file from the working directory. It keeps the
+Prometheus metrics of the workers in files under PROMETHEUS_MULTIPROC_DIR,
+so that /metrics reports the whole server and not just the worker that
+answers. With PRELOAD_APP the app is created once in the master, and each
+worker replaces the database connections it inherits after the fork.
+"""
+import os
+import shutil
+import tempfile
+
+preload_app = os.getenv("PRELOAD_APP", "false").lower() in ["true", "yes", "1"]
+
+multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus-multiproc")
+)
+# Clear the metrics left behind by an earlier server. This happens here and
+# not in on_starting, because with PRELOAD_APP gunicorn imports the app,
+# whose metrics open their files in the directory, before on_starting runs.
+shutil.rmtree(multiproc_dir, ignore_errors=True)
+os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the in-progress requests of a worker that exited"""
+    try:
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Gives a worker of a preloaded app its own database connections"""
+    if preload_app:
+        # pylint: disable=import-outside-toplevel
+        from wsgi import app
+        from service.common import workers
+
+        workers.after_fork(app)
@@ -18,10 +18,9 @@ Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
-import sys
 from flask import Flask
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, json_provider, pool, query_args, workers
 
 
 ############################################################
@@ -32,11 +31,25 @@ def create_app():
     # Create Flask application
     app = Flask(__name__)
     app.config.from_object(config)
+    # <int:...> rules only match ids that fit the Integer id columns
+    app.url_map.converters["int"] = query_args.IdConverter
+    json_provider.init_app(app)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = pool.engine_options(app.config)
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
     from service.models import db
+    from service.common.cache import cache
+    from service.common.replicas import replicas
+    from service.common.metrics import metrics
+    from service.common.sql_trace import sql_trace
+    from service.common.adjacency import adjacency
     db.init_app(app)
+    cache.init_app(app)
+    replicas.init_app(app)
+    metrics.init_app(app)
+    sql_trace.init_app(app)
+    adjacency.init_app(app)
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
@@ -44,16 +57,14 @@ def create_app():
         from service import routes, models  # noqa: F401 E402
         from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
-        try:
-            db.create_all()
-        except Exception as error:  # pylint: disable=broad-except
-            app.logger.critical("%s: Cannot continue", error)
-            # gunicorn requires exit code 4 to stop spawning workers when they die
-            sys.exit(4)
-
         # Set up logging for production
         log_handlers.init_logging(app, "gunicorn.error")
 
+        # the tables are created by "flask db-migrate" before the workers start,
+        # and a preloaded app warms up in each worker after the fork instead
+        if app.config["WARMUP"] and not app.config["PRELOAD_APP"]:
+            workers.warm_up(app)
+
         app.logger.info(70 * "*")
         app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
         app.logger.info(70 * "*")
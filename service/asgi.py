@@ -0,0 +1,589 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Recommendation Store Service (ASGI)
+
+This module serves the REST API of service/routes.py from async handlers
+over an async SQLAlchemy engine, so one worker process keeps many requests
+in flight while they wait on the database. The URL rules are matched by
+werkzeug as in Flask, and what a handler decides comes from
+service/common/handlers.py and the Recommendation model, so the handlers
+here only run the statements and both apps answer the same way.
+
+DATABASE_URI is used with an async driver: psycopg for PostgreSQL and
+aiosqlite for SQLite. Reads always go to the database; writes still evict
+the shared cache so a Flask app reading through Redis stays current.
+"""
+import asyncio
+import logging
+import os
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlencode
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MultiDict, MIMEAccept
+from werkzeug.exceptions import HTTPException, InternalServerError, abort
+from werkzeug.http import parse_accept_header, parse_etags
+from werkzeug.routing import Map, Rule
+from service import config
+from service.models import db, Recommendation, DataValidationError
+from service.common import status
+from service.common.cache import cache
+from service.common.json_provider import dumps_bytes, dumps_rows, loads
+from service.common.pool import engine_options, pool_stats
+from service.common.query_args import IdConverter, parse_filters, parse_bulk_filters
+from service.common.handlers import (
+    NDJSON, Batch, StreamEncoder, cache_headers, error_message, list_args, next_page_args, not_found,
+    page_headers, product_args, restock_failed, update_values,
+)
+
+logger = logging.getLogger("flask.app")
+
+TABLE = Recommendation.__table__
+STATIC_FOLDER = os.path.join(os.path.dirname(__file__), "static")
+
+# the error names used by service/common/error_handlers.py
+ERROR_NAMES = {
+    status.HTTP_400_BAD_REQUEST: "Bad Request",
+    status.HTTP_404_NOT_FOUND: "Not Found",
+    status.HTTP_405_METHOD_NOT_ALLOWED: "Method not Allowed",
+    status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: "Unsupported media type",
+    status.HTTP_500_INTERNAL_SERVER_ERROR: "Internal Server Error",
+}
+
+
+######################################################################
+#  R E Q U E S T S   A N D   R E S P O N S E S
+######################################################################
+class Request:
+    """The parts of an ASGI HTTP request that the handlers read"""
+
+    def __init__(self, scope, receive, service):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.scheme = scope.get("scheme", "http")
+        self.args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+        self.headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        self.service = service
+        self._receive = receive
+
+    @property
+    def engine(self):
+        """The async engine of the service"""
+        return self.service.engine
+
+    @property
+    def settings(self) -> dict:
+        """The configuration of the service"""
+        return self.service.settings
+
+    @property
+    def url_root(self) -> str:
+        """The scheme and host the request was sent to"""
+        return f"{self.scheme}://{self.headers.get('host', 'localhost')}"
+
+    @property
+    def base_url(self) -> str:
+        """The URL of the request without its query string"""
+        return self.url_root + self.path
+
+    async def stream(self):
+        """Yields the chunks of the request body as they arrive"""
+        while True:
+            message = await self._receive()
+            yield message.get("body", b"")
+            if not message.get("more_body"):
+                return
+
+    async def lines(self):
+        """Yields the lines of the request body"""
+        pending = b""
+        async for chunk in self.stream():
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        yield pending
+
+    async def json(self):
+        """Returns the decoded JSON body"""
+        body = b"".join([chunk async for chunk in self.stream()])
+        try:
+            return loads(body)
+        except ValueError:
+            return abort(status.HTTP_400_BAD_REQUEST, "Failed to decode JSON object")
+
+    def check_content_type(self, *content_types):
+        """Checks that the media type is one of the given types"""
+        content_type = self.headers.get("content-type")
+        if content_type not in content_types:
+            logger.error("Invalid Content-Type: %s", content_type)
+            abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {' or '.join(content_types)}")
+
+    def prefers_ndjson(self) -> bool:
+        """True when the Accept header prefers NDJSON to a JSON array"""
+        accept = parse_accept_header(self.headers.get("accept"), MIMEAccept)
+        return accept.best_match(["application/json", NDJSON]) == NDJSON
+
+    def not_modified(self, etag) -> bool:
+        """True when the If-None-Match header already holds the entity tag"""
+        return parse_etags(self.headers.get("if-none-match")).contains_weak(etag)
+
+
+class Response:  # pylint: disable=too-few-public-methods
+    """A response with a body, or with a stream of body chunks"""
+
+    def __init__(self, body=b"", status_code=status.HTTP_200_OK, headers=None, content_type="application/json"):
+        self.body = body
+        self.status_code = status_code
+        self.headers = dict(headers or {})
+        if content_type:
+            self.headers["Content-Type"] = content_type
+
+    async def send(self, send):
+        """Sends the response through an ASGI send callable"""
+        streaming = not isinstance(self.body, bytes)
+        if not streaming:
+            self.headers["Content-Length"] = str(len(self.body))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in self.headers.items()],
+            }
+        )
+        if not streaming:
+            await send({"type": "http.response.body", "body": self.body})
+            return
+        async for chunk in self.body:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    """Returns a response with the data encoded as JSON"""
+    return Response(dumps_bytes(data) + b"\n", status_code, headers)
+
+
+def error_response(status_code, message):
+    """Returns an error response shaped like the ones of error_handlers.py"""
+    name = ERROR_NAMES.get(status_code, HTTPStatus(status_code).phrase)
+    return json_response({"status": status_code, "error": name, "message": message}, status_code)
+
+
+def not_modified(headers):
+    """Returns an empty 304 Not Modified response"""
+    return Response(b"", status.HTTP_304_NOT_MODIFIED, headers, content_type=None)
+
+
+######################################################################
+#  R O U T I N G
+######################################################################
+# the rules of service/routes.py with the converters of the Flask app
+URL_MAP = Map(converters={"int": IdConverter}, strict_slashes=False, merge_slashes=False)
+
+
+def route(rule, *methods):
+    """Registers a handler for a rule of service/routes.py"""
+
+    def decorator(handler):
+        URL_MAP.add(Rule(rule, methods=methods, endpoint=handler))
+        return handler
+
+    return decorator
+
+
+async def dispatch(request):
+    """Calls the handler of the rule that matches the request, or raises 404 or 405 as Flask does"""
+    handler, params = URL_MAP.bind("localhost").match(request.path, request.method)  # pylint: disable=unpacking-non-sequence
+    return await handler(request, **params)
+
+
+async def write(request, statement, parameters=None):
+    """Runs a write statement in its own transaction and returns its buffered result
+
+    A statement the database rejects raises DataValidationError, as the
+    writes of the Recommendation model do.
+    """
+    try:
+        async with request.engine.begin() as connection:
+            return await connection.execute(statement, parameters)
+    except SQLAlchemyError as error:
+        raise DataValidationError(error) from error
+
+
+async def exists(request, product_id) -> bool:
+    """True when there is a Recommendation with the id"""
+    async with request.engine.connect() as connection:
+        return await connection.scalar(db.select(TABLE.c.id).where(TABLE.c.id == product_id)) is not None
+
+
+async def invalidate(*ids, all_rows=False):
+    """Evicts changed Recommendations from the shared cache"""
+    await asyncio.to_thread(Recommendation.invalidate, *ids, all_rows=all_rows)
+
+
+######################################################################
+#  R E S T   A P I   E N D P O I N T S
+######################################################################
+@route("/", "GET")
+async def index(request):  # pylint: disable=unused-argument
+    """Base URL for our service"""
+
+    def read():
+        with open(os.path.join(STATIC_FOLDER, "index.html"), "rb") as page:
+            return page.read()
+
+    return Response(await asyncio.to_thread(read), content_type="text/html; charset=utf-8")
+
+
+@route("/recommendations", "POST")
+async def create_recommendations(request):
+    """Creates a Recommendation"""
+    request.check_content_type("application/json")
+    values = Recommendation.validate(await request.json())
+    row = (await write(request, db.insert(TABLE).values(values).returning(*TABLE.columns))).first()
+    await invalidate(row.id)
+    location = f"{request.url_root}/recommendations/{row.id}"
+    return json_response(Recommendation.serialize_row(row), status.HTTP_201_CREATED, {"Location": location})
+
+
+@route("/recommendations/batch", "POST")
+async def create_recommendations_batch(request):
+    """Creates many Recommendations with multi-row INSERTs, one transaction per chunk"""
+    request.check_content_type("application/json", NDJSON)
+    batch = Batch(request.settings["BATCH_CHUNK_SIZE"])
+    async for position, item in batch_items(request):
+        await insert_chunk(request, batch.add(position, item), batch)
+    await insert_chunk(request, batch.rest(), batch)
+    return json_response(*batch.result())
+
+
+async def batch_items(request):
+    """Yields (position, item) for each item of a JSON array or NDJSON body"""
+    if request.headers["content-type"] == NDJSON:
+        position = 0
+        async for line in request.lines():
+            if not line.strip():
+                continue
+            try:
+                yield position, loads(line)
+            except ValueError:
+                yield position, None
+            position += 1
+        return
+
+    items = await request.json()
+    if not isinstance(items, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Batch body must be a JSON array")
+    for position, item in enumerate(items):
+        yield position, item
+
+
+async def insert_chunk(request, chunk, batch):
+    """Inserts one chunk of validated (position, values) pairs, row by row if the chunk fails"""
+    if not chunk:
+        return
+    statement = db.insert(TABLE).returning(TABLE.c.id, sort_by_parameter_order=True)
+    try:
+        ids = (await write(request, statement, [values for _, values in chunk])).scalars().all()
+    except DataValidationError as err:
+        if len(chunk) > 1:
+            for item in chunk:
+                await insert_chunk(request, [item], batch)
+            return
+        batch.reject(chunk[0][0], err)
+        return
+    batch.created.extend(ids)
+    await invalidate(*ids)
+
+
+@route("/recommendations/<int:product_id>", "GET")
+async def get_recommendations(request, product_id):
+    """Retrieves a single Recommendation"""
+    statement = db.select(*Recommendation.read_columns()).where(Recommendation.id == product_id)
+    async with request.engine.connect() as connection:
+        row = (await connection.execute(statement)).first()
+    if row is None:
+        abort(status.HTTP_404_NOT_FOUND, f"Recommendation with id '{product_id}' was not found.")
+
+    [recommendation] = Recommendation.serialize_rows([row])
+    etag = Recommendation.item_etag(recommendation, row.version)
+    headers = cache_headers(request.settings, etag)
+    if request.not_modified(etag):
+        return not_modified(headers)
+    return json_response(recommendation, status.HTTP_200_OK, headers)
+
+
+@route("/recommendations/<int:product_id>", "PUT")
+async def update_recommendations(request, product_id):
+    """Updates a Recommendation"""
+    request.check_content_type("application/json")
+    return await update_recommendation(request, product_id)
+
+
+@route("/recommendations/<int:product_id>/restock", "PUT")
+async def restock_recommendations(request, product_id):
+    """Restocks a recommendation that is not in stock"""
+    statement = Recommendation.update_statement(
+        {"recommendation_in_stock": True},
+        Recommendation.id == product_id,
+        Recommendation.recommendation_in_stock.is_(False),
+    ).returning(*TABLE.columns)
+    row = (await write(request, statement)).first()
+    if row is None:
+        restock_failed(product_id, await exists(request, product_id))
+    await invalidate(product_id)
+    return json_response(Recommendation.serialize_row(row))
+
+
+@route("/recommendations/<int:product_id>/<int:recommendations_id>", "PUT")
+async def update_recommendations_id(request, product_id, recommendations_id):
+    """Links a recommendation id to an existing product"""
+    request.check_content_type("application/json")
+    return await update_recommendation(request, product_id, recommendation_id=recommendations_id)
+
+
+@route("/recommendations/<int:product_id>/<name>", "PUT")
+async def update_recommendations_name(request, product_id, name):
+    """Links a recommendation name to an existing product"""
+    request.check_content_type("application/json")
+    return await update_recommendation(request, product_id, recommendation_name=name)
+
+
+async def update_recommendation(request, product_id, **path_values):
+    """Updates a Recommendation from the request body and path in one statement and returns it"""
+    try:
+        values = update_values(await request.json(), path_values)
+    except (DataValidationError, HTTPException):
+        if not await exists(request, product_id):
+            abort(status.HTTP_404_NOT_FOUND, not_found(product_id))
+        raise
+    statement = Recommendation.update_statement(values, Recommendation.id == product_id)
+    row = (await write(request, statement.returning(*TABLE.columns))).first()
+    if row is None:
+        abort(status.HTTP_404_NOT_FOUND, not_found(product_id))
+    await invalidate(product_id)
+    return json_response(Recommendation.serialize_row(row))
+
+
+@route("/recommendations/<int:product_id>", "DELETE")
+async def delete_recommendations(request, product_id):
+    """Deletes a Recommendation"""
+    result = await write(request, db.delete(TABLE).where(TABLE.c.id == product_id))
+    if result.rowcount:
+        await invalidate(product_id)
+    return Response(b"", status.HTTP_204_NO_CONTENT, content_type=None)
+
+
+@route("/recommendations", "GET")
+async def list_recommendations(request):
+    """Returns a page of the Recommendations matching the filters, or streams them all"""
+    return await list_matching(request, parse_filters(request.args))
+
+
+@route("/recommendations/targets/<int:recommendation_id>", "GET")
+async def list_recommendations_of_target(request, recommendation_id):
+    """Returns the Recommendations that point at a product through the recommendation_id index"""
+    filters = parse_filters(request.args)
+    filters["recommendation_id"] = [recommendation_id]
+    return await list_matching(request, filters)
+
+
+@route("/recommendations/targets/<int:recommendation_id>/stock", "PUT")
+async def update_stock_of_target(request, recommendation_id):
+    """Sets the stock of every Recommendation of a product whose stock differs with one UPDATE"""
+    request.check_content_type("application/json")
+    in_stock = Recommendation.validate_stock(await request.json())
+    statement = Recommendation.stock_of_target_statement(recommendation_id, in_stock)
+    ids = (await write(request, statement)).scalars().all()
+    if ids:
+        await invalidate(*ids)
+    return json_response({"updated": len(ids)})
+
+
+@route("/products/<name>/recommendations", "GET")
+async def list_product_recommendations(request, name):
+    """Returns what a product recommends, optionally of one type
+
+    Without the in-memory adjacency index of the Flask workers, the rows
+    come from one query in the same order
+    """
+    statement = Recommendation.product_query(name, *product_args(request.args, request.settings))
+    async with request.engine.connect() as connection:
+        rows = (await connection.execute(statement)).all()
+    return Response(dumps_rows(list(Recommendation.serialize_rows(rows))) + b"\n")
+
+
+async def list_matching(request, filters):
+    """Returns a page of the Recommendations matching the filters, or streams them all"""
+    statement = db.select(*Recommendation.read_columns()).where(*Recommendation.filter_clauses(filters))
+    ndjson = request.prefers_ndjson()
+    listing = list_args(request.args, request.settings, ndjson)
+    if listing.stream:
+        return stream_recommendations(request, Recommendation.sort_query(statement, listing.sort), ndjson)
+
+    statement = Recommendation.page_query(statement, listing.limit, listing.cursor, listing.sort)
+    async with request.engine.connect() as connection:
+        rows = (await connection.execute(statement)).all()
+    page, next_cursor = Recommendation.page_rows(rows, listing.limit, listing.sort)
+    if listing.top:
+        next_cursor = None
+
+    etag = Recommendation.page_etag(page, next_cursor)
+    if request.not_modified(etag):
+        return not_modified(page_headers(request.settings, etag))
+    next_url = next_cursor and f"{request.base_url}?{urlencode(next_page_args(request.args, next_cursor))}"
+    headers = page_headers(request.settings, etag, next_cursor, next_url)
+    return Response(dumps_rows(list(Recommendation.serialize_rows(page))) + b"\n", status.HTTP_200_OK, headers)
+
+
+def stream_recommendations(request, statement, ndjson):
+    """Streams rows as newline delimited JSON or as a chunked JSON array"""
+    batch_size = request.settings["STREAM_BATCH_SIZE"]
+    encoder = StreamEncoder(ndjson, dumps_rows)
+
+    async def generate():
+        yield encoder.start()
+        async with request.engine.connect() as connection:
+            result = await connection.stream(statement.execution_options(yield_per=batch_size))
+            async for rows in result.partitions(batch_size):
+                yield encoder.encode(rows)
+        yield encoder.end()
+
+    return Response(generate(), content_type=encoder.content_type)
+
+
+@route("/recommendations", "PATCH")
+async def update_recommendations_by_filter(request):
+    """Updates every Recommendation matching the query filters with one UPDATE"""
+    request.check_content_type("application/json")
+    filters = parse_bulk_filters(request.args)
+    values = Recommendation.validate(await request.json(), partial=True)
+    count = (await write(request, Recommendation.update_statement(values, *Recommendation.filter_clauses(filters)))).rowcount
+    await invalidate(all_rows=True)
+    return json_response({"updated": count})
+
+
+@route("/recommendations", "DELETE")
+async def delete_recommendations_by_filter(request):
+    """Deletes every Recommendation matching the query filters with one DELETE"""
+    filters = parse_bulk_filters(request.args)
+    count = (await write(request, db.delete(TABLE).where(*Recommendation.filter_clauses(filters)))).rowcount
+    await invalidate(all_rows=True)
+    return json_response({"deleted": count})
+
+
+@route("/health", "GET")
+async def health(request):  # pylint: disable=unused-argument
+    """Health Status"""
+    return json_response({"status": "OK"})
+
+
+@route("/stats", "GET")
+async def service_stats(request):
+    """Runtime statistics of this worker"""
+    return json_response({"cache": cache.stats(), "pool": pool_stats(request.engine.sync_engine)})
+
+
+######################################################################
+#  A S G I   A P P L I C A T I O N
+######################################################################
+def async_url(uri):
+    """Returns a database URI that uses the async driver of its database"""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend == "sqlite" and url.get_driver_name() in ("pysqlite", "sqlite"):
+        return url.set(drivername="sqlite+aiosqlite")
+    if backend == "postgresql" and url.get_driver_name() in ("psycopg2", "psycopg"):
+        return url.set(drivername="postgresql+psycopg")
+    return url
+
+
+class RecommendationService:
+    """The ASGI application of the Recommendation service"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or {key: getattr(config, key) for key in dir(config) if key.isupper()}
+        self.engine = None
+        self._startup_lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        await self.startup()
+        request = Request(scope, receive, self)
+        try:
+            response = await dispatch(request)
+        except HTTPException as error:
+            logger.warning(str(error))
+            response = error_response(error.code, str(error))
+            if error.code == status.HTTP_405_METHOD_NOT_ALLOWED:
+                response.headers["Allow"] = ", ".join(sorted(error.valid_methods))
+        except DataValidationError as error:
+            message = error_message(error)
+            logger.warning(message)
+            response = error_response(status.HTTP_400_BAD_REQUEST, message)
+        except Exception:  # pylint: disable=broad-except
+            # the error may hold SQL and bound parameters, so it is only logged
+            logger.exception("Unhandled error in %s %s", request.method, request.path)
+            response = error_response(status.HTTP_500_INTERNAL_SERVER_ERROR, str(InternalServerError()))
+        await response.send(send)
+
+    async def startup(self):
+        """Creates the async engine and connects to the database on first use"""
+        async with self._startup_lock:
+            if self.engine is not None:
+                return
+            options = engine_options(self.settings)
+            # async engines need the asyncio version of the queue pool
+            options.pop("poolclass", None)
+            engine = create_async_engine(async_url(self.settings["SQLALCHEMY_DATABASE_URI"]), **options)
+            # fail fast on a database that cannot be reached, the tables
+            # themselves are created by "flask db-migrate"
+            async with engine.connect():
+                pass
+            cache.configure(self.settings)
+            self.engine = engine
+            logger.info("ASGI service initialized!")
+
+    async def shutdown(self):
+        """Closes every pooled connection"""
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def lifespan(self, receive, send):
+        """Handles the ASGI lifespan protocol"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as error:  # pylint: disable=broad-except
+                    logger.critical("%s: Cannot continue", error)
+                    await send({"type": "lifespan.startup.failed", "message": str(error)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
@@ -0,0 +1,417 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Adjacency Index
+
+This module keeps an in-memory index of what each product recommends, so
+that GET /products/<name>/recommendations is answered without a query.
+The rows of the table are laid out like a compressed sparse row (CSR)
+matrix: with T recommendation types, the recommendations of the p-th
+product with the t-th type are the positions offsets[p * T + t] up to
+offsets[p * T + t + 1] of flat arrays of row ids, recommended product ids,
+recommended product names (as numbers into a list of distinct names), stock
+flags and scores. Within a type they are ordered by descending score, then
+by descending id, so the best N of a type are its first N positions. Row
+ids, positions and offsets are 32-bit, as the id column is an Integer, so
+a row costs about 33 bytes.
+
+The writes of this worker only queue the ids of the rows they touch, so
+they run no extra query. The next lookup patches the products of the
+queued rows with one query, and patched products are served from a small
+overlay until the next rebuild. A full rebuild runs in a background
+thread when the index is older than ADJACENCY_REBUILD_SECONDS, which picks
+up the writes of other workers, after a bulk write, and when more than
+ADJACENCY_MAX_PATCHES products are patched. Lookups keep using the old
+index until the new one is ready, and the rows written while it was read
+are queued again once it is in place.
+
+The index is built by the first lookup, or by the warmup with
+WARMUP_ADJACENCY, and only once when lookups race to build it. A worker
+that never builds it pays nothing on writes.
+"""
+import time
+import heapq
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from flask import has_app_context
+from sqlalchemy import or_, select
+
+logger = logging.getLogger("flask.app")
+
+# stands for a missing recommended product id in the integer array
+NO_ID = -(2**63)
+# the type of the row ids, positions and offsets, see Recommendation.id
+INDEX = "i"
+
+
+def zeros(typecode: str, size: int) -> array:
+    """Returns an array of size zeros"""
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+
+class Snapshot:  # pylint: disable=too-few-public-methods
+    """The CSR arrays built from one read of the table"""
+
+    def __init__(self, rows, types):
+        """Builds the arrays from rows of Recommendation.read_columns() ordered by id"""
+        self.types = types
+        self.type_codes = {name: code for code, name in enumerate(types)}
+        self.products = {}
+        self.product_names = []
+        self.strings = []
+        # the row ids in order and the product of each row, to find where a row was
+        self.sorted_rows = array(INDEX)
+        self.row_products = array(INDEX)
+        columns = self._read(rows)
+        self._group(*columns)
+        self._order_by_score()
+
+    def _read(self, rows):
+        """Reads the rows once into flat arrays in id order"""
+        width = len(self.types)
+        keys, in_stock, target_ids, target_names, scores = array(INDEX), bytearray(), array("q"), array(INDEX), array("d")
+        strings = {}
+        for row in rows:
+            product = self.products.get(row[1])
+            if product is None:
+                product = self.products[row[1]] = len(self.product_names)
+                self.product_names.append(row[1])
+            string = strings.get(row[4])
+            if string is None:
+                string = strings[row[4]] = len(self.strings)
+                self.strings.append(row[4])
+            self.sorted_rows.append(row[0])
+            self.row_products.append(product)
+            keys.append(product * width + self.type_codes[row[3]])
+            in_stock.append(row[2])
+            target_ids.append(NO_ID if row[5] is None else row[5])
+            target_names.append(string)
+            scores.append(row[6])
+        return keys, in_stock, target_ids, target_names, scores
+
+    def _group(self, keys, in_stock, target_ids, target_names, scores):
+        """Moves the rows into product and type order with a counting sort, which keeps the id order within each"""
+        # pylint: disable=too-many-arguments
+        self.offsets = zeros(INDEX, len(self.product_names) * len(self.types) + 1)
+        for key in keys:
+            self.offsets[key + 1] += 1
+        for key in range(1, len(self.offsets)):
+            self.offsets[key] += self.offsets[key - 1]
+        size = len(keys)
+        self.row_ids = zeros(INDEX, size)
+        self.target_ids = zeros("q", size)
+        self.target_names = zeros(INDEX, size)
+        self.in_stock = bytearray(size)
+        self.scores = zeros("d", size)
+        free = self.offsets[:-1]
+        for index, key in enumerate(keys):
+            position = free[key]
+            free[key] += 1
+            self.row_ids[position] = self.sorted_rows[index]
+            self.in_stock[position] = in_stock[index]
+            self.target_ids[position] = target_ids[index]
+            self.target_names[position] = target_names[index]
+            self.scores[position] = scores[index]
+
+    def _order_by_score(self):
+        """Orders the rows of each product and type by descending score, then by descending id"""
+        scores, row_ids = self.scores, self.row_ids
+        for key in range(len(self.offsets) - 1):
+            start, end = self.offsets[key], self.offsets[key + 1]
+            if end - start < 2:
+                continue
+            order = sorted(range(start, end), key=lambda position: (-scores[position], -row_ids[position]))
+            for column in (self.row_ids, self.target_ids, self.target_names, self.scores):
+                column[start:end] = array(column.typecode, [column[position] for position in order])
+            self.in_stock[start:end] = bytes(self.in_stock[position] for position in order)
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def product_of(self, row_id):
+        """Returns the product of a row, or None if the row is not indexed"""
+        index = bisect_left(self.sorted_rows, row_id)
+        if index < len(self.sorted_rows) and self.sorted_rows[index] == row_id:
+            return self.product_names[self.row_products[index]]
+        return None
+
+    def lookup(self, name, type_code, limit, top=False):
+        """Returns the serialized recommendations of a product
+
+        The recommendations are grouped by type, or with top the best of
+        every type are merged by score.
+        """
+        product = self.products.get(name)
+        if product is None:
+            return []
+        width = len(self.types)
+        codes = range(width) if type_code is None else [type_code]
+        groups = []
+        for code in codes:
+            start = self.offsets[product * width + code]
+            end = min(self.offsets[product * width + code + 1], start + limit)
+            groups.append([(position, code) for position in range(start, end)])
+        if top:
+            entries = heapq.merge(*groups, key=lambda entry: (-self.scores[entry[0]], -self.row_ids[entry[0]]))
+        else:
+            entries = (entry for group in groups for entry in group)
+        return [self.serialize(name, position, code) for position, code in islice(entries, limit)]
+
+    def serialize(self, name, position, type_code):
+        """Returns the serialized recommendation at a position"""
+        target_id = self.target_ids[position]
+        return {
+            "id": self.row_ids[position],
+            "name": name,
+            "recommendation_in_stock": bool(self.in_stock[position]),
+            "recommendation_type": self.types[type_code],
+            "recommendation_name": self.strings[self.target_names[position]],
+            "recommendation_id": None if target_id == NO_ID else target_id,
+            "score": self.scores[position],
+        }
+
+
+class AdjacencyIndex:
+    """Answers which products a product recommends from memory"""
+
+    def __init__(self):
+        self.rebuild_seconds = 60.0
+        self.max_patches = 1000
+        self.engine = None
+        # the snapshot, the patched products and the rows moved since the build
+        self._state = None
+        self._built_at = 0.0
+        self._rebuilding = False
+        self._thread = None
+        # the rows written since the last patch, and since a build started,
+        # and whether a bulk write landed during the build
+        self._queued = set()
+        self._pending = set()
+        self._stale = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Reads the ADJACENCY_* settings of an app"""
+        self.rebuild_seconds = app.config.get("ADJACENCY_REBUILD_SECONDS", 60.0)
+        self.max_patches = app.config.get("ADJACENCY_MAX_PATCHES", 1000)
+        app.extensions["adjacency"] = self
+
+    def reset(self):
+        """Drops the index once any rebuild has finished, and the next lookup builds it again"""
+        self.join()
+        with self._lock:
+            self._state = None
+            self._queued = set()
+            self._pending = set()
+            self._stale = False
+
+    def join(self):
+        """Waits for a rebuild in progress"""
+        if self._thread is not None:
+            self._thread.join()
+
+    def lookup(self, name, recommendation_type=None, limit=10, top=False) -> list:
+        """Returns up to limit serialized recommendations of a product
+
+        Args:
+            name (str): the name of the product
+            recommendation_type (str): the type to return, or None for every type
+            limit (int): the most recommendations to return
+            top (bool): True for the highest scores of any type instead of grouping by type
+        """
+        if self._state is None:
+            with self._build_lock:
+                # the lookups that waited for another one to build skip it
+                if self._state is None:
+                    self._build()
+        elif time.monotonic() - self._built_at > self.rebuild_seconds or len(self._state[1]) > self.max_patches:
+            self.rebuild_in_background()
+        if self._queued:
+            self.patch()
+        snapshot, patches, _ = self._state
+        type_code = None if recommendation_type is None else snapshot.type_codes[recommendation_type]
+        if name not in patches:
+            return snapshot.lookup(name, type_code, limit, top)
+        results = patches[name]
+        if recommendation_type is not None:
+            results = [entry for entry in results if entry["recommendation_type"] == recommendation_type]
+        if top:
+            results = sorted(results, key=lambda entry: (-entry["score"], -entry["id"]))
+        return results[:limit]
+
+    def stats(self) -> dict:
+        """Returns the size and age of the index"""
+        if self._state is None:
+            return {"built": False}
+        snapshot, patches, _ = self._state
+        return {
+            "built": True,
+            "products": len(snapshot.products),
+            "recommendations": len(snapshot),
+            "patched_products": len(patches),
+            "queued_rows": len(self._queued),
+            "age_seconds": time.monotonic() - self._built_at,
+        }
+
+    ##################################################
+    # Building and refreshing
+    ##################################################
+
+    def build(self):
+        """Reads the whole table and replaces the index"""
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        # pylint: disable=import-outside-toplevel
+        from service.models import db, EnumRecommendationType
+
+        if self.engine is None or has_app_context():
+            self.engine = db.engine
+        start = time.perf_counter()
+        with self._lock:
+            self._rebuilding = True
+        try:
+            snapshot = Snapshot(stream_rows(self.engine), [member.name for member in EnumRecommendationType])
+        except Exception:
+            with self._lock:
+                self._rebuilding = False
+            raise
+        with self._lock:
+            # writes that raced with the read of the table are patched again,
+            # and a bulk write that did makes the next lookup rebuild
+            self._queued |= self._pending
+            self._pending = set()
+            self._state = (snapshot, {}, {})
+            self._built_at = 0.0 if self._stale else time.monotonic()
+            self._stale = False
+            self._rebuilding = False
+        logger.info(
+            "Indexed %d recommendations of %d products in %.0f ms",
+            len(snapshot),
+            len(snapshot.products),
+            (time.perf_counter() - start) * 1000,
+        )
+
+    def rebuild_in_background(self):
+        """Starts a rebuild unless one is running"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        self._thread = threading.Thread(target=self._rebuild, daemon=True)
+        self._thread.start()
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Rebuilding the adjacency index failed: %s", error)
+
+    def changed(self, *ids, all_rows=False):
+        """Queues the rows that were written for the next lookup to patch
+
+        Args:
+            ids (int): the ids of the Recommendations that changed
+            all_rows (bool): True when a bulk write may have changed any row
+        """
+        with self._lock:
+            if self._rebuilding:
+                # the build in progress, the first one included, may have
+                # read the table before the write
+                self._pending.update(ids)
+                self._stale = self._stale or all_rows
+            if self._state is None:
+                return
+            self._queued.update(ids)
+        if all_rows:
+            # the built_at of 0 keeps rebuilding until one succeeds
+            self._built_at = 0.0
+            self.rebuild_in_background()
+
+    def patch(self):
+        """Reloads the products of the queued rows into the overlay"""
+        with self._lock:
+            ids, self._queued = self._queued, set()
+            snapshot, _, moved = self._state
+        if not ids:
+            return
+        old_names = {moved[row_id] if row_id in moved else snapshot.product_of(row_id) for row_id in ids}
+        old_names.discard(None)
+        try:
+            rows = load_rows(self.engine, ids, old_names)
+        except Exception:
+            with self._lock:
+                self._queued |= ids
+            raise
+        products = {}
+        for row in rows:
+            products.setdefault(row[1], []).append(row)
+        where = {row[0]: row[1] for row in rows}
+        with self._lock:
+            if self._state[0] is not snapshot:
+                # a rebuild replaced the snapshot, and queued again what it missed
+                return
+            _, patches, moved = self._state
+            patches, moved = dict(patches), dict(moved)
+            for name in old_names | set(products):
+                patches[name] = serialize(products.get(name, []), snapshot.type_codes)
+            for row_id in ids:
+                moved[row_id] = where.get(row_id)
+            self._state = (snapshot, patches, moved)
+
+
+def read_statement():
+    """Returns the query of the rows to index in id order"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Recommendation
+
+    return select(*Recommendation.read_columns()).order_by(Recommendation.id)
+
+
+def stream_rows(engine, batch_size=10000):
+    """Yields every row to index, fetching batch_size at a time"""
+    with engine.connect() as connection:
+        yield from connection.execution_options(yield_per=batch_size).execute(read_statement())
+
+
+def load_rows(engine, ids, names) -> list:
+    """Returns the rows of the products of some rows, and of some more products"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Recommendation
+
+    touched = select(Recommendation.name).where(Recommendation.id.in_(ids))
+    statement = read_statement().where(or_(Recommendation.name.in_(touched), Recommendation.name.in_(names)))
+    with engine.connect() as connection:
+        return connection.execute(statement).all()
+
+
+def serialize(rows, type_codes) -> list:
+    """Returns the serialized rows of a patched product in index order"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Recommendation
+
+    ordered = sorted(rows, key=lambda row: (type_codes[row[3]], -row[6], -row[0]))
+    return list(Recommendation.serialize_rows(ordered))
+
+
+# The index to be initialized later in create_app()
+adjacency = AdjacencyIndex()
@@ -0,0 +1,239 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Cache
+
+This module contains the cache that sits in front of the database for
+hot reads. The backend is chosen by the CACHE_BACKEND setting:
+
+memory - an LRU cache with a TTL that lives in each worker process
+redis  - a Redis server shared by every worker (needs the redis extra)
+none   - caching is disabled
+
+Every backend stores bytes, so values look the same whichever backend
+is configured. Backends also keep named counters, which are never
+evicted or cleared, for versioning whole groups of entries.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class NullCache:
+    """A cache that never holds anything"""
+
+    def get(self, key):  # pylint: disable=unused-argument
+        """Returns None for every key"""
+        return None
+
+    def set(self, key, value):
+        """Discards the value"""
+
+    def delete(self, *keys):
+        """Does nothing"""
+
+    def clear(self):
+        """Does nothing"""
+
+    def counter(self, name):  # pylint: disable=unused-argument
+        """Returns 0 for every counter"""
+        return 0
+
+    def incr(self, name):
+        """Does nothing"""
+
+
+class LRUCache:
+    """An in-process least recently used cache whose entries expire after a TTL"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value of a key, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Stores a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        """Removes keys from the cache"""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def counter(self, name):
+        """Returns the value of a counter"""
+        return self._counters.get(name, 0)
+
+    def incr(self, name):
+        """Adds one to a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """A cache stored in Redis and shared by every worker process"""
+
+    def __init__(self, client, ttl: float = 60, prefix: str = "recommendations:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        # kept outside the prefix so that clear() never resets a counter
+        self.counter_prefix = prefix.rstrip(":") + "-counters:"
+
+    def get(self, key):
+        """Returns the value of a key, or None if it is missing or expired"""
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        """Stores a value that Redis will expire after the TTL"""
+        self.client.set(self.prefix + key, value, ex=max(1, int(self.ttl)))
+
+    def delete(self, *keys):
+        """Removes keys from the cache"""
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        """Removes every entry under this cache's prefix"""
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        for start in range(0, len(keys), 500):
+            self.client.delete(*keys[start:start + 500])
+
+    def counter(self, name):
+        """Returns the value of a counter"""
+        return int(self.client.get(self.counter_prefix + name) or 0)
+
+    def incr(self, name):
+        """Adds one to a counter"""
+        self.client.incr(self.counter_prefix + name)
+
+
+class Cache:
+    """Fronts the configured cache backend and counts hits and misses"""
+
+    def __init__(self):
+        self.backend = NullCache()
+        self.hits = 0
+        self.misses = 0
+        # called with True or False after every lookup, see metrics.py
+        self.on_lookup = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Creates the backend named by the CACHE_BACKEND setting of an app"""
+        self.configure(app.config)
+        app.extensions["cache"] = self
+
+    def configure(self, settings):
+        """Creates the backend named by the CACHE_BACKEND setting"""
+        name = settings.get("CACHE_BACKEND", "memory")
+        ttl = settings.get("CACHE_TTL", 60)
+        if name == "memory":
+            self.backend = LRUCache(settings.get("CACHE_MAX_ENTRIES", 10000), ttl)
+        elif name == "redis":
+            try:
+                import redis  # pylint: disable=import-outside-toplevel
+            except ImportError as error:
+                raise ImportError("CACHE_BACKEND=redis needs the redis package: poetry install --extras redis") from error
+
+            client = redis.Redis.from_url(settings["CACHE_REDIS_URL"])
+            self.backend = RedisCache(client, ttl)
+        elif name == "none":
+            self.backend = NullCache()
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND: {name}")
+        self.reset_stats()
+
+    def get(self, key):
+        """Returns the value of a key and counts the hit or miss"""
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if self.on_lookup:
+            self.on_lookup(value is not None)
+        return value
+
+    def set(self, key, value):
+        """Stores a value"""
+        self.backend.set(key, value)
+
+    def delete(self, *keys):
+        """Removes keys from the cache"""
+        self.backend.delete(*keys)
+
+    def clear(self):
+        """Removes every entry"""
+        self.backend.clear()
+
+    def counter(self, name):
+        """Returns the value of a counter"""
+        return self.backend.counter(name)
+
+    def incr(self, name):
+        """Adds one to a counter"""
+        self.backend.incr(name)
+
+    def reset_stats(self):
+        """Zeroes the hit and miss counters"""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of this worker"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# The cache to be initialized later in create_app()
+cache = Cache()
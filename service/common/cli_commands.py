@@ -16,8 +16,11 @@
 """
 Flask CLI Command Extensions
 """
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from service.models import db, DataValidationError, Recommendation
+from service.common import cooccurrence
+from service.common.migrations import upgrade_schema
 
 
 ######################################################################
@@ -34,3 +37,66 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to compute cross-sell recommendations from order history
+# Usage:
+#   flask cross-sell-build orders.csv --metric lift --top-k 10
+######################################################################
+@app.cli.command("cross-sell-build")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]),
+              help="File format [default: from the extension]")
+@click.option("--metric", type=click.Choice(cooccurrence.METRICS), default="lift", show_default=True, help="Pair score")
+@click.option("--top-k", default=10, show_default=True, help="Recommendations per product")
+@click.option("--min-count", default=2, show_default=True, help="Orders a pair must share")
+@click.option("--max-basket", default=100, show_default=True, help="Largest order to count")
+@click.option("--chunk-size", default=100000, show_default=True, help="Order lines counted at a time")
+@click.option("--columns", default="order_id,product_name,product_id", show_default=True,
+              help="Order, product name and product id columns")
+@click.option("--in-stock/--out-of-stock", default=True, help="Stock of new recommendations")
+def cross_sell_build(path, file_format, **options):
+    """
+    Scores the products bought together in a file of order lines and
+    upserts the top K of each product as CROSS_SELL recommendations.
+    """
+    if not cooccurrence.available():
+        raise click.ClickException("cross-sell-build needs NumPy and SciPy: poetry install --extras cross-sell")
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    columns = tuple(options["columns"].split(","))
+    if len(columns) != 3:
+        raise click.BadParameter("expected three comma separated column names", param_hint="--columns")
+    try:
+        lines = cooccurrence.read_order_lines(path, file_format, columns)
+        counts = cooccurrence.CooccurrenceCounts(options["max_basket"]).count(lines, options["chunk_size"])
+    except DataValidationError as error:
+        raise click.ClickException(str(error)) from error
+    click.echo(
+        f"Counted {counts.lines} lines in {counts.orders} orders of {len(counts.names)} products "
+        f"({counts.skipped} orders over --max-basket skipped)"
+    )
+    created = updated = 0
+    for rows in counts.recommendations(
+        in_stock=options["in_stock"], metric=options["metric"], top_k=options["top_k"], min_count=options["min_count"]
+    ):
+        new, changed = Recommendation.upsert_many(rows)
+        created, updated = created + new, updated + changed
+    click.echo(f"Created {created} and updated {updated} CROSS_SELL recommendations")
+
+
+######################################################################
+# Command to upgrade the tables in place
+# Usage:
+#   flask db-migrate
+######################################################################
+@app.cli.command("db-migrate")
+def db_migrate():
+    """
+    Adds any missing tables, columns and indexes without dropping data.
+    Safe to run against a live database.
+    """
+    changes = upgrade_schema(db.engine, db.metadata)
+    for change in changes:
+        click.echo(change)
+    click.echo(f"Schema is up to date ({len(changes)} changes applied)")
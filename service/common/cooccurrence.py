@@ -0,0 +1,199 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Co-occurrence Recommendations
+
+This module turns order history into CROSS_SELL recommendations. The order
+lines are read from a CSV or NDJSON file a chunk at a time, each chunk of
+orders becomes a sparse order x product matrix X of ones, and X.T @ X is
+added to a sparse product x product matrix of how many orders hold both
+products. Its diagonal is how many orders hold each product. Memory grows
+with the products and the pairs bought together, not with the lines.
+
+The lines of an order are expected next to each other, as order exports
+list them, and an order is only counted once its last line has been read,
+so orders are never split between chunks. Orders of more than max_basket
+products are skipped, since their pairs grow with the square of their size
+and say little about any one pair.
+
+Each pair bought together in at least min_count orders is scored by lift,
+how much more often the products are bought together than if they were
+bought independently, or by PMI, the log of the lift:
+
+    lift(a, b) = orders(a, b) * orders / (orders(a) * orders(b))
+
+and the top K of each product are kept. Scoring works on blocks of rows of
+the matrix with array operations rather than one pair at a time.
+
+NumPy and SciPy are only needed by this job, and it refuses to run
+without them.
+"""
+import csv
+import json
+import logging
+from service.models import DataValidationError, EnumRecommendationType
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover
+    np = None  # pylint: disable=invalid-name
+    sparse = None  # pylint: disable=invalid-name
+
+logger = logging.getLogger("flask.app")
+
+METRICS = ("lift", "pmi")
+
+
+def available() -> bool:
+    """True when NumPy and SciPy are installed"""
+    return sparse is not None
+
+
+def read_order_lines(path, file_format, columns):
+    """Yields the order, product name and product id of each line of a file
+
+    Args:
+        path (str): the CSV or NDJSON file to read
+        file_format (str): "csv" or "ndjson"
+        columns (tuple): the names of the order, product name and product id columns
+    """
+    order_column, name_column, id_column = columns
+    with open(path, encoding="utf-8", newline="") as file:
+        if file_format == "csv":
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+        for number, record in enumerate(records, 1):
+            try:
+                product_id = record.get(id_column)
+                yield str(record[order_column]), str(record[name_column]), (
+                    None if product_id in (None, "") else int(product_id)
+                )
+            except (KeyError, TypeError, ValueError, AttributeError) as error:
+                raise DataValidationError(f"Invalid order line {number}: {error}") from error
+
+
+class CooccurrenceCounts:
+    """Counts how many orders hold each product and each pair of products"""
+
+    def __init__(self, max_basket: int = 100):
+        self.max_basket = max_basket
+        self.products = {}
+        self.names = []
+        self.product_ids = {}
+        self.lines = 0
+        self.orders = 0
+        self.skipped = 0
+        self.pairs = None
+
+    def count(self, lines, chunk_size: int = 100000):
+        """Counts the orders of (order, name, product id) lines in chunks of about chunk_size lines"""
+        baskets, basket, current, size = [], set(), None, 0
+        for order, name, product_id in lines:
+            self.lines += 1
+            if order != current:
+                baskets.append(basket)
+                size += len(basket)
+                basket, current = set(), order
+                if size >= chunk_size:
+                    self.add_baskets(baskets)
+                    baskets, size = [], 0
+            basket.add(self.index(name, product_id))
+        baskets.append(basket)
+        self.add_baskets(baskets)
+        logger.info("Counted %d lines in %d orders of %d products", self.lines, self.orders, len(self.names))
+        return self
+
+    def index(self, name, product_id) -> int:
+        """Returns the index of a product, adding it when it is new"""
+        index = self.products.get(name)
+        if index is None:
+            index = self.products[name] = len(self.names)
+            self.names.append(name)
+        if product_id is not None:
+            self.product_ids[name] = product_id
+        return index
+
+    def add_baskets(self, baskets):
+        """Adds the products of each order of a chunk to the counts"""
+        kept = [basket for basket in baskets if 0 < len(basket) <= self.max_basket]
+        self.skipped += sum(1 for basket in baskets if len(basket) > self.max_basket)
+        self.orders += len(kept)
+        size = len(self.names)
+        if self.pairs is None:
+            self.pairs = sparse.csr_matrix((size, size), dtype=np.int32)
+        elif self.pairs.shape[0] < size:
+            self.pairs.resize((size, size))
+        if not kept:
+            return
+        rows = np.repeat(np.arange(len(kept)), [len(basket) for basket in kept])
+        products = np.fromiter((index for basket in kept for index in basket), dtype=np.int64, count=len(rows))
+        orders = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, products)), shape=(len(kept), size))
+        self.pairs = self.pairs + (orders.T @ orders).tocsr()
+
+    def top_neighbors(self, metric: str = "lift", top_k: int = 10, min_count: int = 2, block_size: int = 10000):
+        """Yields arrays of products, neighbors and scores for blocks of products
+
+        Args:
+            metric (str): "lift" or "pmi"
+            top_k (int): the most neighbors to keep per product
+            min_count (int): the fewest orders a pair must share to be scored
+            block_size (int): the products scored at a time
+        """
+        singles = self.pairs.diagonal().astype(np.float64)
+        for start in range(0, self.pairs.shape[0], block_size):
+            block = self.pairs[start:start + block_size]
+            products = np.repeat(np.arange(start, start + block.shape[0]), np.diff(block.indptr))
+            # the diagonal counts the orders of one product, not a pair
+            keep = (block.data >= min_count) & (block.indices != products)
+            products, neighbors, counts = products[keep], block.indices[keep], block.data[keep]
+            scores = counts * float(self.orders) / (singles[products] * singles[neighbors])
+            if metric == "pmi":
+                scores = np.log(scores)
+            # sort by product, best score first, and keep the first top_k of each product
+            order = np.lexsort((neighbors, -scores, products))
+            products, neighbors, scores = products[order], neighbors[order], scores[order]
+            firsts = np.flatnonzero(np.r_[True, products[1:] != products[:-1]])
+            ranks = np.arange(len(products)) - np.repeat(firsts, np.diff(np.r_[firsts, len(products)]))
+            keep = ranks < top_k
+            yield products[keep], neighbors[keep], scores[keep]
+
+    def recommendations(self, in_stock: bool = True, batch_size: int = 1000, **options):
+        """Yields lists of at most batch_size CROSS_SELL Recommendation values
+
+        Args:
+            in_stock (bool): the stock of new Recommendations
+            batch_size (int): the most values per list
+            options: the arguments of top_neighbors
+        """
+        for products, neighbors, scores in self.top_neighbors(**options):
+            for start in range(0, len(products), batch_size):
+                end = start + batch_size
+                yield [
+                    {
+                        "name": self.names[product],
+                        "recommendation_type": EnumRecommendationType.CROSS_SELL,
+                        "recommendation_name": self.names[neighbor],
+                        "recommendation_id": self.product_ids.get(self.names[neighbor]),
+                        "recommendation_in_stock": in_stock,
+                        "score": score,
+                    }
+                    for product, neighbor, score in zip(
+                        products[start:end].tolist(), neighbors[start:end].tolist(), scores[start:end].tolist()
+                    )
+                ]
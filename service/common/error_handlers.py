@@ -20,6 +20,7 @@ from flask import jsonify
 from flask import current_app as app  # Import Flask application
 from service.models import DataValidationError
 from . import status
+from .handlers import error_message
 
 
 ######################################################################
@@ -28,7 +29,7 @@ from . import status
 @app.errorhandler(DataValidationError)
 def request_validation_error(error):
     """Handles Value Errors from bad data"""
-    return bad_request(error)
+    return bad_request(error_message(error))
 
 
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,234 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Handling
+
+This module holds what the Flask routes and the ASGI app decide about a
+request apart from reading and writing the database: which arguments a
+list takes, the headers of a page, how a batch is chunked and reported,
+how a stream is encoded, and which error a failed update or restock is.
+Each app only runs the statements, sync or async, so both answer the
+same way and a change to a handler is made once.
+"""
+import logging
+from typing import NamedTuple, Optional
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import abort
+from service.models import Recommendation, DataValidationError, EnumRecommendationType
+from service.common import status
+from service.common.query_args import parse_page_size, parse_top, wants_stream
+
+logger = logging.getLogger("flask.app")
+
+NDJSON = "application/x-ndjson"
+
+
+######################################################################
+#  E R R O R S
+######################################################################
+def error_message(error: DataValidationError) -> str:
+    """Returns the message of a DataValidationError that a client may see
+
+    A database error holds the SQL and its bound parameters, so it is only
+    logged and the client is told that the database rejected the request.
+    """
+    if isinstance(error.__cause__, SQLAlchemyError):
+        logger.warning("Rejected by the database: %s", error.__cause__)
+        return Recommendation.REJECTED
+    return str(error)
+
+
+def not_found(product_id: int) -> str:
+    """Returns the message of an update of a Recommendation that does not exist"""
+    return f"Recommendation with id: '{product_id}' was not found."
+
+
+######################################################################
+#  U P D A T E S
+######################################################################
+def update_values(body, path_values: dict) -> dict:
+    """Returns the validated column values of a PUT from its body and path
+
+    The caller reports a missing Recommendation before any error raised
+    here, as when it was read first, and only a bad request pays for the
+    lookup that tells them apart.
+    """
+    values = Recommendation.validate(body)
+    if path_values:
+        values.update(Recommendation.validate(path_values, partial=True))
+    return values
+
+
+def restock_failed(product_id: int, exists: bool):
+    """Aborts a restock that changed no row, with 404 or 409 when it was already in stock"""
+    if not exists:
+        abort(status.HTTP_404_NOT_FOUND, f"Product with id '{product_id}' was not found.")
+    abort(status.HTTP_409_CONFLICT, f"Recommendation for id '{product_id}' is already in stock.")
+
+
+######################################################################
+#  L I S T S
+######################################################################
+class ListArgs(NamedTuple):
+    """How a list request is answered, from its query parameters"""
+
+    sort: str
+    limit: Optional[int]
+    cursor: Optional[str]
+    top: Optional[int]
+    stream: bool
+
+
+def list_args(args, settings, ndjson: bool) -> ListArgs:
+    """Returns the sort, page and streaming of a list request
+
+    top asks for the highest scoring rows, which are the first page sorted
+    by descending score, and otherwise NDJSON or stream=true stream every
+    row so that no page size applies.
+    """
+    top = parse_top(args, settings["PAGE_SIZE_MAX"])
+    cursor = args.get("cursor")
+    if top is not None:
+        return ListArgs("-score", top, cursor, top, False)
+    sort = args.get("sort", "id")
+    if ndjson or wants_stream(args):
+        return ListArgs(sort, None, cursor, None, True)
+    limit = parse_page_size(args, settings["PAGE_SIZE_DEFAULT"], settings["PAGE_SIZE_MAX"])
+    return ListArgs(sort, limit, cursor, None, False)
+
+
+def product_args(args, settings) -> tuple:
+    """Returns the (recommendation_type, limit, by_score) of a product's recommendations"""
+    recommendation_type = args.get("type")
+    if recommendation_type is not None and recommendation_type not in EnumRecommendationType.__members__:
+        raise DataValidationError(f"Invalid recommendation type: {recommendation_type}")
+    top = parse_top(args, settings["PAGE_SIZE_MAX"])
+    limit = top or parse_page_size(args, settings["PAGE_SIZE_DEFAULT"], settings["PAGE_SIZE_MAX"])
+    return recommendation_type, limit, top is not None
+
+
+def cache_headers(settings, etag: str) -> dict:
+    """Returns the ETag and Cache-Control headers of a response"""
+    max_age = settings["HTTP_CACHE_MAX_AGE"]
+    return {
+        "ETag": f'"{etag}"',
+        # no-cache lets clients store the response but makes them revalidate it
+        "Cache-Control": f"public, max-age={max_age}" if max_age > 0 else "no-cache",
+    }
+
+
+def page_headers(settings, etag: str, next_cursor: str = None, next_url: str = None) -> dict:
+    """Returns the headers of a page, with a link to the next page when there is one"""
+    headers = cache_headers(settings, etag)
+    headers["Vary"] = "Accept"
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return headers
+
+
+def next_page_args(args, next_cursor: str) -> dict:
+    """Returns the query parameters of the page after a cursor"""
+    next_args = args.to_dict()
+    next_args["cursor"] = next_cursor
+    return next_args
+
+
+class StreamEncoder:
+    """Encodes batches of rows as newline delimited JSON or as one JSON array
+
+    Each batch is encoded as it comes off the database cursor, so a stream
+    never holds the full result.
+    """
+
+    def __init__(self, ndjson: bool, dumps_rows):
+        self.ndjson = ndjson
+        self.count = 0
+        self._dumps_rows = dumps_rows
+
+    @property
+    def content_type(self) -> str:
+        """The media type of the stream"""
+        return NDJSON if self.ndjson else "application/json"
+
+    def start(self) -> bytes:
+        """Returns what the stream begins with"""
+        return b"" if self.ndjson else b"["
+
+    def encode(self, rows) -> bytes:
+        """Returns a batch of rows from select_rows() encoded"""
+        items = [self._dumps_rows(item) for item in Recommendation.serialize_rows(rows)]
+        if not items:
+            return b""
+        if self.ndjson:
+            chunk = b"".join(item + b"\n" for item in items)
+        else:
+            chunk = (b"," if self.count else b"") + b",".join(items)
+        self.count += len(items)
+        return chunk
+
+    def end(self) -> bytes:
+        """Returns what the stream ends with"""
+        logger.info("Streamed %d recommendations", self.count)
+        return b"" if self.ndjson else b"]"
+
+
+######################################################################
+#  B A T C H E S
+######################################################################
+class Batch:
+    """The items of a batch request, validated into chunks, and its results
+
+    The app inserts each chunk with a multi-row INSERT, and when the INSERT
+    fails inserts its rows one at a time so that only the rows the database
+    rejects are reported.
+    """
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.created = []
+        self.errors = []
+        self._chunk = []
+
+    def add(self, position: int, item) -> list:
+        """Validates an item and returns the chunk to insert once it is full"""
+        try:
+            self._chunk.append((position, Recommendation.validate(item)))
+        except DataValidationError as err:
+            self.errors.append({"index": position, "error": str(err)})
+        if len(self._chunk) < self.chunk_size:
+            return []
+        return self.rest()
+
+    def rest(self) -> list:
+        """Returns the validated items that are not inserted yet"""
+        chunk, self._chunk = self._chunk, []
+        return chunk
+
+    def reject(self, position: int, error):
+        """Reports an item that the database rejected"""
+        # the database error holds SQL and parameters, so it is only logged
+        logger.warning("Batch item %d was rejected: %s", position, error)
+        self.errors.append({"index": position, "error": Recommendation.REJECTED})
+
+    def result(self) -> tuple:
+        """Returns the (message, status) of the batch"""
+        logger.info("Batch created %d Recommendations with %d errors", len(self.created), len(self.errors))
+        message = {"created": self.created, "errors": sorted(self.errors, key=lambda err: err["index"])}
+        if self.errors and not self.created:
+            return message, status.HTTP_400_BAD_REQUEST
+        return message, status.HTTP_201_CREATED
@@ -0,0 +1,134 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+JSON Providers
+
+This module contains the JSON providers that jsonify, view return values,
+the error handlers and the list endpoints encode with. The provider is
+chosen by the JSON_PROVIDER setting:
+
+auto   - orjson when it is installed, otherwise the standard library
+orjson - orjson, which encodes several times faster (needs the orjson package)
+stdlib - the standard library json module
+
+Both providers encode Enum members by their name, as serialized
+Recommendations spell their type, so the output does not change with the
+provider. orjson encodes Enum members by value before it ever calls a
+default function, so the orjson provider swaps them for their names first.
+That walk costs more than the encoding itself, so dumps_rows skips it for
+serialized rows, which never hold an Enum.
+"""
+import json
+from enum import Enum
+from flask.json.provider import JSONProvider, DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # pylint: disable=invalid-name
+
+
+def default(obj):
+    """Encodes the types that json does not know, like Flask does, plus Enums"""
+    if isinstance(obj, Enum):
+        return obj.name
+    return DefaultJSONProvider.default(obj)
+
+
+def enum_names(obj):
+    """Returns the data with every Enum member in it replaced by its name"""
+    if isinstance(obj, Enum):
+        return obj.name
+    if isinstance(obj, dict):
+        return {key: enum_names(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [enum_names(value) for value in obj]
+    return obj
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, with Enums encoded by name"""
+
+    default = staticmethod(default)
+
+    def dumps_bytes(self, obj):
+        """Serializes data as UTF-8 encoded JSON"""
+        return self.dumps(obj).encode("utf-8")
+
+    def dumps_rows(self, rows):
+        """Serializes serialized rows as UTF-8 encoded JSON"""
+        return self.dumps_bytes(rows)
+
+
+class OrjsonProvider(JSONProvider):
+    """A JSON provider that encodes and decodes with orjson"""
+
+    mimetype = "application/json"
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        """Serializes data as a JSON string, ignoring json.dumps arguments"""
+        return self.dumps_bytes(obj).decode("utf-8")
+
+    def dumps_bytes(self, obj):
+        """Serializes data as UTF-8 encoded JSON"""
+        return orjson.dumps(enum_names(obj), default=default, option=self.option)
+
+    def dumps_rows(self, rows):
+        """Serializes serialized rows, which hold no Enums, as UTF-8 encoded JSON"""
+        return orjson.dumps(rows, default=default, option=self.option)
+
+    def loads(self, s, **kwargs):
+        """Deserializes data from a JSON string or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Returns a response with the arguments serialized as compact JSON"""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+
+def dumps_bytes(obj) -> bytes:
+    """Serializes data as compact UTF-8 encoded JSON outside of a Flask app"""
+    return dumps_rows(enum_names(obj) if orjson else obj)
+
+
+def dumps_rows(rows) -> bytes:
+    """Serializes serialized rows, which hold no Enums, as compact JSON outside of a Flask app"""
+    if orjson:
+        return orjson.dumps(rows, default=default, option=OrjsonProvider.option)
+    return json.dumps(rows, default=default, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    """Deserializes JSON outside of a Flask app"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def init_app(app):
+    """Installs the JSON provider named by the JSON_PROVIDER setting"""
+    name = app.config.get("JSON_PROVIDER", "auto")
+    if name == "auto":
+        name = "orjson" if orjson else "stdlib"
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("JSON_PROVIDER is orjson but the orjson package is not installed")
+        app.json = OrjsonProvider(app)
+    elif name == "stdlib":
+        app.json = StdlibJSONProvider(app)
+    else:
+        raise ValueError(f"Unknown JSON_PROVIDER: {name}")
@@ -18,19 +18,142 @@
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. The app logger writes through the gunicorn handlers, and
+three settings change how:
+
+LOG_QUEUE    - when true, records are put on a queue and a background
+               thread formats and writes them, off the request thread
+LOG_FORMAT   - text (default) or json, one JSON object per line
+LOG_SAMPLING - comma separated logger=rate pairs, like service=0.1, that
+               keep that share of the INFO and DEBUG records of a logger
+               and its children; warnings and errors are always kept
 """
+import json
+import queue
+import atexit
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as a JSON object on one line"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in every N INFO and DEBUG records of the sampled loggers"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        # the longest name first, so that a child's rate beats its parent's
+        self.every = sorted(
+            ((name, max(1, round(1 / rate)) if rate > 0 else 0) for name, rate in rates.items()),
+            key=lambda item: -len(item[0]),
+        )
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        for name, every in self.every:
+            if record.name == name or record.name.startswith(name + "."):
+                if not every:
+                    return False
+                with self._lock:
+                    count = self.counts.get(name, 0)
+                    self.counts[name] = count + 1
+                return count % every == 0
+        return True
+
+
+class LocalQueueHandler(QueueHandler):
+    """Puts records on an in-process queue without formatting them first"""
+
+    def emit(self, record):
+        # QueueHandler.prepare() formats the record so that it can be pickled,
+        # which an in-process queue does not need, so the listener does it
+        try:
+            self.enqueue(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
+    stop_listener(app)
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
+    handlers = list(gunicorn_logger.handlers)
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    formatter = make_formatter(app.config.get("LOG_FORMAT", "text"))
+    for handler in handlers:
         handler.setFormatter(formatter)
+    if app.config.get("LOG_QUEUE"):
+        handler = LocalQueueHandler(queue.SimpleQueue())
+        app.extensions["log_listener"] = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+        app.extensions["log_listener"].start()
+        atexit.register(stop_listener, app)
+        handlers = [handler]
+    rates = parse_rates(app.config.get("LOG_SAMPLING", ""))
+    if rates:
+        sampling = SamplingFilter(rates)
+        for handler in handlers:
+            handler.addFilter(sampling)
+    app.logger.handlers = handlers
     app.logger.info("Logging handler established")
+
+
+def make_formatter(name: str) -> logging.Formatter:
+    """Returns the formatter named by the LOG_FORMAT setting"""
+    if name == "json":
+        return JSONFormatter()
+    if name == "text":
+        return logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    raise ValueError(f"Unknown LOG_FORMAT: {name}")
+
+
+def parse_rates(setting: str) -> dict:
+    """Returns the sampling rates of a LOG_SAMPLING setting like service=0.1"""
+    rates = {}
+    for pair in setting.replace(",", " ").split():
+        name, _, rate = pair.partition("=")
+        rates[name] = float(rate)
+    return rates
+
+
+def restart_listener(app):
+    """Starts the queue listener again in a forked worker, which inherits no threads"""
+    listener = app.extensions.get("log_listener")
+    if listener is None:
+        return
+    # the master's queue may have been locked at the moment of the fork
+    records = queue.SimpleQueue()
+    for handler in app.logger.handlers:
+        if isinstance(handler, QueueHandler):
+            handler.queue = records
+    app.extensions["log_listener"] = QueueListener(records, *listener.handlers, respect_handler_level=True)
+    app.extensions["log_listener"].start()
+
+
+def stop_listener(app):
+    """Writes out the queued records and stops the queue listener"""
+    listener = app.extensions.pop("log_listener", None)
+    if listener is not None:
+        listener.stop()
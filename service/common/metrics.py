@@ -0,0 +1,153 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Metrics
+
+This module collects the Prometheus metrics served by GET /metrics:
+
+http_requests_total              - requests by method, route and status
+http_request_duration_seconds    - request latency by method, route and status
+http_requests_in_progress        - requests being served by method and route
+db_query_duration_seconds        - SQL statement latency, whose count is the queries
+cache_lookups_total              - read-through cache lookups by hit or miss
+
+Routes are labelled with their URL rule, like /recommendations/<int:product_id>,
+so that the label values stay few. The metrics need the prometheus_client
+package and are off without it.
+
+Under gunicorn every worker has its own process, so the values are kept in
+the files of the PROMETHEUS_MULTIPROC_DIR directory, which gunicorn.conf.py
+sets, and /metrics adds up the files of all the workers.
+"""
+import os
+import time
+import logging
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service.common.cache import cache
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # pragma: no cover
+    prometheus_client = None  # pylint: disable=invalid-name
+
+logger = logging.getLogger("flask.app")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """Records the request, database and cache metrics of the service"""
+
+    def __init__(self):
+        self.enabled = prometheus_client is not None
+        if not self.enabled:  # pragma: no cover
+            return
+        self.requests = prometheus_client.Counter(
+            "http_requests_total", "HTTP requests", ["method", "route", "status"]
+        )
+        self.latency = prometheus_client.Histogram(
+            "http_request_duration_seconds",
+            "HTTP request latency",
+            ["method", "route", "status"],
+            buckets=LATENCY_BUCKETS,
+        )
+        self.in_progress = prometheus_client.Gauge(
+            "http_requests_in_progress",
+            "HTTP requests being served",
+            ["method", "route"],
+            multiprocess_mode="livesum",
+        )
+        self.queries = prometheus_client.Histogram(
+            "db_query_duration_seconds", "SQL statement latency", buckets=LATENCY_BUCKETS
+        )
+        self.cache_lookups = prometheus_client.Counter(
+            "cache_lookups_total", "Read-through cache lookups", ["result"]
+        )
+
+    def init_app(self, app):
+        """Starts recording the requests of an app and every database query"""
+        app.extensions["metrics"] = self
+        if not self.enabled:  # pragma: no cover
+            logger.warning("prometheus_client is not installed: /metrics is disabled")
+            return
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.end_request)
+        cache.on_lookup = self.cache_lookup
+        if not event.contains(Engine, "before_cursor_execute", start_query):
+            event.listen(Engine, "before_cursor_execute", start_query)
+            event.listen(Engine, "after_cursor_execute", self.finish_query)
+
+    @staticmethod
+    def route():
+        """Returns the URL rule of the current request"""
+        return request.url_rule.rule if request.url_rule else "<unmatched>"
+
+    def start_request(self):
+        """Notes the start of a request"""
+        g.metrics_route = self.route()
+        g.metrics_started = time.perf_counter()
+        self.in_progress.labels(request.method, g.metrics_route).inc()
+
+    def finish_request(self, response):
+        """Counts a request and its latency by status code"""
+        if "metrics_started" in g:
+            labels = (request.method, g.metrics_route, str(response.status_code))
+            self.requests.labels(*labels).inc()
+            self.latency.labels(*labels).observe(time.perf_counter() - g.metrics_started)
+        return response
+
+    def end_request(self, error=None):  # pylint: disable=unused-argument
+        """Takes a finished request off the in-progress gauge"""
+        route = g.pop("metrics_route", None)
+        if g.pop("metrics_started", None) is not None:
+            self.in_progress.labels(request.method, route).dec()
+
+    def finish_query(self, conn, cursor, statement, parameters, context, executemany):
+        """Records the latency of a SQL statement"""
+        # pylint: disable=too-many-arguments, unused-argument
+        started = getattr(context, "metrics_started", None)
+        if started is not None:
+            self.queries.observe(time.perf_counter() - started)
+
+    def cache_lookup(self, hit):
+        """Counts a cache hit or miss"""
+        self.cache_lookups.labels("hit" if hit else "miss").inc()
+
+    @staticmethod
+    def render():
+        """Returns the metrics in the Prometheus text format and its content type"""
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    """Notes the start of a SQL statement"""
+    # pylint: disable=too-many-arguments, unused-argument
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+# The metrics to be initialized later in create_app()
+metrics = Metrics()
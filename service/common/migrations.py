@@ -0,0 +1,123 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Schema Migrations
+
+This module brings an existing database up to date with the models
+without dropping anything. Missing tables are created, missing columns
+are added with ALTER TABLE and missing indexes are built, concurrently
+on PostgreSQL so that reads and writes are not blocked while they build.
+
+A concurrent build that fails leaves an INVALID index behind on
+PostgreSQL. Such an index is dropped and built again by the next run
+rather than being taken for an index that exists.
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+logger = logging.getLogger("flask.app")
+
+# Indexes of a table that PostgreSQL will not use because their build failed
+INVALID_INDEXES = """
+SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = CAST(:table AS regclass) AND NOT i.indisvalid
+"""
+
+
+def upgrade_schema(engine, metadata) -> list:
+    """Applies every missing table, column and index to the database
+
+    Args:
+        engine (Engine): the engine of the database to upgrade
+        metadata (MetaData): the metadata describing the target schema
+
+    Returns:
+        a list describing each change that was applied
+    """
+    changes = []
+    existing_tables = set(inspect(engine).get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            table.create(engine)
+            changes.append(f"Created table {table.name}")
+            continue
+        changes.extend(_add_columns(engine, table))
+        changes.extend(_add_indexes(engine, table))
+    for change in changes:
+        logger.info(change)
+    return changes
+
+
+def _add_columns(engine, table) -> list:
+    """Adds the columns of a table that are missing from the database"""
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    changes = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        definition = CreateColumn(column).compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+        changes.append(f"Added column {table.name}.{column.name}")
+    return changes
+
+
+def _add_indexes(engine, table) -> list:
+    """Builds the indexes of a table that are missing from the database or invalid"""
+    existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+    invalid = _invalid_indexes(engine, table)
+    changes = []
+    for index in sorted(table.indexes, key=lambda index: index.name):
+        if index.name in invalid:
+            _drop_index(engine, index)
+            _create_index(engine, index)
+            changes.append(f"Rebuilt invalid index {index.name} on {table.name}")
+        elif index.name not in existing:
+            _create_index(engine, index)
+            changes.append(f"Created index {index.name} on {table.name}")
+    return changes
+
+
+def _invalid_indexes(engine, table) -> set:
+    """Returns the names of the indexes of a table that PostgreSQL marked invalid"""
+    if engine.dialect.name != "postgresql":
+        return set()
+    with engine.connect() as conn:
+        return set(conn.execute(text(INVALID_INDEXES), {"table": table.name}).scalars())
+
+
+def _drop_index(engine, index):
+    """Drops one index without holding a write lock on PostgreSQL"""
+    name = engine.dialect.identifier_preparer.quote(index.name)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def _create_index(engine, index):
+    """Builds one index without holding a write lock on PostgreSQL"""
+    if engine.dialect.name != "postgresql":
+        index.create(engine)
+        return
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    options = index.dialect_options["postgresql"]
+    options["concurrently"] = True
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(CreateIndex(index))
+    finally:
+        options["concurrently"] = False
@@ -0,0 +1,52 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Pagination Cursors
+
+This module encodes and decodes the opaque cursors handed out by the
+list endpoints. A cursor records the sort order it was issued for and
+the sort key of the last row on the page so the next page can be
+fetched with a keyset (seek) query instead of an OFFSET.
+"""
+import json
+import base64
+import binascii
+
+# Types a sort key may have, the ones that json gives back for a column value
+VALUE_TYPES = (str, int, float, bool, type(None))
+
+
+def encode_cursor(sort: str, value, last_id: int) -> str:
+    """Encodes the position after the last row of a page into a cursor"""
+    payload = json.dumps([sort, value, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decodes a cursor into a (sort, value, last_id) tuple
+
+    Raises:
+        ValueError: if the cursor was not produced by encode_cursor
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as error:
+        raise ValueError(f"Invalid cursor: {cursor}") from error
+    if not isinstance(sort, str) or not isinstance(value, VALUE_TYPES) or not isinstance(last_id, int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return sort, value, last_id
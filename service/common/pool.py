@@ -0,0 +1,103 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Connection Pool
+
+This module turns the DB_POOL_* settings into SQLAlchemy engine options and
+reports the health of the pool. Each worker process holds its own pool, so
+a deployment opens up to workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+connections, which must stay below the max_connections of the database.
+"""
+import time
+import threading
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def connect(self):
+        """Checks out a connection, timing the wait"""
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+def engine_options(config) -> dict:
+    """Returns the SQLAlchemy engine options for the DB_POOL_* settings
+
+    In-memory SQLite databases live in a single connection, so they keep
+    the pool that Flask-SQLAlchemy picks for them.
+    """
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    if uri.startswith("sqlite") and (uri.endswith(":memory:") or uri.rstrip("/") == "sqlite:"):
+        return options
+    options.setdefault("poolclass", TimedQueuePool)
+    options.setdefault("pool_size", config["DB_POOL_SIZE"])
+    options.setdefault("max_overflow", config["DB_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", config["DB_POOL_TIMEOUT"])
+    options.setdefault("pool_recycle", config["DB_POOL_RECYCLE"])
+    options.setdefault("pool_pre_ping", config["DB_POOL_PRE_PING"])
+    timeout = config["DB_STATEMENT_TIMEOUT"]
+    if timeout and uri.startswith("postgresql"):
+        connect_args = options.setdefault("connect_args", {})
+        connect_args.setdefault("options", f"-c statement_timeout={timeout}")
+    return options
+
+
+def pool_stats(engine) -> dict:
+    """Returns the state of the connection pool of an engine in this worker"""
+    pool = engine.pool
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            # QueuePool counts up from -size while the pool is filling
+            overflow=max(0, pool.overflow()),
+            max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(
+            checkouts=pool.checkouts,
+            timeouts=pool.timeouts,
+            wait_seconds=pool.wait_seconds,
+            max_wait_seconds=pool.max_wait_seconds,
+            mean_wait_seconds=pool.wait_seconds / pool.checkouts if pool.checkouts else 0.0,
+        )
+    return stats
@@ -0,0 +1,145 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Query Arguments
+
+This module parses the query parameters of the list and bulk endpoints.
+The functions take the query parameters as a werkzeug MultiDict, so the
+Flask routes and the ASGI app share them, and raise DataValidationError
+for a bad value. Integers must fit an Integer column, and an integer path
+segment that does not fit one matches no rule, so its URL answers 404.
+"""
+import logging
+from werkzeug.routing import IntegerConverter
+from service.models import DataValidationError, INTEGER_MIN, INTEGER_MAX
+
+logger = logging.getLogger("flask.app")
+
+FILTER_ARGS = [
+    "id",
+    "name",
+    "recommendation_type",
+    "recommendation_name",
+    "recommendation_id",
+    "recommendation_in_stock",
+    "id_min",
+    "id_max",
+    "recommendation_id_min",
+    "recommendation_id_max",
+]
+
+# Values a bulk request may give a boolean filter
+STRICT_BOOLEANS = ["true", "false", "yes", "no", "1", "0"]
+
+
+def parse_filters(args) -> dict:
+    """Returns the filters passed as query parameters
+
+    A filter may be repeated to match any of several values, and the id,
+    type and recommendation id filters also accept comma separated lists.
+    """
+    filters = {}
+    for key in ["name", "recommendation_name"]:
+        filters[key] = arg_values(args, key)
+    for key in ["id", "recommendation_type", "recommendation_id"]:
+        filters[key] = arg_values(args, key, split=True)
+    for key in ["id", "recommendation_id"]:
+        filters[key] = int_values(key, filters[key])
+    for key in ["id_min", "id_max", "recommendation_id_min", "recommendation_id_max"]:
+        values = int_values(key, arg_values(args, key))
+        filters[key] = values[-1] if values else None
+
+    in_stock = args.get("recommendation_in_stock")
+    if in_stock:
+        logger.info("Find by in_stock: %s", in_stock)
+        # create bool from string
+        filters["recommendation_in_stock"] = in_stock.lower() in ["true", "yes", "1"]
+
+    return {key: value for key, value in filters.items() if value not in (None, [])}
+
+
+def parse_bulk_filters(args) -> dict:
+    """Returns the query filters of a bulk update or delete
+
+    Bulk requests must be narrowed by at least one filter, and any query
+    parameter that is not a filter is rejected rather than ignored, as is
+    a stock filter that is not clearly true or false.
+    """
+    unknown = sorted(set(args) - set(FILTER_ARGS))
+    if unknown:
+        raise DataValidationError(f"Invalid filters: {', '.join(unknown)}")
+    for in_stock in arg_values(args, "recommendation_in_stock"):
+        if in_stock.lower() not in STRICT_BOOLEANS:
+            raise DataValidationError(f"Invalid boolean for recommendation_in_stock: {in_stock}")
+    filters = parse_filters(args)
+    if not filters:
+        raise DataValidationError("At least one filter is required")
+    return filters
+
+
+def parse_page_size(args, default: int, maximum: int) -> int:
+    """Returns the requested page size capped at the maximum"""
+    limit = args.get("limit")
+    if limit is None:
+        return default
+    if not limit.isdigit() or int(limit) < 1:
+        raise DataValidationError(f"Invalid limit: {limit}")
+    return min(int(limit), maximum)
+
+
+def parse_top(args, maximum: int):
+    """Returns how many of the highest scoring rows were asked for, or None"""
+    top = args.get("top")
+    if top is None:
+        return None
+    if not top.isdigit() or int(top) < 1:
+        raise DataValidationError(f"Invalid top: {top}")
+    if "cursor" in args:
+        raise DataValidationError("top returns a single page and takes no cursor")
+    return min(int(top), maximum)
+
+
+def wants_stream(args) -> bool:
+    """True when the stream query parameter asks for the whole result set"""
+    return args.get("stream", "").lower() in ["true", "yes", "1"]
+
+
+class IdConverter(IntegerConverter):
+    """The int converter of the URL rules of both apps, limited to ids an Integer column can hold"""
+
+    def __init__(self, url_map, *args, **kwargs):
+        kwargs.setdefault("max", INTEGER_MAX)
+        super().__init__(url_map, *args, **kwargs)
+
+
+def arg_values(args, key, split=False):
+    """Returns the non-empty values of a query parameter"""
+    values = args.getlist(key)
+    if split:
+        values = [item.strip() for value in values for item in value.split(",")]
+    return [value for value in values if value]
+
+
+def int_values(key, values):
+    """Converts the values of a query parameter to integers that fit an Integer column"""
+    try:
+        numbers = [int(value) for value in values]
+    except ValueError as error:
+        raise DataValidationError(f"Invalid integer for {key}: {values}") from error
+    if any(not INTEGER_MIN <= number <= INTEGER_MAX for number in numbers):
+        raise DataValidationError(f"Invalid integer for {key}: {values} is out of range")
+    return numbers
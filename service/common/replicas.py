@@ -0,0 +1,153 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Read Replicas
+
+This module routes reads to the read replicas listed in the space separated
+DATABASE_REPLICA_URIS setting. Only statements marked as replica reads are
+routed, with the "replica" execution option or bind argument; everything
+else, including every write, goes to the primary DATABASE_URI.
+
+Replicas are used round-robin and each one is checked with a SELECT 1 at
+most every DATABASE_REPLICA_CHECK_INTERVAL seconds, skipping it while the
+check fails. When no replica is healthy reads fall back to the primary.
+
+A successful write request stamps the client's session cookie, and for
+DATABASE_REPLICA_STICKY_SECONDS after that the client's requests read from
+the primary and skip cache lookups, so a GET that follows a PUT sees the
+change.
+"""
+import time
+import logging
+import threading
+from flask import g, has_app_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger("flask.app")
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class Replica:  # pylint: disable=too-few-public-methods
+    """A read replica and the result of its last health check"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = True
+        self.checked_at = None
+
+
+class ReplicaRouter:
+    """Chooses the replica each read goes to"""
+
+    def __init__(self):
+        self.replicas = []
+        self.check_interval = 5.0
+        self.sticky_seconds = 5.0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Creates an engine for each of the DATABASE_REPLICA_URIS"""
+        self.check_interval = app.config.get("DATABASE_REPLICA_CHECK_INTERVAL", 5.0)
+        self.sticky_seconds = app.config.get("DATABASE_REPLICA_STICKY_SECONDS", 5.0)
+        options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {}
+        self.configure(
+            [create_engine(uri, **options) for uri in app.config.get("DATABASE_REPLICA_URIS", [])]
+        )
+        app.before_request(self.pin_recent_writers)
+        app.after_request(self.remember_writes)
+        app.extensions["replicas"] = self
+
+    def configure(self, engines):
+        """Replaces the replicas with the given engines"""
+        for replica in self.replicas:
+            replica.engine.dispose()
+        with self._lock:
+            self.replicas = [Replica(engine) for engine in engines]
+            self._next = 0
+
+    @property
+    def enabled(self) -> bool:
+        """True when there is at least one replica"""
+        return bool(self.replicas)
+
+    def choose(self):
+        """Returns the engine of the next healthy replica, or None"""
+        with self._lock:
+            replicas = self.replicas
+            start = self._next
+            self._next = (start + 1) % len(replicas) if replicas else 0
+        for offset in range(len(replicas)):
+            replica = replicas[(start + offset) % len(replicas)]
+            if self.check(replica):
+                return replica.engine
+        return None
+
+    def check(self, replica) -> bool:
+        """Returns True if a replica is healthy, checking it when it is due"""
+        now = time.monotonic()
+        if replica.checked_at is not None and now - replica.checked_at < self.check_interval:
+            return replica.healthy
+        try:
+            with replica.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            healthy = True
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Read replica %s is unavailable: %s", replica.engine.url, error)
+            healthy = False
+        replica.healthy, replica.checked_at = healthy, now
+        return healthy
+
+    def pin_recent_writers(self):
+        """Sends the reads of a client that wrote recently to the primary"""
+        g.read_primary = self.enabled and time.time() - session.get("wrote_at", 0) < self.sticky_seconds
+
+    @staticmethod
+    def pinned() -> bool:
+        """True when the reads of the current request must go to the primary
+
+        Pinned requests also skip cache lookups, since another client may
+        have cached what a lagging replica returned.
+        """
+        return has_app_context() and g.get("read_primary", False)
+
+    def remember_writes(self, response):
+        """Stamps the session of a client whose write succeeded"""
+        if self.enabled and request.method in WRITE_METHODS and response.status_code < 400:
+            session["wrote_at"] = time.time()
+        return response
+
+
+class RoutingSession(Session):
+    """A Flask-SQLAlchemy session that sends replica reads to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """Returns a replica engine for replica reads, otherwise the primary"""
+        if bind is None and replicas.enabled and not replicas.pinned():
+            marked = kwargs.pop("replica", False)
+            if marked or (clause is not None and clause.get_execution_options().get("replica")):
+                engine = replicas.choose()
+                if engine is not None:
+                    return engine
+        kwargs.pop("replica", None)
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+# The replica router to be initialized later in create_app()
+replicas = ReplicaRouter()
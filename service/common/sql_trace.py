@@ -0,0 +1,145 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+SQL Tracing
+
+This module follows the SQL statements that each request runs, using the
+cursor events of every SQLAlchemy engine:
+
+- the statements and the time spent in the database are added to each
+  response as X-DB-Queries and Server-Timing headers when SQL_TRACE_HEADERS
+  is set, or the app runs in debug or testing mode
+- statements slower than SQL_SLOW_QUERY_MS are logged as warnings, with
+  their parameters redacted
+- a statement that runs SQL_REPEAT_THRESHOLD times or more in one request is
+  logged when the request ends as a likely N+1 query, which usually means a
+  loop that should be one query
+
+Setting SQL_SLOW_QUERY_MS or SQL_REPEAT_THRESHOLD to 0 turns that check off.
+"""
+import time
+import logging
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app")
+
+
+class RequestQueries:  # pylint: disable=too-few-public-methods
+    """The statements one request has run"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+
+class SQLTrace:
+    """Counts, times and checks the SQL statements of each request"""
+
+    def __init__(self):
+        self.headers = False
+        self.slow_seconds = 0.2
+        self.repeat_threshold = 5
+
+    def init_app(self, app):
+        """Starts tracing the statements of an app's requests"""
+        self.headers = app.config.get("SQL_TRACE_HEADERS", False)
+        self.slow_seconds = app.config.get("SQL_SLOW_QUERY_MS", 200) / 1000
+        self.repeat_threshold = app.config.get("SQL_REPEAT_THRESHOLD", 5)
+        app.before_request(self.start_request)
+        app.after_request(self.add_headers)
+        app.teardown_request(self.check_repeats)
+        if not event.contains(Engine, "before_cursor_execute", start_query):
+            event.listen(Engine, "before_cursor_execute", start_query)
+            event.listen(Engine, "after_cursor_execute", self.finish_query)
+        app.extensions["sql_trace"] = self
+
+    @staticmethod
+    def start_request():
+        """Starts counting the statements of a request"""
+        g.sql_queries = RequestQueries()
+
+    @staticmethod
+    def current():
+        """Returns the statements of the current request, or None outside one"""
+        return g.get("sql_queries") if has_request_context() else None
+
+    def finish_query(self, conn, cursor, statement, parameters, context, executemany):
+        """Counts a finished statement and checks it for slowness and repeats"""
+        # pylint: disable=too-many-arguments, unused-argument
+        started = getattr(context, "trace_started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        if self.slow_seconds and seconds >= self.slow_seconds:
+            logger.warning(
+                "Slow query (%.1f ms): %s parameters: %s", seconds * 1000, statement, redact(parameters)
+            )
+        queries = self.current()
+        if queries is None:
+            return
+        queries.count += 1
+        queries.seconds += seconds
+        queries.statements[statement] += 1
+
+    def add_headers(self, response):
+        """Reports the statements of a request in the response headers"""
+        queries = self.current()
+        if queries is not None and (self.headers or current_app.debug or current_app.testing):
+            response.headers["X-DB-Queries"] = str(queries.count)
+            response.headers["Server-Timing"] = f'db;dur={queries.seconds * 1000:.1f};desc="{queries.count} queries"'
+        return response
+
+    def check_repeats(self, error=None):  # pylint: disable=unused-argument
+        """Logs the statements a finished request ran suspiciously often"""
+        queries = self.current()
+        if queries is None or not self.repeat_threshold:
+            return
+        for statement, times in queries.statements.items():
+            if times >= self.repeat_threshold:
+                logger.warning(
+                    "Possible N+1 query: %s %s ran the same statement %d times: %s",
+                    request.method,
+                    request.path,
+                    times,
+                    statement,
+                )
+
+
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    """Notes the start of a SQL statement"""
+    # pylint: disable=too-many-arguments, unused-argument
+    if context is not None:
+        context.trace_started = time.perf_counter()
+
+
+def redact(parameters):
+    """Replaces the values of statement parameters with their type names"""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"{len(parameters)} rows of {redact(parameters[0])}"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+# The tracer to be initialized later in create_app()
+sql_trace = SQLTrace()
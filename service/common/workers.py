@@ -0,0 +1,92 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Worker Startup
+
+This module prepares a worker process to serve requests. The tables are
+not created here but by "flask db-migrate", which runs once per rollout.
+
+after_fork - with PRELOAD_APP, gunicorn creates the app in the master and
+             forks the workers from it; each worker then drops the pooled
+             connections it inherited, which must never be shared between
+             processes, and opens its own
+warm_up    - with WARMUP, opens WARMUP_CONNECTIONS pool connections and
+             caches the WARMUP_CACHE_ITEMS newest Recommendations before the
+             worker accepts its first request, so the readiness probe only
+             passes once the first requests will be fast; with
+             WARMUP_ADJACENCY it also builds the adjacency index
+"""
+import time
+import logging
+from contextlib import ExitStack
+from sqlalchemy import text
+from service.common import log_handlers
+
+logger = logging.getLogger("flask.app")
+
+
+def after_fork(app):
+    """Gives a worker forked from a preloaded app its own database connections"""
+    for engine in engines(app):
+        # close=False leaves the master's connections alone for it to close
+        engine.dispose(close=False)
+    log_handlers.restart_listener(app)
+    if app.config.get("WARMUP"):
+        warm_up(app)
+
+
+def warm_up(app):
+    """Opens pool connections and fills the cache of a worker"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Recommendation
+    from service.common.adjacency import adjacency
+
+    start = time.perf_counter()
+    try:
+        with app.app_context():
+            connections = sum(open_connections(engine, app.config.get("WARMUP_CONNECTIONS", 5)) for engine in engines(app))
+            items = Recommendation.prime_cache(app.config.get("WARMUP_CACHE_ITEMS", 100))
+            if app.config.get("WARMUP_ADJACENCY"):
+                adjacency.build()
+    except Exception as error:  # pylint: disable=broad-except
+        # the worker can still serve requests, it just starts cold
+        logger.warning("Warmup failed: %s", error)
+        return
+    logger.info(
+        "Warmed up %d connections and %d cache entries in %.0f ms", connections, items, (time.perf_counter() - start) * 1000
+    )
+
+
+def open_connections(engine, count: int) -> int:
+    """Opens up to count pooled connections of an engine and returns how many"""
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 0
+    # connections beyond the pool size would be closed again when returned
+    count = min(count, size)
+    with ExitStack() as stack:
+        for _ in range(count):
+            stack.enter_context(engine.connect()).execute(text("SELECT 1"))
+    return count
+
+
+def engines(app):
+    """Returns the primary and replica engines of an app"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+    from service.common.replicas import replicas
+
+    with app.app_context():
+        return list(db.engines.values()) + [replica.engine for replica in replicas.replicas]
@@ -13,8 +13,68 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Space separated read replicas of DATABASE_URI, see service/common/replicas.py
+DATABASE_REPLICA_URIS = os.getenv("DATABASE_REPLICA_URIS", "").split()
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "5"))
+# Seconds a client that wrote keeps reading from the primary
+DATABASE_REPLICA_STICKY_SECONDS = float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "5"))
+
+# Connection pool of each worker process, see service/common/pool.py
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ["true", "yes", "1"]
+# Milliseconds before PostgreSQL cancels a statement, 0 for no limit
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
+# Worker startup, see gunicorn.conf.py and service/common/workers.py
+# Create the app once in the gunicorn master and fork the workers from it
+PRELOAD_APP = os.getenv("PRELOAD_APP", "false").lower() in ["true", "yes", "1"]
+# Open pool connections and fill the cache before a worker serves requests
+WARMUP = os.getenv("WARMUP", "false").lower() in ["true", "yes", "1"]
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", str(DB_POOL_SIZE)))
+WARMUP_CACHE_ITEMS = int(os.getenv("WARMUP_CACHE_ITEMS", "100"))
+# Also build the in-memory index of product recommendations during the warmup
+WARMUP_ADJACENCY = os.getenv("WARMUP_ADJACENCY", "false").lower() in ["true", "yes", "1"]
+
+# SQL tracing, see service/common/sql_trace.py
+SQL_TRACE_HEADERS = os.getenv("SQL_TRACE_HEADERS", "false").lower() in ["true", "yes", "1"]
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "5"))
+
+# In-memory index of product recommendations, see service/common/adjacency.py
+ADJACENCY_REBUILD_SECONDS = float(os.getenv("ADJACENCY_REBUILD_SECONDS", "60"))
+ADJACENCY_MAX_PATCHES = int(os.getenv("ADJACENCY_MAX_PATCHES", "1000"))
+
+# Page sizes for the list endpoints
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+# Rows fetched and written per chunk when streaming a list
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+# Rows inserted per transaction by the batch create endpoint
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "1000"))
+
+# Read-through cache: memory (per worker), redis (shared) or none
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Seconds clients and CDNs may reuse a GET response before revalidating it
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "0"))
+
+# JSON encoder: auto (orjson when installed), orjson or stdlib
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "auto")
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
+
+# Logging, see service/common/log_handlers.py
+# Write log records from a background thread instead of the request thread
+LOG_QUEUE = os.getenv("LOG_QUEUE", "false").lower() in ["true", "yes", "1"]
+# text or json, one object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# logger=rate pairs keeping that share of INFO records, e.g. service=0.1
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
@@ -12,17 +12,33 @@ recommendation_type (enum) - the recommendation type (cross-sell, up-sell...etc)
 recommendation_in_stock (boolean) - True for the recommendation is in stock
 recommendation_name (string) - recommendation name
 recommendation_id (int) - recommendation id
+score (float) - how relevant the recommendation is, higher is better
+version (int) - bumped by every write, used as the entity tag of the row
 """
 
+import re
+import json
+import math
+import hashlib
 import logging
 from enum import Enum
 from flask_sqlalchemy import SQLAlchemy
+from service.common.cache import cache
+from service.common.adjacency import adjacency
+from service.common.replicas import RoutingSession, replicas
+from service.common.pagination import encode_cursor, decode_cursor
 
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+# Range of an Integer column on every supported database
+INTEGER_MIN, INTEGER_MAX = -(2**31), 2**31 - 1
+# Text of an integer as the UI sends it
+INTEGER_TEXT = re.compile(r"[+-]?[0-9]+")
 
 
 class DataValidationError(Exception):
@@ -38,7 +54,7 @@ class EnumRecommendationType(Enum):
     UNKNOWN = 3
 
 
-class Recommendation(db.Model):
+class Recommendation(db.Model):  # pylint: disable=too-many-public-methods
     """
     Class that represents a Recommendation
     """
@@ -56,6 +72,58 @@ class Recommendation(db.Model):
     recommendation_name = db.Column(db.String(63))
     recommendation_id = db.Column(db.Integer, primary_key=False)
     recommendation_in_stock = db.Column(db.Boolean(), nullable=False, default=False)
+    score = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        db.Index("ix_recommendation_name", "name"),
+        db.Index("ix_recommendation_recommendation_name", "recommendation_name"),
+        db.Index("ix_recommendation_recommendation_id", "recommendation_id"),
+        db.Index(
+            "ix_recommendation_type_in_stock",
+            "recommendation_type",
+            "recommendation_in_stock",
+        ),
+        # the best recommendations of a product come off this index in the
+        # order of sort=-score, id being its tie breaker
+        db.Index("ix_recommendation_name_type_score", "name", "recommendation_type", score.desc(), id.desc()),
+    )
+
+    # the ORM bumps the version of every row it updates
+    __mapper_args__ = {"version_id_col": version}
+
+    # Cache counter bumped by every write to the table
+    CACHE_VERSION = "recommendation-version"
+
+    # Fields that clients may set, in the order they are validated
+    FIELDS = (
+        "name",
+        "recommendation_in_stock",
+        "recommendation_type",
+        "recommendation_name",
+        "recommendation_id",
+        "score",
+    )
+
+    # Values of the fields that a full Recommendation may leave out
+    DEFAULTS = {"score": 0.0}
+
+    # Keys of a serialized Recommendation, in the order of read_columns()
+    SERIALIZED_KEYS = (
+        "id",
+        "name",
+        "recommendation_in_stock",
+        "recommendation_type",
+        "recommendation_name",
+        "recommendation_id",
+        "score",
+    )
+
+    # Error reported for a row that passed validate but that the database rejected
+    REJECTED = "Invalid Recommendation: rejected by the database"
+
+    # Columns that list results may be sorted and paginated on
+    SORTABLE_COLUMNS = ("id", "name", "recommendation_name", "recommendation_id", "score")
 
     def __repr__(self):
         return f"<Recommendation {self.name} id=[{self.id}]>"
@@ -73,6 +141,7 @@ class Recommendation(db.Model):
             db.session.rollback()
             logger.error("Error creating record: %s", self)
             raise DataValidationError(e) from e
+        self.invalidate(self.id)
 
     def update(self):
         """
@@ -87,11 +156,13 @@ class Recommendation(db.Model):
             db.session.rollback()
             logger.error("Error updating record: %s", self)
             raise DataValidationError(e) from e
+        self.invalidate(self.id)
 
     def delete(self):
         """Removes a Recommendation from the data store"""
 
         logger.info("Deleting %s", self.name)
+        by_id = self.id
         try:
             db.session.delete(self)
             db.session.commit()
@@ -99,6 +170,7 @@ class Recommendation(db.Model):
             db.session.rollback()
             logger.error("Error deleting record: %s", self)
             raise DataValidationError(e) from e
+        self.invalidate(by_id)
 
     def serialize(self):
         """Serializes a Recommendation into a dictionary"""
@@ -110,8 +182,57 @@ class Recommendation(db.Model):
             "recommendation_type": self.recommendation_type.name,
             "recommendation_name": self.recommendation_name,
             "recommendation_id": self.recommendation_id,
+            "score": self.score,
+        }
+
+    @staticmethod
+    def serialize_row(row) -> dict:
+        """Serializes a row of Recommendation columns into a dictionary"""
+        mapping = row._mapping
+        return {
+            "id": mapping["id"],
+            "name": mapping["name"],
+            "recommendation_in_stock": mapping["recommendation_in_stock"],
+            "recommendation_type": mapping["recommendation_type"].name,
+            "recommendation_name": mapping["recommendation_name"],
+            "recommendation_id": mapping["recommendation_id"],
+            "score": mapping["score"],
         }
 
+    @classmethod
+    def read_columns(cls) -> list:
+        """Returns the columns selected by the read-only fast path
+
+        The type is read as its stored name so no Enum is built per row, and
+        the version comes last, after every serialized key.
+        """
+        return [
+            cls.id,
+            cls.name,
+            cls.recommendation_in_stock,
+            db.type_coerce(cls.recommendation_type, db.String).label("recommendation_type"),
+            cls.recommendation_name,
+            cls.recommendation_id,
+            cls.score,
+            cls.version,
+        ]
+
+    @classmethod
+    def select_rows(cls, query):
+        """Returns a read-only copy of a query that yields plain rows
+
+        The rows are Core tuples of read_columns(), so no Recommendation is
+        instantiated or added to the session identity map.
+        """
+        return query.with_entities(*cls.read_columns())
+
+    @classmethod
+    def serialize_rows(cls, rows):
+        """Yields a serialized dictionary for each row from select_rows()"""
+        keys = cls.SERIALIZED_KEYS
+        # zip stops at the last key, which leaves the version out
+        return (dict(zip(keys, row)) for row in rows)
+
     def deserialize(self, data):
         """
         Deserializes a Recommendation from a dictionary
@@ -119,22 +240,31 @@ class Recommendation(db.Model):
         Args:
             data (dict): A dictionary containing the resource data
         """
-        try:
-            self.name = data["name"]
+        for key, value in self.validate(data).items():
+            setattr(self, key, value)
+        return self
 
-            if isinstance(data["recommendation_in_stock"], bool):
-                self.recommendation_in_stock = data["recommendation_in_stock"]
-            else:
-                raise DataValidationError(
-                    "Invalid type for boolean [recommendation_in_stock]: "
-                    + str(type(data["recommendation_in_stock"]))
-                )
+    @classmethod
+    def validate(cls, data, partial: bool = False) -> dict:
+        """
+        Validates a dictionary and returns the column values it holds
 
-            self.recommendation_type = getattr(
-                EnumRecommendationType, data["recommendation_type"]
-            )  # create enum from string
-            self.recommendation_name = data["recommendation_name"]
-            self.recommendation_id = data["recommendation_id"]
+        Args:
+            data (dict): A dictionary containing the resource data
+            partial (bool): True to validate only the fields that are present
+        """
+        if partial and not isinstance(data, dict):
+            raise DataValidationError(
+                "Invalid Recommendation: body of request contained bad or no data"
+            )
+        values = {}
+        try:
+            for field in cls.FIELDS:
+                if field not in data and (partial or field in cls.DEFAULTS):
+                    if not partial:
+                        values[field] = cls.DEFAULTS[field]
+                    continue
+                values[field] = cls._validate_field(field, data[field])
         except AttributeError as error:
             raise DataValidationError("Invalid attribute: " + error.args[0]) from error
         except KeyError as error:
@@ -146,54 +276,244 @@ class Recommendation(db.Model):
                 "Invalid Recommendation: body of request contained bad or no data "
                 + str(error)
             ) from error
-        return self
+        if not values:
+            raise DataValidationError("Invalid Recommendation: no fields to update")
+        return values
+
+    @classmethod
+    def validate_stock(cls, data) -> bool:
+        """Validates a body that holds only recommendation_in_stock and returns its value"""
+        values = cls.validate(data, partial=True)
+        if set(data) != {"recommendation_in_stock"}:
+            raise DataValidationError("Invalid stock update: only recommendation_in_stock may be set")
+        return values["recommendation_in_stock"]
+
+    @classmethod
+    def _validate_field(cls, field, value):
+        """Validates the value of one field against the type and size of its column"""
+        if field == "recommendation_in_stock" and not isinstance(value, bool):
+            raise DataValidationError(
+                "Invalid type for boolean [recommendation_in_stock]: " + str(type(value))
+            )
+        if field == "recommendation_type":
+            if not isinstance(value, str) or value not in EnumRecommendationType.__members__:
+                raise DataValidationError(f"Invalid recommendation_type: {value}")
+            return EnumRecommendationType[value]
+        if field == "score":
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise DataValidationError("Invalid score: " + str(value))
+            return float(value)
+        if field in ("name", "recommendation_name") and value is not None:
+            length = cls.__table__.c[field].type.length
+            if not isinstance(value, str) or len(value) > length:
+                raise DataValidationError(f"Invalid {field}: must be a string of at most {length} characters")
+        if field == "recommendation_id":
+            return cls._validate_integer(field, value)
+        return value
+
+    @staticmethod
+    def _validate_integer(field, value):
+        """Validates the value of a nullable Integer column, which may come as the text of a UI field"""
+        # the UI sends the text of its input field, which is blank for no id
+        if isinstance(value, str):
+            value = int(value) if INTEGER_TEXT.fullmatch(value.strip()) else value.strip() or None
+        if value is None:
+            return None
+        if isinstance(value, bool) or not isinstance(value, int) or not INTEGER_MIN <= value <= INTEGER_MAX:
+            raise DataValidationError(f"Invalid {field}: must be a 32-bit integer")
+        return value
 
     ##################################################
     # CLASS METHODS
     ##################################################
 
+    @classmethod
+    def create_many(cls, rows: list) -> list:
+        """
+        Creates many Recommendations with multi-row INSERTs in one transaction
+
+        Args:
+            rows (list): the column values of each Recommendation, see validate
+
+        Returns:
+            the ids of the new Recommendations in the order of the rows
+        """
+        logger.info("Creating %d Recommendations", len(rows))
+        if not rows:
+            return []
+        try:
+            statement = db.insert(cls).returning(cls.id, sort_by_parameter_order=True)
+            ids = db.session.scalars(statement, rows).all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error creating %d records", len(rows))
+            raise DataValidationError(e) from e
+        cls.invalidate(*ids)
+        return ids
+
+    @classmethod
+    def upsert_many(cls, rows: list) -> tuple:
+        """
+        Creates or updates many Recommendations in one transaction
+
+        A row updates the score and recommendation_id of the Recommendations
+        with its name, recommendation_type and recommendation_name, and is
+        inserted when there are none. The stock of existing rows is kept.
+
+        Args:
+            rows (list): the column values of each Recommendation, see validate
+
+        Returns:
+            the number of Recommendations created and updated
+        """
+        logger.info("Upserting %d Recommendations", len(rows))
+        if not rows:
+            return 0, 0
+        table = cls.__table__
+        try:
+            statement = db.select(cls.id, cls.name, cls.recommendation_type, cls.recommendation_name).where(
+                cls.name.in_({row["name"] for row in rows}),
+                cls.recommendation_name.in_({row["recommendation_name"] for row in rows}),
+            )
+            existing = {}
+            for row_id, name, recommendation_type, recommendation_name in db.session.execute(statement).all():
+                existing.setdefault((name, recommendation_type, recommendation_name), []).append(row_id)
+            updates, inserts = [], []
+            for row in rows:
+                ids = existing.get((row["name"], row["recommendation_type"], row["recommendation_name"]), ())
+                updates.extend(
+                    {"row_id": row_id, "score": row["score"], "recommendation_id": row["recommendation_id"]}
+                    for row_id in ids
+                )
+                if not ids:
+                    inserts.append(row)
+            if updates:
+                db.session.execute(
+                    table.update()
+                    .where(table.c.id == db.bindparam("row_id"))
+                    .values(version=table.c.version + 1),
+                    updates,
+                )
+            if inserts:
+                db.session.execute(db.insert(cls), inserts)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error upserting %d records", len(rows))
+            raise DataValidationError(e) from e
+        cls.invalidate(all_rows=True)
+        return len(inserts), len(updates)
+
     @classmethod
     def all(cls):
         """Returns all of the Recommendations in the database"""
         logger.info("Processing all Recommendations")
-        return cls.query.all()
+        return cls._reads().all()
 
     @classmethod
     def find(cls, by_id):
         """Finds a Recommendation by its ID"""
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.session.get(cls, by_id)
+        return cls.query.session.get(cls, by_id, bind_arguments={"replica": True})
+
+    @classmethod
+    def find_serialized(cls, by_id):
+        """Returns a serialized Recommendation through the read-through cache
+
+        Args:
+            by_id (int): the id of the Recommendation to find
+
+        Returns:
+            a tuple of the serialized Recommendation and its version, or
+            None if it was not found
+        """
+        key = f"recommendation:{by_id}"
+        cached = None if replicas.pinned() else cache.get(key)
+        if cached is not None:
+            data, version = json.loads(cached)
+            return data, version
+        recommendation = cls.find(by_id)
+        if not recommendation:
+            return None
+        return recommendation.cache_serialized()
+
+    def cache_serialized(self):
+        """Caches the serialized Recommendation for find_serialized and returns it with its version"""
+        data = self.serialize()
+        cache.set(f"recommendation:{self.id}", json.dumps([data, self.version]).encode("utf-8"))
+        return data, self.version
+
+    @classmethod
+    def prime_cache(cls, limit: int) -> int:
+        """Caches the most recently created Recommendations
+
+        Args:
+            limit (int): how many Recommendations to cache
+
+        Returns:
+            the number of Recommendations cached
+        """
+        recommendations = cls._reads().order_by(cls.id.desc()).limit(limit).all()
+        for recommendation in recommendations:
+            recommendation.cache_serialized()
+        return len(recommendations)
 
     @classmethod
-    def find_by_name(cls, name):
+    def invalidate(cls, *ids, all_rows=False):
+        """Evicts cached Recommendations and bumps the table version
+
+        Args:
+            ids (int): the ids of the Recommendations that changed
+            all_rows (bool): True when a bulk write may have changed any row
+        """
+        cache.incr(cls.CACHE_VERSION)
+        if all_rows:
+            cache.clear()
+        elif ids:
+            cache.delete(*[f"recommendation:{by_id}" for by_id in ids])
+        adjacency.changed(*ids, all_rows=all_rows)
+
+    @classmethod
+    def table_version(cls) -> int:
+        """Returns the version of the table, bumped by every write"""
+        return cache.counter(cls.CACHE_VERSION)
+
+    @classmethod
+    def find_by_name(cls, name, serialized: bool = False):
         """Returns all Recommendations with the given name
 
         Args:
             name (string): the name of the Recommendations you want to match
+            serialized (bool): True to return a list of dictionaries instead
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        return cls._results(cls._reads().filter(cls.name == name), serialized)
 
     @classmethod
-    def find_by_type(cls, recommendation_type):
+    def find_by_type(cls, recommendation_type, serialized: bool = False):
         """Returns all Recommendations with the given recommendation type
 
         Args:
             recommendation_type (string): the recommendation type of the Recommendations you want to match
+            serialized (bool): True to return a list of dictionaries instead
         """
         logger.info(
             "Processing recommendation type query for %s ...", recommendation_type
         )
-        return cls.query.filter(
+        query = cls._reads().filter(
             cls.recommendation_type == EnumRecommendationType[recommendation_type]
         )
+        return cls._results(query, serialized)
 
     @classmethod
-    def find_by_in_stock(cls, recommendation_in_stock: bool = True) -> list:
+    def find_by_in_stock(cls, recommendation_in_stock: bool = True, serialized: bool = False) -> list:
         """Returns all Recommendations by their availability
 
         :param recommendation_in_stock: True for pets that are recommendation_in_stock
         :type recommendation_in_stock: str
+        :param serialized: True to return a list of dictionaries instead
+        :type serialized: bool
 
         :return: a collection of Recommendations that are recommendation_in_stock
         :rtype: list
@@ -203,27 +523,386 @@ class Recommendation(db.Model):
             "Processing recommendation_in_stock query for %s ...",
             recommendation_in_stock,
         )
-        return cls.query.filter(cls.recommendation_in_stock == recommendation_in_stock)
+        query = cls._reads().filter(cls.recommendation_in_stock == recommendation_in_stock)
+        return cls._results(query, serialized)
 
     @classmethod
-    def find_by_recommendation_name(cls, recommendation_name):
+    def find_by_recommendation_name(cls, recommendation_name, serialized: bool = False):
         """Returns all Recommendations with the given recommendation name
 
         Args:
             recommendation_name (string): the recommendation name of the Recommendations you want to match
+            serialized (bool): True to return a list of dictionaries instead
         """
         logger.info(
             "Processing recommendation name query for %s ...", recommendation_name
         )
-        return cls.query.filter(cls.recommendation_name == recommendation_name)
+        query = cls._reads().filter(cls.recommendation_name == recommendation_name)
+        return cls._results(query, serialized)
 
     @classmethod
-    def find_by_recommendation_id(cls, recommendation_id):
+    def find_by_recommendation_id(cls, recommendation_id, serialized: bool = False):
         """Returns all Recommendations with the given recommendation ID
 
         Args:
             recommendation_id (int): the recommendation ID of the Recommendations you want to match
+            serialized (bool): True to return a list of dictionaries instead
         """
         logger.info("Processing recommendation ID query for %s ...", recommendation_id)
 
-        return cls.query.filter(cls.recommendation_id == recommendation_id)
+        query = cls._reads().filter(cls.recommendation_id == recommendation_id)
+        return cls._results(query, serialized)
+
+    @classmethod
+    def _reads(cls):
+        """Returns a query that may be served by a read replica"""
+        return cls.query.execution_options(replica=True)
+
+    @classmethod
+    def _results(cls, query, serialized):
+        """Returns a query, or its rows serialized through the fast path"""
+        if not serialized:
+            return query
+        return list(cls.serialize_rows(cls.select_rows(query)))
+
+    @classmethod
+    def update_by_id(cls, by_id: int, values: dict, *conditions):
+        """
+        Updates one Recommendation with a single UPDATE ... RETURNING
+
+        Args:
+            by_id (int): the id of the Recommendation to update
+            values (dict): the column values to set, see validate
+            conditions: extra WHERE clauses the row must also match
+
+        Returns:
+            the serialized Recommendation, or None if no row matched
+        """
+        logger.info("Updating Recommendation with id %s", by_id)
+        statement = cls.update_statement(values, cls.id == by_id, *conditions).returning(
+            *cls.__table__.columns
+        )
+        try:
+            row = db.session.execute(
+                statement, execution_options={"synchronize_session": False}
+            ).first()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error updating record with id %s", by_id)
+            raise DataValidationError(e) from e
+        if not row:
+            return None
+        cls.invalidate(by_id)
+        return cls.serialize_row(row)
+
+    @classmethod
+    def delete_by_id(cls, by_id: int) -> bool:
+        """
+        Deletes one Recommendation with a single DELETE
+
+        Args:
+            by_id (int): the id of the Recommendation to delete
+
+        Returns:
+            True if a Recommendation was deleted
+        """
+        logger.info("Deleting Recommendation with id %s", by_id)
+        deleted = cls._execute_write(db.delete(cls).where(cls.id == by_id)) > 0
+        if deleted:
+            cls.invalidate(by_id)
+        return deleted
+
+    @classmethod
+    def update_stock_of_target(cls, recommendation_id: int, in_stock: bool) -> int:
+        """
+        Sets the stock of every Recommendation of a product with one UPDATE
+
+        Args:
+            recommendation_id (int): the id of the recommended product
+            in_stock (bool): True if the recommended product is in stock
+
+        Returns:
+            the number of Recommendations whose stock changed
+        """
+        logger.info("Setting the stock of recommendation id %s to %s", recommendation_id, in_stock)
+        try:
+            ids = db.session.scalars(
+                cls.stock_of_target_statement(recommendation_id, in_stock),
+                execution_options={"synchronize_session": False},
+            ).all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error setting the stock of recommendation id %s", recommendation_id)
+            raise DataValidationError(e) from e
+        if ids:
+            cls.invalidate(*ids)
+        return len(ids)
+
+    @classmethod
+    def stock_of_target_statement(cls, recommendation_id: int, in_stock: bool):
+        """Returns an UPDATE ... RETURNING id of the rows of a recommended product whose stock differs"""
+        return cls.update_statement(
+            {"recommendation_in_stock": in_stock},
+            cls.recommendation_id == recommendation_id,
+            cls.recommendation_in_stock.isnot(in_stock),
+        ).returning(cls.id)
+
+    @classmethod
+    def exists(cls, by_id: int) -> bool:
+        """Returns True if a Recommendation with the id exists"""
+        return db.session.scalar(db.select(cls.id).where(cls.id == by_id)) is not None
+
+    @classmethod
+    def update_where(cls, filters: dict, values: dict) -> int:
+        """
+        Updates every Recommendation matching the filters with one UPDATE
+
+        Args:
+            filters (dict): the filters to AND together, see filter_clauses
+            values (dict): the column values to set, see validate
+
+        Returns:
+            the number of Recommendations that were updated
+        """
+        logger.info("Updating Recommendations matching %s", filters)
+        statement = cls.update_statement(values, *cls.filter_clauses(filters))
+        count = cls._execute_write(statement)
+        cls.invalidate(all_rows=True)
+        return count
+
+    @classmethod
+    def delete_where(cls, filters: dict) -> int:
+        """
+        Deletes every Recommendation matching the filters with one DELETE
+
+        Args:
+            filters (dict): the filters to AND together, see filter_clauses
+
+        Returns:
+            the number of Recommendations that were deleted
+        """
+        logger.info("Deleting Recommendations matching %s", filters)
+        statement = db.delete(cls).where(*cls.filter_clauses(filters))
+        count = cls._execute_write(statement)
+        cls.invalidate(all_rows=True)
+        return count
+
+    @classmethod
+    def update_statement(cls, values: dict, *clauses):
+        """Returns an UPDATE of the rows matching the clauses that bumps their version"""
+        return db.update(cls).where(*clauses).values({**values, "version": cls.version + 1})
+
+    @classmethod
+    def _execute_write(cls, statement) -> int:
+        """Executes a set based write in its own transaction"""
+        try:
+            result = db.session.execute(
+                statement, execution_options={"synchronize_session": False}
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error executing %s", statement)
+            raise DataValidationError(e) from e
+        return result.rowcount
+
+    @classmethod
+    def find_by_filters(cls, filters: dict):
+        """Returns all Recommendations matching every one of the given filters
+
+        Args:
+            filters (dict): the filters to AND together, see filter_clauses
+        """
+        logger.info("Processing filter query for %s ...", filters)
+        return cls._reads().filter(*cls.filter_clauses(filters))
+
+    @classmethod
+    def filter_clauses(cls, filters: dict) -> list:
+        """Returns the WHERE clauses for a set of filters
+
+        Each of ``id``, ``name``, ``recommendation_type``, ``recommendation_name``
+        and ``recommendation_id`` may be a single value or a list of values to
+        match with IN, ``recommendation_in_stock`` is a bool, and ``id`` and
+        ``recommendation_id`` also accept inclusive ``_min``/``_max`` bounds.
+
+        Args:
+            filters (dict): a dictionary of column names or bounds to values
+        """
+        clauses = []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key == "recommendation_in_stock":
+                clauses.append(cls.recommendation_in_stock == value)
+            elif key in ("id_min", "recommendation_id_min"):
+                clauses.append(getattr(cls, key[:-4]) >= value)
+            elif key in ("id_max", "recommendation_id_max"):
+                clauses.append(getattr(cls, key[:-4]) <= value)
+            elif key in ("id", "name", "recommendation_type", "recommendation_name", "recommendation_id"):
+                clauses.append(cls._match(key, value))
+            else:
+                raise DataValidationError(f"Invalid filter: {key}")
+        return clauses
+
+    @classmethod
+    def _match(cls, key, value):
+        """Returns an equality or IN clause for one column"""
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        if key == "recommendation_type":
+            try:
+                values = [EnumRecommendationType[item] for item in values]
+            except KeyError as error:
+                raise DataValidationError(
+                    "Invalid recommendation type: " + error.args[0]
+                ) from error
+        column = getattr(cls, key)
+        if len(values) == 1:
+            return column == values[0]
+        return column.in_(values)
+
+    @classmethod
+    def paginate(cls, query, limit: int, cursor: str = None, sort: str = "id"):
+        """Returns one page of a query using keyset pagination
+
+        Rows are ordered by the sort column with ``id`` as a tie breaker, and
+        the next page starts after the last row of this one instead of at an
+        OFFSET, so every page costs the same no matter how deep it is.
+
+        Args:
+            query (Query): the filtered query to page through
+            limit (int): the maximum number of Recommendations to return
+            cursor (string): the opaque cursor returned with the previous page
+            sort (string): the column to sort on, prefixed with "-" for descending
+
+        Returns:
+            a tuple of the list of Recommendations and the cursor of the next
+            page, which is None when this is the last page
+        """
+        logger.info("Processing page query sorted by %s with limit %d ...", sort, limit)
+        rows = cls.page_query(query, limit, cursor, sort).all()
+        return cls.page_rows(rows, limit, sort)
+
+    @classmethod
+    def page_query(cls, query, limit: int, cursor: str = None, sort: str = "id"):
+        """Returns a query for one page and one extra row, see paginate
+
+        The query may be an ORM Query or a Core Select.
+        """
+        column_name, descending = cls._sort_column(sort)
+        if cursor:
+            try:
+                cursor_sort, value, last_id = decode_cursor(cursor)
+            except ValueError as error:
+                raise DataValidationError(str(error)) from error
+            if cursor_sort != sort:
+                raise DataValidationError(f"Cursor was not issued for sort order: {sort}")
+            query = query.filter(cls._after(getattr(cls, column_name), value, last_id, descending))
+        return cls.sort_query(query, sort).limit(limit + 1)
+
+    @classmethod
+    def page_rows(cls, rows: list, limit: int, sort: str = "id"):
+        """Splits the rows of page_query() into the page and the next cursor"""
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, encode_cursor(sort, getattr(last, sort.lstrip("-")), last.id)
+
+    @classmethod
+    def product_query(cls, name: str, recommendation_type: str = None, limit: int = 10, top: bool = False):
+        """Returns a query for what a product recommends, in the order of the adjacency index
+
+        The rows are grouped by type in the order of EnumRecommendationType,
+        highest score first, or with top ordered by score across the types.
+        """
+        query = db.select(*cls.read_columns()).where(cls.name == name)
+        if recommendation_type is not None:
+            query = query.where(cls.recommendation_type == EnumRecommendationType[recommendation_type])
+        order = [cls.score.desc(), cls.id.desc()]
+        if not top:
+            type_codes = [(cls.recommendation_type == member, code) for code, member in enumerate(EnumRecommendationType)]
+            order.insert(0, db.case(*type_codes))
+        return query.order_by(*order).limit(limit)
+
+    @staticmethod
+    def item_etag(data: dict, version: int) -> str:
+        """Returns the entity tag of a serialized Recommendation
+
+        The id and version change with every write, and the digest of the
+        content keeps a row recreated under a reused id from matching the
+        tag of the row that was deleted.
+        """
+        digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        return f"{data['id']}-{version}-{digest}"
+
+    @staticmethod
+    def page_etag(rows, next_cursor: str = None) -> str:
+        """Returns the entity tag of a page from its rows and its next cursor
+
+        Every column of every row is hashed, so a row recreated under a
+        reused id changes the tag, and so does the next cursor, so a client
+        holding the last page learns when a next page appears.
+        """
+        content = repr([tuple(row) for row in rows] + [next_cursor])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+    @classmethod
+    def stream(cls, query, sort: str = "id", batch_size: int = 1000):
+        """Iterates over every row of a query without loading them all at once
+
+        Rows are fetched from a server side cursor ``batch_size`` at a time, so
+        memory stays flat however many rows the query matches.
+
+        Args:
+            query (Query): the filtered query to iterate over
+            sort (string): the column to sort on, prefixed with "-" for descending
+            batch_size (int): the number of rows to fetch per round trip
+        """
+        logger.info("Processing streaming query sorted by %s ...", sort)
+        return cls.sort_query(query, sort).yield_per(batch_size)
+
+    @classmethod
+    def sort_query(cls, query, sort: str = "id"):
+        """Orders a query by a sort argument with id as the tie breaker"""
+        return query.order_by(*cls._order_by(sort))
+
+    @classmethod
+    def _sort_column(cls, sort):
+        """Returns the column name and direction of a sort argument"""
+        column_name = sort.lstrip("-")
+        if column_name not in cls.SORTABLE_COLUMNS:
+            raise DataValidationError(f"Invalid sort column: {column_name}")
+        return column_name, sort.startswith("-")
+
+    @classmethod
+    def _order_by(cls, sort):
+        """Returns the ORDER BY clauses of a sort argument"""
+        column_name, descending = cls._sort_column(sort)
+        if column_name == "id":
+            return [cls.id.desc() if descending else cls.id.asc()]
+        column = getattr(cls, column_name)
+        order = column.desc() if descending else column.asc()
+        # NULLs sort last, which a column without them need not spell out
+        # for the database to read it in the order of an index
+        if column.nullable:
+            order = order.nulls_last()
+        return [order, cls.id.desc() if descending else cls.id.asc()]
+
+    @classmethod
+    def _after(cls, column, value, last_id, descending):
+        """Returns the keyset clause that selects the rows after a cursor"""
+        id_after = cls.id < last_id if descending else cls.id > last_id
+        if column is cls.id:
+            return id_after
+        # NULLs sort last in both directions, so once the cursor is in the
+        # NULL region only NULL rows with a later id remain
+        if value is None:
+            return db.and_(column.is_(None), id_after)
+        column_after = column < value if descending else column > value
+        if not column.nullable:
+            return db.or_(column_after, db.and_(column == value, id_after))
+        return db.or_(
+            column_after, db.and_(column == value, id_after), column.is_(None)
+        )
@@ -21,10 +21,24 @@ This service implements a REST API that allows you to Create, Read, Update
 and Delete Recommendations from the inventory of recommendations in the RecommendationShop
 """
 
-from flask import jsonify, request, url_for, abort
+import json
+import hashlib
+from itertools import islice
+from flask import jsonify, request, url_for, abort, Response, stream_with_context
 from flask import current_app as app  # Import Flask application
-from service.models import Recommendation
+from werkzeug.exceptions import BadRequest
+from service.models import db, Recommendation, DataValidationError
 from service.common import status  # HTTP Status Codes
+from service.common.cache import cache
+from service.common.adjacency import adjacency
+from service.common.metrics import metrics
+from service.common.pool import pool_stats
+from service.common.replicas import replicas
+from service.common.query_args import parse_filters, parse_bulk_filters
+from service.common.handlers import (
+    NDJSON, Batch, StreamEncoder, cache_headers, list_args, next_page_args, not_found, page_headers, product_args,
+    restock_failed, update_values,
+)
 
 
 ######################################################################
@@ -71,6 +85,29 @@ def create_recommendations():
     return jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
 
 
+######################################################################
+# CREATE A BATCH OF Recommendations
+######################################################################
+@app.route("/recommendations/batch", methods=["POST"])
+def create_recommendations_batch():
+    """
+    Creates many Recommendations
+
+    This endpoint takes a JSON array or an NDJSON body, validates every item
+    and inserts the valid ones with multi-row INSERTs, one transaction per chunk
+    """
+    app.logger.info("Request to create a batch of Recommendations")
+    check_content_type("application/json", NDJSON)
+
+    batch = Batch(app.config["BATCH_CHUNK_SIZE"])
+    for position, item in batch_items():
+        insert_chunk(batch.add(position, item), batch)
+    insert_chunk(batch.rest(), batch)
+
+    message, status_code = batch.result()
+    return jsonify(message), status_code
+
+
 ######################################################################
 # READ A Recommendation
 ######################################################################
@@ -83,15 +120,21 @@ def get_recommendations(product_id):
     """
     app.logger.info("Request for recommendation with id: %s", product_id)
 
-    recommendation = Recommendation.find(product_id)
-    if not recommendation:
+    found = Recommendation.find_serialized(product_id)
+    if not found:
         error(
             status.HTTP_404_NOT_FOUND,
             f"Recommendation with id '{product_id}' was not found.",
         )
 
-    app.logger.info("Returning recommendation: %s", recommendation.name)
-    return jsonify(recommendation.serialize()), status.HTTP_200_OK
+    recommendation, version = found
+    etag = Recommendation.item_etag(recommendation, version)
+    if request.if_none_match.contains_weak(etag):
+        app.logger.info("Recommendation with id %s not modified", product_id)
+        return not_modified(etag)
+
+    app.logger.info("Returning recommendation: %s", recommendation["name"])
+    return jsonify(recommendation), status.HTTP_200_OK, cache_headers(app.config, etag)
 
 
 ######################################################################
@@ -107,19 +150,7 @@ def update_recommendations(product_id):
     app.logger.info("Request to update recommendations with id: %d", product_id)
     check_content_type("application/json")
 
-    recommendations = Recommendation.find(product_id)
-    if not recommendations:
-        error(
-            status.HTTP_404_NOT_FOUND,
-            f"Recommendation with id: '{product_id}' was not found.",
-        )
-
-    recommendations.deserialize(request.get_json())
-    recommendations.id = product_id
-    recommendations.update()
-
-    app.logger.info("Recommendation with ID: %d updated.", recommendations.id)
-    return jsonify(recommendations.serialize()), status.HTTP_200_OK
+    return update_recommendation(product_id)
 
 
 ######################################################################
@@ -136,19 +167,7 @@ def update_recommendations_id(product_id, recommendations_id):
     app.logger.info("Request to update recommendations with id: %d", product_id)
     check_content_type("application/json")
 
-    recommendations = Recommendation.find(product_id)
-    if not recommendations:
-        error(
-            status.HTTP_404_NOT_FOUND,
-            f"Recommendation with id: '{product_id}' was not found.",
-        )
-
-    recommendations.deserialize(request.get_json())
-    recommendations.recommendation_id = recommendations_id
-    recommendations.update()
-
-    app.logger.info("Recommendation with ID: %d updated.", recommendations.id)
-    return jsonify(recommendations.serialize()), status.HTTP_200_OK
+    return update_recommendation(product_id, recommendation_id=recommendations_id)
 
 
 ######################################################################
@@ -163,19 +182,7 @@ def update_recommendations_name(product_id, name):
     app.logger.info("Request to update recommendations with id: %d", product_id)
     check_content_type("application/json")
 
-    recommendations = Recommendation.find(product_id)
-    if not recommendations:
-        error(
-            status.HTTP_404_NOT_FOUND,
-            f"Recommendation with id: '{product_id}' was not found.",
-        )
-
-    recommendations.deserialize(request.get_json())
-    recommendations.recommendation_name = name
-    recommendations.update()
-
-    app.logger.info("Recommendation with ID: %d updated.", recommendations.id)
-    return jsonify(recommendations.serialize()), status.HTTP_200_OK
+    return update_recommendation(product_id, recommendation_name=name)
 
 
 ######################################################################
@@ -190,9 +197,7 @@ def delete_recommendations(recommendation_id):
     """
     app.logger.info("Request to delete recommendations with id: %d", recommendation_id)
 
-    recommendations = Recommendation.find(recommendation_id)
-    if recommendations:
-        recommendations.delete()
+    Recommendation.delete_by_id(recommendation_id)
 
     app.logger.info("Recommendation with ID: %d delete complete.", recommendation_id)
     return "", status.HTTP_204_NO_CONTENT
@@ -206,37 +211,87 @@ def list_recommendations():
     """Returns all of the recommendations"""
     app.logger.info("Request for recommendations list")
 
-    recommendations = []
-
-    # See if any query filters were passed in
-    name = request.args.get("name")
-    in_stock = request.args.get("recommendation_in_stock")
-    recommendation_type = request.args.get("recommendation_type")
-    recommendation_name = request.args.get("recommendation_name")
-    recommendation_id = request.args.get("recommendation_id")
-
-    if name:
-        recommendations = Recommendation.find_by_name(name)
-    elif in_stock:
-        app.logger.info("Find by in_stock: %s", in_stock)
-        # create bool from string
-        available_value = in_stock.lower() in ["true", "yes", "1"]
-        recommendations = Recommendation.find_by_in_stock(available_value)
-    elif recommendation_type:
-        recommendations = Recommendation.find_by_type(recommendation_type)
-    elif recommendation_name:
-        recommendations = Recommendation.find_by_recommendation_name(
-            recommendation_name
-        )
-    elif recommendation_id:
-        recommendation_id = int(recommendation_id)
-        recommendations = Recommendation.find_by_recommendation_id(recommendation_id)
-    else:
-        recommendations = Recommendation.all()
+    return list_matching(parse_filters(request.args))
 
-    results = [recommendation.serialize() for recommendation in recommendations]
-    app.logger.info("Returning %d recommendations", len(results))
-    return jsonify(results), status.HTTP_200_OK
+
+######################################################################
+# LIST THE RECOMMENDATIONS OF A RECOMMENDED PRODUCT
+######################################################################
+@app.route("/recommendations/targets/<int:recommendation_id>", methods=["GET"])
+def list_recommendations_of_target(recommendation_id):
+    """
+    Returns every recommendation that points at a product
+
+    This endpoint reads through the recommendation_id index and takes the
+    same filters, paging and streaming as the list of all recommendations
+    """
+    app.logger.info("Request for the recommendations of recommendation id %d", recommendation_id)
+
+    filters = parse_filters(request.args)
+    filters["recommendation_id"] = [recommendation_id]
+    return list_matching(filters)
+
+
+######################################################################
+# SET THE STOCK OF EVERY RECOMMENDATION OF A RECOMMENDED PRODUCT
+######################################################################
+@app.route("/recommendations/targets/<int:recommendation_id>/stock", methods=["PUT"])
+def update_stock_of_target(recommendation_id):
+    """
+    Sets recommendation_in_stock on every recommendation that points at a product
+
+    This endpoint changes every row whose stock differs with a single UPDATE
+    and returns how many were changed
+    """
+    app.logger.info("Request to set the stock of recommendation id %d", recommendation_id)
+    check_content_type("application/json")
+
+    in_stock = Recommendation.validate_stock(request.get_json())
+    count = Recommendation.update_stock_of_target(recommendation_id, in_stock)
+
+    app.logger.info("Set the stock of %d recommendations.", count)
+    return jsonify(updated=count), status.HTTP_200_OK
+
+
+######################################################################
+# UPDATE ALL RECOMMENDATIONS MATCHING A FILTER
+######################################################################
+@app.route("/recommendations", methods=["PATCH"])
+def update_recommendations_by_filter():
+    """
+    Update every Recommendation matching the query filters
+
+    This endpoint sets the fields in the body on every matching Recommendation
+    with a single UPDATE statement and returns how many were changed
+    """
+    app.logger.info("Request to update recommendations matching %s", request.args)
+    check_content_type("application/json")
+
+    filters = parse_bulk_filters(request.args)
+    values = Recommendation.validate(request.get_json(), partial=True)
+    count = Recommendation.update_where(filters, values)
+
+    app.logger.info("Updated %d recommendations.", count)
+    return jsonify(updated=count), status.HTTP_200_OK
+
+
+######################################################################
+# DELETE ALL RECOMMENDATIONS MATCHING A FILTER
+######################################################################
+@app.route("/recommendations", methods=["DELETE"])
+def delete_recommendations_by_filter():
+    """
+    Delete every Recommendation matching the query filters
+
+    This endpoint removes every matching Recommendation with a single DELETE
+    statement and returns how many were removed
+    """
+    app.logger.info("Request to delete recommendations matching %s", request.args)
+
+    count = Recommendation.delete_where(parse_bulk_filters(request.args))
+
+    app.logger.info("Deleted %d recommendations.", count)
+    return jsonify(deleted=count), status.HTTP_200_OK
 
 
 ######################################################################
@@ -247,28 +302,37 @@ def restock_recommendations(product_id):
     """Restock a recommendation to make it in stock"""
     app.logger.info("Request to restock recommendation with id: %d", product_id)
 
-    # Attempt to find the Pet and abort if not found
-    recommendation = Recommendation.find(product_id)
+    # you can only restock when they are not in stock, so the stock check is
+    # part of the UPDATE itself and concurrent restocks cannot both succeed
+    recommendation = Recommendation.update_by_id(
+        product_id,
+        {"recommendation_in_stock": True},
+        Recommendation.recommendation_in_stock.is_(False),
+    )
     if not recommendation:
-        abort(
-            status.HTTP_404_NOT_FOUND, f"Product with id '{product_id}' was not found."
-        )
+        restock_failed(product_id, Recommendation.exists(product_id))
 
-    # you can only restock when they are not in stock
-    if recommendation.recommendation_in_stock:
-        abort(
-            status.HTTP_409_CONFLICT,
-            f"Recommendation for id '{product_id}' is already in stock.",
-        )
+    app.logger.info("Recommendation with ID: %d has been restocked.", product_id)
+    return recommendation, status.HTTP_200_OK
+
+
+######################################################################
+# LIST THE RECOMMENDATIONS OF A PRODUCT
+######################################################################
+@app.route("/products/<name>/recommendations", methods=["GET"])
+def list_product_recommendations(name):
+    """
+    Returns what a product recommends, optionally of one type
 
-    # At this point you would execute code to purchase the pet
-    # For the moment, we will just set them to unavailable
+    This endpoint is answered from the in-memory adjacency index without a
+    query, grouped by type with the highest scores first, or with top as
+    the highest scores of any type
+    """
+    app.logger.info("Request for the recommendations of product %s", name)
 
-    recommendation.recommendation_in_stock = True
-    recommendation.update()
+    recommendation_type, limit, by_score = product_args(request.args, app.config)
 
-    app.logger.info("Pet with ID: %d has been purchased.", product_id)
-    return recommendation.serialize(), status.HTTP_200_OK
+    return jsonify(adjacency.lookup(name, recommendation_type, limit, by_score)), status.HTTP_200_OK
 
 
 ######################################################################
@@ -280,6 +344,27 @@ def health():
     return {"status": "OK"}, status.HTTP_200_OK
 
 
+######################################################################
+# GET SERVICE STATISTICS
+######################################################################
+@app.route("/stats")
+def service_stats():
+    """Runtime statistics of this worker"""
+    return {"cache": cache.stats(), "pool": pool_stats(db.engine), "adjacency": adjacency.stats()}, status.HTTP_200_OK
+
+
+######################################################################
+# GET PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics")
+def prometheus_metrics():
+    """Request, database and cache metrics of every worker"""
+    if not metrics.enabled:
+        abort(status.HTTP_404_NOT_FOUND, "Metrics need the prometheus_client package")
+    body, content_type = metrics.render()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
@@ -288,25 +373,216 @@ def health():
 ######################################################################
 # Checks the ContentType of a request
 ######################################################################
-def check_content_type(content_type):
-    """Checks that the media type is correct"""
+def check_content_type(*content_types):
+    """Checks that the media type is one of the given types"""
+    expected = " or ".join(content_types)
     if "Content-Type" not in request.headers:
         app.logger.error("No Content-Type specified.")
         error(
             status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            f"Content-Type must be {content_type}",
+            f"Content-Type must be {expected}",
         )
 
-    if request.headers["Content-Type"] == content_type:
+    if request.headers["Content-Type"] in content_types:
         return
 
     app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
     error(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-        f"Content-Type must be {content_type}",
+        f"Content-Type must be {expected}",
+    )
+
+
+######################################################################
+# Updates one recommendation
+######################################################################
+def update_recommendation(product_id, **path_values):
+    """Updates a Recommendation from the request body and path in one statement and returns it"""
+    try:
+        values = update_values(request.get_json(), path_values)
+    except (DataValidationError, BadRequest):
+        if not Recommendation.exists(product_id):
+            error(status.HTTP_404_NOT_FOUND, not_found(product_id))
+        raise
+    recommendation = Recommendation.update_by_id(product_id, values)
+    if not recommendation:
+        error(status.HTTP_404_NOT_FOUND, not_found(product_id))
+
+    app.logger.info("Recommendation with ID: %d updated.", product_id)
+    return jsonify(recommendation), status.HTTP_200_OK
+
+
+######################################################################
+# Reads the items of a batch request
+######################################################################
+def batch_items():
+    """Yields (position, item) for each item of a JSON array or NDJSON body
+
+    NDJSON bodies are read a line at a time so they never have to be held
+    in memory whole. An item that is not valid JSON is yielded as None.
+    """
+    if request.headers["Content-Type"] == NDJSON:
+        position = 0
+        for line in read_lines(request.stream):
+            if not line.strip():
+                continue
+            try:
+                yield position, app.json.loads(line)
+            except ValueError:
+                yield position, None
+            position += 1
+        return
+
+    items = request.get_json()
+    if not isinstance(items, list):
+        error(status.HTTP_400_BAD_REQUEST, "Batch body must be a JSON array")
+    yield from enumerate(items)
+
+
+def read_lines(stream, chunk_size=65536):
+    """Yields the lines of a byte stream reading it in large chunks"""
+    pending = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    yield pending
+
+
+def insert_chunk(chunk, batch):
+    """Inserts one chunk of validated (position, values) pairs, row by row if the chunk fails"""
+    if not chunk:
+        return
+    try:
+        batch.created.extend(Recommendation.create_many([values for _, values in chunk]))
+    except DataValidationError as err:
+        if len(chunk) > 1:
+            for item in chunk:
+                insert_chunk([item], batch)
+            return
+        batch.reject(chunk[0][0], err)
+
+
+######################################################################
+# Returns one page of a list of recommendations
+######################################################################
+def list_matching(filters):
+    """Returns a page of the recommendations matching the filters, or streams them all"""
+    # AND together every query filter that was passed in, and read plain
+    # rows instead of Recommendation objects since they are only serialized
+    recommendations = Recommendation.select_rows(Recommendation.find_by_filters(filters))
+
+    ndjson = request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+    listing = list_args(request.args, app.config, ndjson)
+    if listing.stream:
+        batch_size = app.config["STREAM_BATCH_SIZE"]
+        rows = Recommendation.stream(recommendations, listing.sort, batch_size)
+        return stream_recommendations(rows, batch_size, ndjson)
+
+    return page_recommendations(recommendations, listing, filters)
+
+
+def page_recommendations(query, listing, filters):
+    """Returns one page of a query with a link to the next page, or the top rows
+
+    Pages are cached as encoded JSON under the normalized request and the
+    table version, so a repeat request skips both the query and the
+    serialization until a write bumps the version. The ETag of a page is
+    derived from its rows and next cursor, so a client that already holds
+    the page gets a 304 without the page being serialized.
+    """
+    key = list_cache_key(filters, listing)
+    cached = None if replicas.pinned() else cache.get(key)
+    if cached is not None:
+        headers, body = unpack_response(cached)
+        etag = headers["ETag"].strip('"')
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag, page=True)
+        app.logger.info("Returning cached recommendations")
+        return Response(body, status.HTTP_200_OK, headers, mimetype="application/json")
+
+    page, next_cursor = Recommendation.paginate(query, listing.limit, listing.cursor, listing.sort)
+    if listing.top:
+        next_cursor = None
+    etag = Recommendation.page_etag(page, next_cursor)
+    if request.if_none_match.contains_weak(etag):
+        app.logger.info("Recommendations not modified")
+        return not_modified(etag, page=True)
+
+    results = list(Recommendation.serialize_rows(page))
+    headers = page_headers(app.config, etag, next_cursor, next_cursor and next_page_url(next_cursor))
+
+    body = app.json.dumps_rows(results) + b"\n"
+    cache.set(key, pack_response(headers, body))
+    app.logger.info("Returning %d recommendations", len(results))
+    return Response(body, status.HTTP_200_OK, headers, mimetype="application/json")
+
+
+def next_page_url(next_cursor):
+    """Returns the URL of the page after a cursor"""
+    return url_for(request.endpoint, _external=True, **request.view_args, **next_page_args(request.args, next_cursor))
+
+
+def list_cache_key(filters, listing):
+    """Returns the cache key of a list request"""
+    normalized = {
+        key: sorted(value) if isinstance(value, list) else value
+        for key, value in filters.items()
+    }
+    request_key = json.dumps(
+        [request.base_url, normalized, listing.sort, listing.limit, listing.cursor, listing.top], sort_keys=True
+    )
+    digest = hashlib.sha256(request_key.encode("utf-8")).hexdigest()
+    return f"recommendations:{Recommendation.table_version()}:{digest}"
+
+
+def pack_response(headers, body):
+    """Packs response headers and an encoded body into one cache value"""
+    return json.dumps(headers).encode("utf-8") + b"\n" + body
+
+
+def unpack_response(packed):
+    """Unpacks the headers and body of a cached response"""
+    headers, body = packed.split(b"\n", 1)
+    return json.loads(headers), body
+
+
+######################################################################
+# Conditional GET support
+######################################################################
+def not_modified(etag, page=False):
+    """Returns an empty 304 Not Modified response for an entity tag of an item or a page"""
+    return Response(
+        status=status.HTTP_304_NOT_MODIFIED,
+        headers=page_headers(app.config, etag) if page else cache_headers(app.config, etag),
     )
 
 
+######################################################################
+# Streams a list of recommendations
+######################################################################
+def stream_recommendations(rows, batch_size, ndjson):
+    """Streams rows as newline delimited JSON or as a chunked JSON array
+
+    Rows are encoded as they come off the database cursor and written out
+    ``batch_size`` at a time, so the response never holds the full result.
+    """
+    app.logger.info("Streaming recommendations as %s", NDJSON if ndjson else "a JSON array")
+    encoder = StreamEncoder(ndjson, app.json.dumps_rows)
+
+    def generate():
+        yield encoder.start()
+        rows_left = iter(rows)
+        while batch := list(islice(rows_left, batch_size)):
+            yield encoder.encode(batch)
+        yield encoder.end()
+
+    return Response(stream_with_context(generate()), status.HTTP_200_OK, mimetype=encoder.content_type)
+
+
 ######################################################################
 # Logs error messages before aborting
 ######################################################################
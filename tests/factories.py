@@ -5,7 +5,7 @@ Test Factory to make fake objects for testing
 # from datetime import date
 
 import factory
-from factory.fuzzy import FuzzyChoice
+from factory.fuzzy import FuzzyChoice, FuzzyFloat
 from service.models import Recommendation, EnumRecommendationType
 
 
@@ -24,3 +24,4 @@ class RecommendationFactory(factory.Factory):
     recommendation_type = EnumRecommendationType.UNKNOWN
     recommendation_name = FuzzyChoice(choices=["apple", "banana", "steak", "fish"])
     recommendation_id = factory.Sequence(lambda n: n)
+    score = FuzzyFloat(0, 1)
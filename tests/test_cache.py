@@ -0,0 +1,171 @@
+"""
+Test cases for the Cache
+"""
+import fnmatch
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from service.common.cache import Cache, LRUCache, NullCache, RedisCache
+
+
+class FakeRedis:
+    """A dictionary standing in for the few Redis calls the cache makes"""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    def get(self, key):
+        """Returns a value"""
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        """Stores a value"""
+        self.data[key] = value
+        self.expiry[key] = ex
+
+    def delete(self, *keys):
+        """Removes keys"""
+        for key in keys:
+            self.data.pop(key, None)
+
+    def incr(self, key):
+        """Adds one to a counter"""
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+
+    def scan_iter(self, match):
+        """Yields the keys matching a pattern"""
+        yield from [key for key in self.data if fnmatch.fnmatch(key, match)]
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(TestCase):
+    """In-process LRU Cache Tests"""
+
+    def test_get_and_set(self):
+        """It should return stored values and None for missing keys"""
+        lru = LRUCache(maxsize=10, ttl=60)
+        self.assertIsNone(lru.get("a"))
+        lru.set("a", b"1")
+        self.assertEqual(lru.get("a"), b"1")
+        lru.delete("a", "missing")
+        self.assertIsNone(lru.get("a"))
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set("a", b"1")
+        lru.set("b", b"2")
+        lru.get("a")
+        lru.set("c", b"3")
+        self.assertEqual(len(lru), 2)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("a"), b"1")
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+    def test_counters_survive_clear(self):
+        """It should keep counters when the entries are cleared"""
+        lru = LRUCache(maxsize=1, ttl=60)
+        self.assertEqual(lru.counter("version"), 0)
+        lru.incr("version")
+        lru.incr("version")
+        lru.set("a", b"1")
+        lru.set("b", b"2")
+        lru.clear()
+        self.assertEqual(lru.counter("version"), 2)
+
+    @patch("service.common.cache.time.monotonic")
+    def test_expire_after_ttl(self, monotonic_mock):
+        """It should expire entries after the TTL"""
+        monotonic_mock.return_value = 100.0
+        lru = LRUCache(maxsize=2, ttl=5)
+        lru.set("a", b"1")
+        monotonic_mock.return_value = 104.0
+        self.assertEqual(lru.get("a"), b"1")
+        monotonic_mock.return_value = 105.0
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(len(lru), 0)
+
+
+class TestRedisCache(TestCase):
+    """Redis Cache Tests"""
+
+    def test_prefixed_keys(self):
+        """It should store prefixed keys that expire after the TTL"""
+        client = FakeRedis()
+        redis_cache = RedisCache(client, ttl=30, prefix="test:")
+        redis_cache.set("a", b"1")
+        self.assertEqual(client.data, {"test:a": b"1"})
+        self.assertEqual(client.expiry, {"test:a": 30})
+        self.assertEqual(redis_cache.get("a"), b"1")
+        redis_cache.delete()
+        redis_cache.delete("a")
+        self.assertIsNone(redis_cache.get("a"))
+
+    def test_clear_only_own_prefix(self):
+        """It should clear only the keys under its prefix"""
+        client = FakeRedis()
+        client.set("other:a", b"keep")
+        redis_cache = RedisCache(client, prefix="test:")
+        for key in range(1200):
+            redis_cache.set(str(key), b"x")
+        redis_cache.incr("version")
+        redis_cache.clear()
+        self.assertEqual(sorted(client.data), ["other:a", "test-counters:version"])
+        self.assertEqual(redis_cache.counter("version"), 1)
+        self.assertEqual(redis_cache.counter("missing"), 0)
+
+
+class TestCache(TestCase):
+    """Cache Front End Tests"""
+
+    def test_backend_from_config(self):
+        """It should create the backend named in the configuration"""
+        app = Flask(__name__)
+        cache = Cache()
+        self.assertIsInstance(cache.backend, NullCache)
+        cache.incr("version")
+        self.assertEqual(cache.counter("version"), 0)
+        for name, backend in [("memory", LRUCache), ("none", NullCache)]:
+            app.config["CACHE_BACKEND"] = name
+            cache.init_app(app)
+            self.assertIsInstance(cache.backend, backend)
+        self.assertIs(app.extensions["cache"], cache)
+        app.config["CACHE_BACKEND"] = "bogus"
+        self.assertRaises(ValueError, cache.init_app, app)
+
+    def test_redis_backend_from_config(self):
+        """It should connect to Redis when configured"""
+        app = Flask(__name__)
+        app.config.update(CACHE_BACKEND="redis", CACHE_REDIS_URL="redis://cache:6379/0")
+        redis_module = MagicMock()
+        redis_module.Redis.from_url.return_value = FakeRedis()
+        with patch.dict("sys.modules", {"redis": redis_module}):
+            cache = Cache()
+            cache.init_app(app)
+        redis_module.Redis.from_url.assert_called_once_with("redis://cache:6379/0")
+        self.assertIsInstance(cache.backend, RedisCache)
+        self.assertIsInstance(cache.backend.client, FakeRedis)
+        with patch.dict("sys.modules", {"redis": None}):
+            with self.assertRaisesRegex(ImportError, "--extras redis"):
+                Cache().init_app(app)
+
+    def test_count_hits_and_misses(self):
+        """It should count hits and misses"""
+        cache = Cache()
+        cache.backend = LRUCache()
+        self.assertEqual(cache.stats()["hit_ratio"], 0.0)
+        cache.get("a")
+        cache.set("a", b"1")
+        cache.get("a")
+        cache.get("a")
+        self.assertEqual(cache.stats(), {"backend": "LRUCache", "hits": 2, "misses": 1, "hit_ratio": 2 / 3})
+        cache.incr("version")
+        self.assertEqual(cache.counter("version"), 1)
+        cache.delete("a")
+        cache.clear()
+        cache.reset_stats()
+        self.assertEqual(cache.stats()["hits"], 0)
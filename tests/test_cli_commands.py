@@ -23,3 +23,13 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.upgrade_schema')
+    def test_db_migrate(self, upgrade_mock):
+        """It should call the db-migrate command"""
+        upgrade_mock.return_value = ["Created index ix_test on test"]
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["db-migrate"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Created index ix_test on test", result.output)
+        self.assertIn("1 changes applied", result.output)
@@ -0,0 +1,81 @@
+"""
+Test cases for the JSON Providers
+"""
+import uuid
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask, jsonify
+from service.models import EnumRecommendationType
+from service.common import json_provider
+from service.common.json_provider import OrjsonProvider, StdlibJSONProvider
+
+
+def make_app(name):
+    """Returns a Flask app with the named JSON provider installed"""
+    app = Flask(__name__)
+    app.config["JSON_PROVIDER"] = name
+    json_provider.init_app(app)
+    return app
+
+
+######################################################################
+#  J S O N   P R O V I D E R   T E S T   C A S E S
+######################################################################
+class TestJSONProvider(TestCase):
+    """JSON Provider Tests"""
+
+    def test_init_app(self):
+        """It should install the provider named by JSON_PROVIDER"""
+        self.assertIsInstance(make_app("orjson").json, OrjsonProvider)
+        self.assertIsInstance(make_app("stdlib").json, StdlibJSONProvider)
+        self.assertIsInstance(make_app("auto").json, OrjsonProvider)
+        self.assertRaises(ValueError, make_app, "simplejson")
+
+    def test_init_app_without_orjson(self):
+        """It should fall back to the standard library when orjson is missing"""
+        with patch.object(json_provider, "orjson", None):
+            self.assertIsInstance(make_app("auto").json, StdlibJSONProvider)
+            self.assertRaises(ValueError, make_app, "orjson")
+
+    def test_providers_agree(self):
+        """It should encode the same data the same way with either provider"""
+        data = {
+            "id": 1,
+            "recommendation_in_stock": False,
+            "recommendation_type": EnumRecommendationType.UP_SELL,
+            "types": (EnumRecommendationType.CROSS_SELL, [{"type": EnumRecommendationType.ACCESSORY}]),
+            "name": "café",
+            "uuid": uuid.UUID(int=7),
+            "nothing": None,
+        }
+        decoded = []
+        for name in ["orjson", "stdlib"]:
+            provider = make_app(name).json
+            self.assertEqual(provider.loads(provider.dumps_bytes(data)), provider.loads(provider.dumps(data)))
+            decoded.append(provider.loads(provider.dumps(data)))
+        self.assertEqual(decoded[0], decoded[1])
+        self.assertEqual(decoded[0]["recommendation_type"], "UP_SELL")
+        self.assertEqual(decoded[0]["types"], ["CROSS_SELL", [{"type": "ACCESSORY"}]])
+        self.assertEqual(decoded[0]["uuid"], str(uuid.UUID(int=7)))
+
+    def test_response(self):
+        """It should build jsonify responses with the installed provider"""
+        for name in ["orjson", "stdlib"]:
+            app = make_app(name)
+            with app.app_context():
+                response = jsonify(status=400, valid=True)
+                self.assertEqual(response.mimetype, "application/json")
+                self.assertEqual(response.get_json(), {"status": 400, "valid": True})
+                self.assertEqual(jsonify([1, 2]).get_json(), [1, 2])
+
+    def test_dumps_rows(self):
+        """It should encode serialized rows the same way as any other data"""
+        rows = [{"id": 1, "recommendation_type": "UP_SELL", "score": 0.5}]
+        for name in ["orjson", "stdlib"]:
+            provider = make_app(name).json
+            self.assertEqual(provider.dumps_rows(rows), provider.dumps_bytes(rows))
+        data = {"recommendation_type": EnumRecommendationType.UNKNOWN}
+        for orjson in [json_provider.orjson, None]:
+            with patch.object(json_provider, "orjson", orjson):
+                self.assertEqual(json_provider.dumps_bytes(data), b'{"recommendation_type":"UNKNOWN"}')
+                self.assertEqual(json_provider.dumps_rows(rows), json_provider.dumps_bytes(rows))
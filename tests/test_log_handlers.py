@@ -0,0 +1,103 @@
+"""
+Test cases for the Log Handlers
+"""
+import io
+import json
+import logging
+from unittest import TestCase
+from flask import Flask
+from service.common import log_handlers
+from service.common.log_handlers import LocalQueueHandler, SamplingFilter
+
+
+def make_app(**settings):
+    """Returns a Flask app whose logs go to a stream through a fake gunicorn logger"""
+    app = Flask("logged")
+    app.config.update(settings)
+    stream = io.StringIO()
+    server_logger = logging.getLogger("test.gunicorn")
+    server_logger.handlers = [logging.StreamHandler(stream)]
+    server_logger.setLevel(logging.INFO)
+    log_handlers.init_logging(app, "test.gunicorn")
+    return app, stream
+
+
+def lines(stream):
+    """Returns the lines written to a stream"""
+    return stream.getvalue().splitlines()
+
+
+######################################################################
+#  L O G   H A N D L E R   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Log Handler Tests"""
+
+    def test_text_format(self):
+        """It should write formatted text lines through the server handlers"""
+        app, stream = make_app()
+        app.logger.info("Found %d recommendations", 3)
+        self.assertEqual(len(lines(stream)), 2)
+        self.assertRegex(lines(stream)[1], r"^\[.+\] \[INFO\] \[test_log_handlers\] Found 3 recommendations$")
+
+    def test_json_format(self):
+        """It should write one JSON object per record"""
+        app, stream = make_app(LOG_FORMAT="json")
+        try:
+            raise ValueError("bad value")
+        except ValueError:
+            app.logger.exception("Request failed for %s", "hat")
+        entry = json.loads(lines(stream)[-1])
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertEqual(entry["logger"], "logged")
+        self.assertEqual(entry["message"], "Request failed for hat")
+        self.assertIn("ValueError: bad value", entry["exception"])
+        self.assertRaises(ValueError, make_app, LOG_FORMAT="xml")
+
+    def test_queue(self):
+        """It should write the records from a background thread"""
+        app, stream = make_app(LOG_QUEUE=True)
+        self.assertIsInstance(app.logger.handlers[0], LocalQueueHandler)
+        for count in range(100):
+            app.logger.info("Record %d", count)
+        log_handlers.stop_listener(app)
+        self.assertEqual(len(lines(stream)), 101)
+        self.assertTrue(lines(stream)[-1].endswith("Record 99"))
+        self.assertNotIn("log_listener", app.extensions)
+
+    def test_restart_listener(self):
+        """It should start a new listener and queue after a fork"""
+        app, stream = make_app(LOG_QUEUE=True)
+        listener = app.extensions["log_listener"]
+        log_handlers.restart_listener(app)
+        listener.stop()
+        self.assertIsNot(app.extensions["log_listener"], listener)
+        self.assertIs(app.logger.handlers[0].queue, app.extensions["log_listener"].queue)
+        app.logger.info("After the fork")
+        log_handlers.stop_listener(app)
+        self.assertTrue(lines(stream)[-1].endswith("After the fork"))
+
+        log_handlers.restart_listener(app)
+        self.assertNotIn("log_listener", app.extensions)
+
+    def test_sampling(self):
+        """It should keep a share of the INFO records of sampled loggers"""
+        app, stream = make_app(LOG_SAMPLING="logged=0.25, logged.quiet=0")
+        stream.truncate(0)
+        stream.seek(0)
+        for count in range(8):
+            app.logger.info("Sampled %d", count)
+            app.logger.warning("Kept %d", count)
+        self.assertEqual(len([line for line in lines(stream) if "Sampled" in line]), 2)
+        self.assertEqual(len([line for line in lines(stream) if "Kept" in line]), 8)
+
+        sampling = SamplingFilter(log_handlers.parse_rates("logged=0.5,logged.quiet=0"))
+        record = logging.makeLogRecord({"name": "logged.quiet", "levelno": logging.INFO})
+        self.assertFalse(sampling.filter(record))
+        record = logging.makeLogRecord({"name": "other", "levelno": logging.INFO})
+        self.assertTrue(sampling.filter(record))
+
+    def test_parse_rates(self):
+        """It should parse the LOG_SAMPLING setting"""
+        self.assertEqual(log_handlers.parse_rates(""), {})
+        self.assertEqual(log_handlers.parse_rates("service=0.1, flask.app=0.5"), {"service": 0.1, "flask.app": 0.5})
@@ -0,0 +1,113 @@
+"""
+Test cases for Schema Migrations
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from sqlalchemy import Boolean, Column, Index, Integer, MetaData, String, Table, create_engine, inspect
+from service.common.migrations import upgrade_schema, _add_indexes, _create_index, _drop_index, _invalid_indexes
+
+
+def make_metadata(with_new_fields):
+    """Returns the metadata of a table with or without its newer fields"""
+    metadata = MetaData()
+    columns = [Column("id", Integer, primary_key=True), Column("name", String(63))]
+    if with_new_fields:
+        columns.append(Column("in_stock", Boolean, nullable=False, server_default="0"))
+    table = Table("product", metadata, *columns)
+    if with_new_fields:
+        Index("ix_product_name", table.c.name)
+    return metadata
+
+
+######################################################################
+#  M I G R A T I O N   T E S T   C A S E S
+######################################################################
+class TestMigrations(TestCase):
+    """Schema Migration Tests"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_create_missing_table(self):
+        """It should create tables that do not exist"""
+        changes = upgrade_schema(self.engine, make_metadata(True))
+        self.assertEqual(changes, ["Created table product"])
+        self.assertIn("product", inspect(self.engine).get_table_names())
+
+    def test_add_missing_columns_and_indexes(self):
+        """It should add new columns and indexes without losing rows"""
+        old = make_metadata(False)
+        old.create_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(old.tables["product"].insert(), [{"name": "shoes"}])
+
+        changes = upgrade_schema(self.engine, make_metadata(True))
+        self.assertEqual(
+            changes,
+            ["Added column product.in_stock", "Created index ix_product_name on product"],
+        )
+        indexes = [index["name"] for index in inspect(self.engine).get_indexes("product")]
+        self.assertEqual(indexes, ["ix_product_name"])
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql("SELECT name, in_stock FROM product").all()
+        self.assertEqual([tuple(row) for row in rows], [("shoes", 0)])
+
+        # a second run has nothing left to do
+        self.assertEqual(upgrade_schema(self.engine, make_metadata(True)), [])
+
+    def test_create_index_concurrently_on_postgres(self):
+        """It should build indexes concurrently outside a transaction on PostgreSQL"""
+        index = make_metadata(True).tables["product"].indexes.pop()
+        engine = MagicMock()
+        engine.dialect.name = "postgresql"
+        conn = engine.connect.return_value.execution_options.return_value.__enter__.return_value
+        conn.execute.side_effect = lambda ddl: self.assertTrue(
+            ddl.element.dialect_options["postgresql"]["concurrently"]
+        )
+        _create_index(engine, index)
+        engine.connect.return_value.execution_options.assert_called_once_with(isolation_level="AUTOCOMMIT")
+        conn.execute.assert_called_once()
+        self.assertFalse(index.dialect_options["postgresql"]["concurrently"])
+
+    def test_rebuild_invalid_indexes(self):
+        """It should drop and rebuild indexes that PostgreSQL marked invalid"""
+        table = make_metadata(True).tables["product"]
+        Index("ix_product_in_stock", table.c.in_stock)
+        engine = MagicMock()
+        with patch("service.common.migrations.inspect") as inspect_mock, patch(
+            "service.common.migrations._invalid_indexes", return_value={"ix_product_name"}
+        ), patch("service.common.migrations._drop_index") as drop_mock, patch(
+            "service.common.migrations._create_index"
+        ) as create_mock:
+            inspect_mock.return_value.get_indexes.return_value = [{"name": "ix_product_name"}]
+            changes = _add_indexes(engine, table)
+        self.assertEqual(
+            changes,
+            ["Created index ix_product_in_stock on product", "Rebuilt invalid index ix_product_name on product"],
+        )
+        self.assertEqual([call.args[1].name for call in drop_mock.call_args_list], ["ix_product_name"])
+        self.assertEqual(len(create_mock.call_args_list), 2)
+
+    def test_find_invalid_indexes(self):
+        """It should look for invalid indexes on PostgreSQL only"""
+        table = make_metadata(True).tables["product"]
+        self.assertEqual(_invalid_indexes(self.engine, table), set())
+        engine = MagicMock()
+        engine.dialect.name = "postgresql"
+        conn = engine.connect.return_value.__enter__.return_value
+        conn.execute.return_value.scalars.return_value = ["ix_product_name"]
+        self.assertEqual(_invalid_indexes(engine, table), {"ix_product_name"})
+        self.assertEqual(conn.execute.call_args.args[1], {"table": "product"})
+
+    def test_drop_index_concurrently(self):
+        """It should drop an index concurrently outside a transaction"""
+        index = make_metadata(True).tables["product"].indexes.pop()
+        engine = MagicMock()
+        engine.dialect.identifier_preparer.quote.side_effect = lambda name: name
+        conn = engine.connect.return_value.execution_options.return_value.__enter__.return_value
+        _drop_index(engine, index)
+        engine.connect.return_value.execution_options.assert_called_once_with(isolation_level="AUTOCOMMIT")
+        self.assertEqual(str(conn.execute.call_args.args[0]), "DROP INDEX CONCURRENTLY IF EXISTS ix_product_name")
@@ -13,6 +13,7 @@ from service.models import (
     DataValidationError,
     db,
 )
+from service.common.cache import cache
 from .factories import RecommendationFactory
 
 DATABASE_URI = os.getenv(
@@ -35,6 +36,7 @@ class TestCaseBase(TestCase):
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
         app.app_context().push()
+        db.create_all()
 
     @classmethod
     def tearDownClass(cls):
@@ -45,6 +47,7 @@ class TestCaseBase(TestCase):
         """This runs before each test"""
         db.session.query(Recommendation).delete()  # clean up the last tests
         db.session.commit()
+        cache.clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -118,6 +121,33 @@ class TestRecommendationModel(TestCaseBase):
             found_recommendation.recommendation_id, recommendation.recommendation_id
         )
 
+    def test_create_many_recommendations(self):
+        """It should Create many Recommendations in one transaction"""
+        self.assertEqual(Recommendation.create_many([]), [])
+        rows = [Recommendation.validate(RecommendationFactory().serialize()) for _ in range(3)]
+        ids = Recommendation.create_many(rows)
+        self.assertEqual(len(ids), 3)
+        for row, new_id in zip(rows, ids):
+            found = Recommendation.find(new_id)
+            self.assertEqual(found.name, row["name"])
+            self.assertEqual(found.recommendation_id, row["recommendation_id"])
+
+    def test_upsert_many_recommendations(self):
+        """It should Update the score of matching Recommendations and Create the others"""
+        self.assertEqual(Recommendation.upsert_many([]), (0, 0))
+        rows = [Recommendation.validate(RecommendationFactory().serialize()) for _ in range(3)]
+        self.assertEqual(Recommendation.upsert_many(rows), (3, 0))
+        in_stock = rows[0]["recommendation_in_stock"]
+        changed = [{**rows[0], "score": 9.0, "recommendation_id": 7, "recommendation_in_stock": not in_stock}]
+        self.assertEqual(Recommendation.upsert_many(changed + [{**rows[1], "name": "new"}]), (1, 1))
+        found = Recommendation.find_by_filters(
+            {"name": [rows[0]["name"]], "recommendation_name": [rows[0]["recommendation_name"]]}
+        ).all()
+        self.assertEqual(len(found), 1)
+        self.assertEqual((found[0].score, found[0].recommendation_id, found[0].version), (9.0, 7, 2))
+        self.assertEqual(found[0].recommendation_in_stock, in_stock)
+        self.assertEqual(len(Recommendation.all()), 4)
+
     def test_update_a_recommendation(self):
         """It should Update a Recommendation"""
         recommendation = RecommendationFactory()
@@ -139,6 +169,82 @@ class TestRecommendationModel(TestCaseBase):
         self.assertEqual(recommendations[0].id, original_id)
         self.assertEqual(recommendations[0].category, "k9")
 
+    def test_update_and_delete_by_id(self):
+        """It should Update and Delete one Recommendation in one statement"""
+        recommendation = RecommendationFactory(recommendation_in_stock=False)
+        recommendation.create()
+        data = Recommendation.update_by_id(
+            recommendation.id,
+            {"recommendation_in_stock": True},
+            Recommendation.recommendation_in_stock.is_(False),
+        )
+        self.assertEqual(data["id"], recommendation.id)
+        self.assertEqual(data["name"], recommendation.name)
+        self.assertTrue(data["recommendation_in_stock"])
+        self.assertEqual(data["recommendation_type"], "UNKNOWN")
+        # the condition no longer matches so nothing is updated
+        self.assertIsNone(
+            Recommendation.update_by_id(
+                recommendation.id,
+                {"recommendation_in_stock": True},
+                Recommendation.recommendation_in_stock.is_(False),
+            )
+        )
+        recommendation_id = recommendation.id
+        self.assertTrue(Recommendation.exists(recommendation_id))
+        self.assertTrue(Recommendation.delete_by_id(recommendation_id))
+        self.assertFalse(Recommendation.delete_by_id(recommendation_id))
+        self.assertFalse(Recommendation.exists(recommendation_id))
+
+    def test_update_and_delete_where(self):
+        """It should Update and Delete Recommendations matching filters"""
+        for index in range(4):
+            RecommendationFactory(name="even" if index % 2 == 0 else "odd").create()
+        count = Recommendation.update_where({"name": "odd"}, Recommendation.validate({"name": "gone"}, partial=True))
+        self.assertEqual(count, 2)
+        self.assertEqual(Recommendation.find_by_name("gone").count(), 2)
+        self.assertEqual(Recommendation.delete_where({"name": ["gone", "nothing"]}), 2)
+        self.assertEqual([rec.name for rec in Recommendation.all()], ["even", "even"])
+
+    def test_update_stock_of_target(self):
+        """It should set the stock of the Recommendations of a product whose stock differs"""
+        for in_stock in [True, False, False]:
+            RecommendationFactory(recommendation_id=5, recommendation_in_stock=in_stock).create()
+        other = RecommendationFactory(recommendation_id=6, recommendation_in_stock=False)
+        other.create()
+        self.assertEqual(Recommendation.update_stock_of_target(5, True), 2)
+        self.assertEqual(Recommendation.update_stock_of_target(5, True), 0)
+        db.session.expire_all()
+        self.assertTrue(all(rec.recommendation_in_stock for rec in Recommendation.find_by_recommendation_id(5)))
+        self.assertFalse(Recommendation.find(other.id).recommendation_in_stock)
+        self.assertEqual(Recommendation.validate_stock({"recommendation_in_stock": False}), False)
+
+    def test_version_bumped_by_every_write(self):
+        """It should bump the version of a Recommendation on every write"""
+        recommendation = RecommendationFactory()
+        recommendation.create()
+        self.assertEqual(recommendation.version, 1)
+        recommendation.name = "renamed"
+        recommendation.update()
+        self.assertEqual(recommendation.version, 2)
+        Recommendation.update_by_id(recommendation.id, {"name": "again"})
+        Recommendation.update_where({"id": recommendation.id}, {"name": "bulk"})
+        db.session.expire_all()
+        self.assertEqual(Recommendation.find(recommendation.id).version, 4)
+        self.assertEqual(
+            Recommendation.find_serialized(recommendation.id),
+            (Recommendation.find(recommendation.id).serialize(), 4),
+        )
+
+    def test_validate_partial(self):
+        """It should validate only the fields that are present"""
+        self.assertEqual(
+            Recommendation.validate({"recommendation_type": "UP_SELL", "id": 7}, partial=True),
+            {"recommendation_type": EnumRecommendationType.UP_SELL},
+        )
+        self.assertRaises(DataValidationError, Recommendation.validate, {}, partial=True)
+        self.assertRaises(DataValidationError, Recommendation.validate, "name", partial=True)
+
     def test_update_no_id(self):
         """It should not Update a Recommendation with no id"""
         recommendation = RecommendationFactory()
@@ -237,6 +343,50 @@ class TestRecommendationModel(TestCaseBase):
         recommendation = Recommendation()
         self.assertRaises(DataValidationError, recommendation.deserialize, data)
 
+    def test_deserialize_score(self):
+        """It should default a missing score and reject a bad one"""
+        data = RecommendationFactory().serialize()
+        del data["score"]
+        self.assertEqual(Recommendation().deserialize(data).score, 0.0)
+        data["score"] = 3
+        self.assertEqual(Recommendation().deserialize(data).score, 3.0)
+        for score in ["high", True, None, float("nan")]:
+            data["score"] = score
+            self.assertRaises(DataValidationError, Recommendation().deserialize, data)
+        self.assertEqual(Recommendation.validate({"name": "x"}, partial=True), {"name": "x"})
+
+    def test_deserialize_bad_columns(self):
+        """It should not deserialize values that do not fit their columns"""
+        for field, value in [
+            ("name", {"x": 1}),
+            ("name", "x" * 64),
+            ("recommendation_name", 7),
+            ("recommendation_id", [1, 2]),
+            ("recommendation_id", True),
+            ("recommendation_id", 2**31),
+            ("recommendation_type", "mro"),
+            ("recommendation_type", 1),
+        ]:
+            data = RecommendationFactory().serialize()
+            data[field] = value
+            self.assertRaises(DataValidationError, Recommendation().deserialize, data)
+        data = RecommendationFactory().serialize()
+        data.update(name="x" * 63, recommendation_id=None)
+        self.assertEqual(Recommendation.validate(data)["name"], "x" * 63)
+
+    def test_deserialize_ui_values(self):
+        """It should read the recommendation_id text the UI sends and allow null names"""
+        data = RecommendationFactory().serialize()
+        for text, expected in [("123", 123), (" -7 ", -7), ("", None), ("  ", None)]:
+            data["recommendation_id"] = text
+            self.assertEqual(Recommendation.validate(data)["recommendation_id"], expected, text)
+        for text in ["12a", "1.5", "99999999999", "\u00b2"]:
+            data["recommendation_id"] = text
+            self.assertRaises(DataValidationError, Recommendation.validate, data)
+        data.update(name=None, recommendation_name=None, recommendation_id=1)
+        values = Recommendation.validate(data)
+        self.assertEqual((values["name"], values["recommendation_name"]), (None, None))
+
     def test_deserialize_bad_in_stock(self):
         """It should not deserialize a bad recommendation_in_stock attribute"""
         test_recommendation = RecommendationFactory()
@@ -274,6 +424,38 @@ class TestExceptionHandlers(TestCaseBase):
         recommendation = RecommendationFactory()
         self.assertRaises(DataValidationError, recommendation.update)
 
+    @patch("service.models.db.session.commit")
+    def test_create_many_exception(self, exception_mock):
+        """It should catch a create many exception"""
+        exception_mock.side_effect = Exception()
+        rows = [Recommendation.validate(RecommendationFactory().serialize())]
+        self.assertRaises(DataValidationError, Recommendation.create_many, rows)
+
+    @patch("service.models.db.session.commit")
+    def test_upsert_many_exception(self, exception_mock):
+        """It should catch an upsert many exception"""
+        exception_mock.side_effect = Exception()
+        rows = [Recommendation.validate(RecommendationFactory().serialize())]
+        self.assertRaises(DataValidationError, Recommendation.upsert_many, rows)
+
+    @patch("service.models.db.session.commit")
+    def test_update_by_id_exception(self, exception_mock):
+        """It should catch a single statement update exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Recommendation.update_by_id, 1, {"name": "x"})
+
+    @patch("service.models.db.session.commit")
+    def test_update_stock_of_target_exception(self, exception_mock):
+        """It should catch a stock update exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Recommendation.update_stock_of_target, 1, True)
+
+    @patch("service.models.db.session.commit")
+    def test_delete_where_exception(self, exception_mock):
+        """It should catch a bulk delete exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Recommendation.delete_where, {"name": "x"})
+
     @patch("service.models.db.session.commit")
     def test_delete_exception(self, exception_mock):
         """It should catch a delete exception"""
@@ -321,6 +503,93 @@ class TestExceptionHandlers(TestCaseBase):
                 recommendation.recommendation_in_stock, recommendation_in_stock
             )
 
+    def test_find_by_columns(self):
+        """It should Find Recommendations by each column"""
+        recommendation = RecommendationFactory(
+            name="shoes",
+            recommendation_type=EnumRecommendationType.ACCESSORY,
+            recommendation_name="laces",
+            recommendation_id=42,
+        )
+        recommendation.create()
+        RecommendationFactory(name="hat", recommendation_name="scarf", recommendation_id=7).create()
+        for found in [
+            Recommendation.find_by_name("shoes"),
+            Recommendation.find_by_type("ACCESSORY"),
+            Recommendation.find_by_recommendation_name("laces"),
+            Recommendation.find_by_recommendation_id(42),
+        ]:
+            self.assertEqual([rec.id for rec in found], [recommendation.id])
+
+    def test_find_serialized_rows(self):
+        """It should serialize plain rows the same way as Recommendations"""
+        recommendation = RecommendationFactory(
+            name="shoes",
+            recommendation_type=EnumRecommendationType.ACCESSORY,
+            recommendation_name="laces",
+            recommendation_id=42,
+            recommendation_in_stock=True,
+        )
+        recommendation.create()
+        RecommendationFactory(
+            name="hat", recommendation_name="scarf", recommendation_id=7, recommendation_in_stock=False
+        ).create()
+        expected = [recommendation.serialize()]
+        for found in [
+            Recommendation.find_by_name("shoes", serialized=True),
+            Recommendation.find_by_type("ACCESSORY", serialized=True),
+            Recommendation.find_by_in_stock(True, serialized=True),
+            Recommendation.find_by_recommendation_name("laces", serialized=True),
+            Recommendation.find_by_recommendation_id(42, serialized=True),
+        ]:
+            self.assertEqual(found, expected)
+        rows = Recommendation.select_rows(Recommendation.find_by_name("shoes")).all()
+        self.assertEqual(rows[0].version, 1)
+
+    def test_find_by_filters(self):
+        """It should Find Recommendations matching every filter"""
+        for index in range(6):
+            RecommendationFactory(
+                name="odd" if index % 2 else "even",
+                recommendation_type=EnumRecommendationType(index % 3),
+                recommendation_in_stock=index < 3,
+                recommendation_id=index,
+            ).create()
+
+        def recommendation_ids(filters):
+            found = Recommendation.find_by_filters(filters).order_by(Recommendation.recommendation_id)
+            return [rec.recommendation_id for rec in found]
+
+        self.assertEqual(recommendation_ids({}), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(recommendation_ids({"name": "even", "recommendation_in_stock": True}), [0, 2])
+        self.assertEqual(recommendation_ids({"recommendation_type": ["CROSS_SELL", "ACCESSORY"]}), [0, 2, 3, 5])
+        self.assertEqual(recommendation_ids({"recommendation_id_min": 2, "recommendation_id_max": 4}), [2, 3, 4])
+        self.assertEqual(recommendation_ids({"recommendation_id": [1, 4, 5], "name": "odd", "id_min": 0}), [1, 5])
+        self.assertEqual(recommendation_ids({"name": None, "recommendation_id_max": 0}), [0])
+
+    def test_find_by_bad_filters(self):
+        """It should not Find Recommendations with an unknown filter or type"""
+        self.assertRaises(DataValidationError, Recommendation.find_by_filters, {"color": "red"})
+        self.assertRaises(DataValidationError, Recommendation.find_by_filters, {"recommendation_type": "BOGUS"})
+
+    def test_paginate_with_null_values(self):
+        """It should page through NULL values of the sort column last"""
+        for recommendation_id in [3, None, 1, None, 2]:
+            RecommendationFactory(recommendation_id=recommendation_id).create()
+        for sort, expected in [
+            ("recommendation_id", [1, 2, 3, None, None]),
+            ("-recommendation_id", [3, 2, 1, None, None]),
+        ]:
+            found, cursor = [], None
+            while True:
+                page, cursor = Recommendation.paginate(Recommendation.query, 2, cursor, sort)
+                found.extend(page)
+                if cursor is None:
+                    break
+            self.assertEqual([rec.recommendation_id for rec in found], expected)
+            null_ids = [rec.id for rec in found[3:]]
+            self.assertEqual(null_ids, sorted(null_ids, reverse=sort.startswith("-")))
+
 
 # class TestModelQueries(TestCaseBase):
 #     """Recommendation Model Query Tests"""
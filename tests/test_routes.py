@@ -3,11 +3,15 @@ Recommendation API Service Test Suite
 """
 
 import os
+import json
 import logging
 from unittest import TestCase
+from unittest.mock import patch
 from wsgi import app
 from service.common import status
-from service.models import db, Recommendation
+from service.models import db, Recommendation, EnumRecommendationType, DataValidationError
+from service.common.cache import cache
+from service.common.pagination import encode_cursor
 from tests.factories import RecommendationFactory
 
 DATABASE_URI = os.getenv(
@@ -34,6 +38,7 @@ class TestRecommendationService(TestCase):
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
         app.app_context().push()
+        db.create_all()
 
     @classmethod
     def tearDownClass(cls):
@@ -45,6 +50,7 @@ class TestRecommendationService(TestCase):
         self.client = app.test_client()
         db.session.query(Recommendation).delete()  # clean up the last tests
         db.session.commit()
+        cache.clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -102,6 +108,73 @@ class TestRecommendationService(TestCase):
             test_recommendation.recommendation_type.name,
         )
 
+    def test_create_recommendations_batch(self):
+        """It should Create a batch of Recommendations and report bad items"""
+        items = [RecommendationFactory().serialize() for _ in range(5)]
+        items.insert(2, {"name": "missing fields"})
+        app.config["BATCH_CHUNK_SIZE"] = 2
+        try:
+            response = self.client.post(f"{BASE_URL}/batch", json=items)
+        finally:
+            app.config["BATCH_CHUNK_SIZE"] = 1000
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.get_json()
+        self.assertEqual(len(data["created"]), 5)
+        self.assertEqual([err["index"] for err in data["errors"]], [2])
+        self.assertIn("missing", data["errors"][0]["error"])
+        for item, new_id in zip(items[:2] + items[3:], data["created"]):
+            self.assertEqual(Recommendation.find(new_id).name, item["name"])
+
+    def test_create_recommendations_batch_ndjson(self):
+        """It should Create a batch of Recommendations from NDJSON"""
+        lines = [json.dumps(RecommendationFactory().serialize()) for _ in range(3)]
+        lines.insert(1, "{not json")
+        body = "\n".join(lines) + "\n\n"
+        response = self.client.post(f"{BASE_URL}/batch", data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.get_json()
+        self.assertEqual(len(data["created"]), 3)
+        self.assertEqual([err["index"] for err in data["errors"]], [1])
+        self.assertEqual(len(Recommendation.all()), 3)
+
+    def test_create_recommendations_batch_chunk_fails(self):
+        """It should insert a failed chunk row by row and report only the rejected rows"""
+        items = [RecommendationFactory().serialize() for _ in range(3)]
+        app.config["BATCH_CHUNK_SIZE"] = 2
+        rejected = DataValidationError("INSERT INTO recommendation ... [parameters: ...]")
+        try:
+            with patch("service.models.Recommendation.create_many", side_effect=[rejected, rejected, [98], [99]]):
+                response = self.client.post(f"{BASE_URL}/batch", json=items)
+        finally:
+            app.config["BATCH_CHUNK_SIZE"] = 1000
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.get_json()
+        self.assertEqual(data["created"], [98, 99])
+        self.assertEqual(data["errors"], [{"index": 0, "error": Recommendation.REJECTED}])
+
+    def test_create_recommendations_batch_bad_columns(self):
+        """It should reject items with bad column values and Create the others"""
+        items = [RecommendationFactory().serialize() for _ in range(4)]
+        items[1]["name"] = {"x": 1}
+        items[2]["recommendation_id"] = [1, 2]
+        response = self.client.post(f"{BASE_URL}/batch", json=items)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.get_json()
+        self.assertEqual(len(data["created"]), 2)
+        self.assertEqual([err["index"] for err in data["errors"]], [1, 2])
+        self.assertIn("name", data["errors"][0]["error"])
+        self.assertIn("recommendation_id", data["errors"][1]["error"])
+
+    def test_create_recommendations_batch_all_bad(self):
+        """It should not Create a batch with no valid items"""
+        response = self.client.post(f"{BASE_URL}/batch", json=[{}, {"name": "x"}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.get_json()["errors"]), 2)
+        response = self.client.post(f"{BASE_URL}/batch", json={"name": "not a list"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/batch", data="[]", content_type="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
     def test_get_recommendation(self):
         """It should Get a single Recommendation"""
         # get the id of a recommendation
@@ -111,6 +184,60 @@ class TestRecommendationService(TestCase):
         data = response.get_json()
         self.assertEqual(data["name"], test_recommendation.name)
 
+    def test_get_recommendation_cached(self):
+        """It should serve repeat reads from the cache until a write"""
+        test_recommendation = self._create_recommendations(1)[0]
+        url = f"{BASE_URL}/{test_recommendation.id}"
+        cache.reset_stats()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        with patch("service.models.Recommendation.find") as find_mock:
+            response = self.client.get(url)
+            find_mock.assert_not_called()
+        self.assertEqual(response.get_json()["name"], test_recommendation.name)
+        stats = self.client.get("/stats").get_json()
+        self.assertEqual((stats["cache"]["hits"], stats["cache"]["misses"]), (1, 1))
+        self.assertEqual(stats["pool"]["class"], "TimedQueuePool")
+        self.assertGreater(stats["pool"]["checkouts"], 0)
+
+        data = response.get_json()
+        data["name"] = "renamed"
+        self.client.put(url, json=data)
+        self.assertEqual(self.client.get(url).get_json()["name"], "renamed")
+        self.client.patch(BASE_URL, query_string=f"id={test_recommendation.id}", json={"name": "bulk"})
+        self.assertEqual(self.client.get(url).get_json()["name"], "bulk")
+        self.client.delete(url)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_recommendation_conditionally(self):
+        """It should return 304 Not Modified until a Recommendation changes"""
+        test_recommendation = self._create_recommendations(1)[0]
+        url = f"{BASE_URL}/{test_recommendation.id}"
+        response = self.client.get(url)
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.startswith(f'"{test_recommendation.id}-1-'))
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(
+            self.client.get(url, headers={"If-None-Match": "W/" + etag}).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+        self.client.patch(BASE_URL, query_string=f"id={test_recommendation.id}", json={"name": "renamed"})
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.headers["ETag"].startswith(f'"{test_recommendation.id}-2-'))
+
+        app.config["HTTP_CACHE_MAX_AGE"] = 30
+        try:
+            response = self.client.get(url)
+        finally:
+            app.config["HTTP_CACHE_MAX_AGE"] = 0
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=30")
+
     def test_get_recommendation_not_found(self):
         """It should not Get a Recommendation thats not found"""
         response = self.client.get(f"{BASE_URL}/0")
@@ -194,6 +321,48 @@ class TestRecommendationService(TestCase):
         # Check that the recommendation name has been updated
         self.assertEqual(updated_recommendation["recommendation_name"], new_name)
 
+    def test_update_recommendation_name_too_long(self):
+        """It should not link a recommendation name longer than its column"""
+        recommendation = self.client.post(BASE_URL, json=RecommendationFactory().serialize()).get_json()
+        response = self.client.put(f"{BASE_URL}/{recommendation['id']}/{'x' * 64}", json=recommendation)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(f"{BASE_URL}/{recommendation['id']}/{'x' * 63}", json=recommendation)
+        self.assertEqual(response.get_json()["recommendation_name"], "x" * 63)
+
+    def test_create_from_ui(self):
+        """It should create and update a Recommendation with the form values the UI sends"""
+        data = {
+            "name": "cake",
+            "recommendation_in_stock": True,
+            "recommendation_name": "cookie",
+            "recommendation_id": "123",
+            "recommendation_type": "CROSS_SELL",
+        }
+        response = self.client.post(BASE_URL, json=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = response.get_json()
+        self.assertEqual(created["recommendation_id"], 123)
+        data["recommendation_id"] = "777"
+        response = self.client.put(f"{BASE_URL}/{created['id']}", json=data)
+        self.assertEqual(response.get_json()["recommendation_id"], 777)
+
+    def test_update_recommendation_not_found(self):
+        """It should not Update a Recommendation that is not found"""
+        for url in [f"{BASE_URL}/0", f"{BASE_URL}/0/5", f"{BASE_URL}/0/name"]:
+            response = self.client.put(url, json=RecommendationFactory().serialize())
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, url)
+            # a missing Recommendation is reported before a bad body
+            for body in [{"name": {"x": 1}}, "not a dict"]:
+                response = self.client.put(url, json=body)
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, url)
+            response = self.client.put(url, data="{", content_type="application/json")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, url)
+        response = self.client.put(f"{BASE_URL}/0/{'x' * 64}", json=RecommendationFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        recommendation = self.client.post(BASE_URL, json=RecommendationFactory().serialize()).get_json()
+        response = self.client.put(f"{BASE_URL}/{recommendation['id']}", json={"name": {"x": 1}})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_delete_recommendation(self):
         """It should Delete a Recommendation"""
         test_recommendation = self._create_recommendations(1)[0]
@@ -260,6 +429,46 @@ class TestRecommendationService(TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]["recommendation_id"], 1)
 
+    def test_query_by_many_filters(self):
+        """It should AND together every filter passed in"""
+        for index in range(6):
+            self.client.post(BASE_URL, json=RecommendationFactory(
+                name="odd" if index % 2 else "even",
+                recommendation_type=EnumRecommendationType(index % 3),
+                recommendation_in_stock=index < 3,
+                recommendation_id=index,
+            ).serialize())
+
+        def recommendation_ids(query):
+            response = self.client.get(BASE_URL, query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(row["recommendation_id"] for row in response.get_json())
+
+        self.assertEqual(recommendation_ids("name=even&recommendation_in_stock=true"), [0, 2])
+        self.assertEqual(recommendation_ids("name=even&name=odd&recommendation_type=UP_SELL"), [1, 4])
+        self.assertEqual(recommendation_ids("recommendation_type=CROSS_SELL,ACCESSORY&recommendation_in_stock=no"), [3, 5])
+        self.assertEqual(recommendation_ids("recommendation_id=1,2,5&name=odd"), [1, 5])
+        self.assertEqual(recommendation_ids("recommendation_id_min=2&recommendation_id_max=4&name="), [2, 3, 4])
+
+    def test_query_with_bad_filters(self):
+        """It should not list Recommendations with malformed filters"""
+        out_of_range = ["id_min=99999999999999999999999", "id_max=-2147483649", "recommendation_id=2147483648"]
+        for query in ["recommendation_id=one", "id_min=x", "recommendation_type=BOGUS"] + out_of_range:
+            response = self.client.get(BASE_URL, query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        self.assertEqual(self.client.get(BASE_URL, query_string="recommendation_id=2147483647").get_json(), [])
+
+    def test_ids_out_of_range(self):
+        """It should not find a Recommendation whose id cannot fit the id column"""
+        for method, url in [
+            ("get", f"{BASE_URL}/2147483648"),
+            ("get", f"{BASE_URL}/targets/99999999999999999999999"),
+            ("put", f"{BASE_URL}/99999999999999999999999/restock"),
+        ]:
+            response = getattr(self.client, method)(url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, url)
+        self.assertEqual(self.client.get(f"{BASE_URL}/2147483647").status_code, status.HTTP_404_NOT_FOUND)
+
     def test_query_by_in_stock(self):
         """It should Query Recommendations by in_sock"""
         recommendations = self._create_recommendations(10)
@@ -300,6 +509,325 @@ class TestRecommendationService(TestCase):
         for recommendation in data:
             self.assertEqual(recommendation["recommendation_in_stock"], False)
 
+    # ----------------------------------------------------------
+    # TEST BULK UPDATE AND DELETE
+    # ----------------------------------------------------------
+    def test_update_recommendations_by_filter(self):
+        """It should Update every Recommendation matching the filters"""
+        for index in range(6):
+            self.client.post(BASE_URL, json=RecommendationFactory(
+                recommendation_type=EnumRecommendationType(index % 3), recommendation_id=index
+            ).serialize())
+        response = self.client.patch(
+            BASE_URL,
+            query_string="recommendation_type=ACCESSORY",
+            json={"recommendation_type": "UNKNOWN", "recommendation_in_stock": False, "id": 0},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"updated": 2})
+        found = Recommendation.find_by_type("UNKNOWN")
+        self.assertEqual(sorted(rec.recommendation_id for rec in found), [2, 5])
+        self.assertFalse(any(rec.recommendation_in_stock for rec in found))
+        self.assertEqual(Recommendation.find_by_type("ACCESSORY").count(), 0)
+
+    def test_delete_recommendations_by_filter(self):
+        """It should Delete every Recommendation matching the filters"""
+        for index in range(6):
+            self.client.post(BASE_URL, json=RecommendationFactory(recommendation_id=index).serialize())
+        response = self.client.delete(BASE_URL, query_string="recommendation_id_min=2&recommendation_id=2,3,4,9")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"deleted": 3})
+        remaining = sorted(rec.recommendation_id for rec in Recommendation.all())
+        self.assertEqual(remaining, [0, 1, 5])
+
+    def test_bulk_requests_need_filters(self):
+        """It should not Update or Delete everything without a filter"""
+        self._create_recommendations(2)
+        for query in ["", "name=", "nmae=x&recommendation_type=UNKNOWN", "limit=1", "recommendation_in_stock=ture"]:
+            response = self.client.delete(BASE_URL, query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+            response = self.client.patch(BASE_URL, query_string=query, json={"name": "x"})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        self.assertEqual(len(Recommendation.all()), 2)
+        for value in ["No", "0", "false"]:
+            response = self.client.patch(BASE_URL, query_string={"recommendation_in_stock": value}, json={"name": "x"})
+            self.assertEqual(response.status_code, status.HTTP_200_OK, value)
+
+    def test_update_recommendations_by_filter_bad_body(self):
+        """It should not Update Recommendations with a bad body"""
+        self._create_recommendations(2)
+        for body in [{}, {"recommendation_in_stock": "yes"}, {"recommendation_type": "BOGUS"}, ["name"]]:
+            response = self.client.patch(BASE_URL, query_string="id_min=0", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+        response = self.client.patch(BASE_URL, query_string="id_min=0", data="x", content_type="text/plain")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_update_rejected_by_database(self):
+        """It should answer a write the database rejects with 400 and without its SQL"""
+        self._create_recommendations(1)
+        with patch("service.models.Recommendation.validate", return_value={"recommendation_in_stock": None}):
+            response = self.client.patch(BASE_URL, query_string="id_min=0", json={"name": "x"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.get_json()["message"], Recommendation.REJECTED)
+
+    def test_list_recommendations_of_target(self):
+        """It should list the Recommendations that point at a product"""
+        for index in range(5):
+            self.client.post(BASE_URL, json=RecommendationFactory(
+                recommendation_id=7 if index < 4 else 8, recommendation_in_stock=index % 2 == 0
+            ).serialize())
+        response = self.client.get(f"{BASE_URL}/targets/7")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["recommendation_id"] for row in response.get_json()], [7, 7, 7, 7])
+
+        response = self.client.get(f"{BASE_URL}/targets/7", query_string="recommendation_in_stock=true&limit=1")
+        self.assertEqual(len(response.get_json()), 1)
+        next_url = response.headers["Link"].split(">")[0].lstrip("<")
+        self.assertIn(f"{BASE_URL}/targets/7?", next_url)
+        response = self.client.get(next_url)
+        self.assertEqual(len(response.get_json()), 1)
+        self.assertTrue(response.get_json()[0]["recommendation_in_stock"])
+        self.assertNotIn("Link", response.headers)
+        self.assertEqual(self.client.get(f"{BASE_URL}/targets/9").get_json(), [])
+
+    def test_update_stock_of_target(self):
+        """It should set the stock of every Recommendation of a product in one statement"""
+        for index in range(5):
+            self.client.post(BASE_URL, json=RecommendationFactory(
+                recommendation_id=7 if index < 4 else 8, recommendation_in_stock=index % 2 == 0
+            ).serialize())
+        response = self.client.put(f"{BASE_URL}/targets/7/stock", json={"recommendation_in_stock": False})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"updated": 2})
+        self.assertFalse(any(rec.recommendation_in_stock for rec in Recommendation.find_by_recommendation_id(7)))
+        self.assertTrue(Recommendation.find_by_recommendation_id(8).first().recommendation_in_stock)
+
+        response = self.client.put(f"{BASE_URL}/targets/7/stock", json={"recommendation_in_stock": False})
+        self.assertEqual(response.get_json(), {"updated": 0})
+        response = self.client.put(f"{BASE_URL}/targets/7/stock", json={"recommendation_in_stock": True})
+        self.assertEqual(response.get_json(), {"updated": 4})
+
+    def test_update_stock_of_target_bad_body(self):
+        """It should not set the stock of a product with a bad body"""
+        for body in [{}, {"recommendation_in_stock": "no"}, {"recommendation_in_stock": True, "name": "x"}, [True]]:
+            response = self.client.put(f"{BASE_URL}/targets/7/stock", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+        response = self.client.put(f"{BASE_URL}/targets/7/stock", data="x", content_type="text/plain")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    # ----------------------------------------------------------
+    # TEST PAGINATION
+    # ----------------------------------------------------------
+    def test_list_recommendations_in_pages(self):
+        """It should page through Recommendations with a cursor"""
+        recommendations = self._create_recommendations(5)
+        response = self.client.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([row["id"] for row in data], [rec.id for rec in recommendations[:2]])
+        cursor = response.headers.get("X-Next-Cursor")
+        self.assertIsNotNone(cursor)
+        self.assertIn('rel="next"', response.headers.get("Link"))
+
+        seen = [row["id"] for row in data]
+        while cursor:
+            response = self.client.get(BASE_URL, query_string={"limit": 2, "cursor": cursor})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(row["id"] for row in response.get_json())
+            cursor = response.headers.get("X-Next-Cursor")
+        self.assertEqual(seen, [rec.id for rec in recommendations])
+
+    def test_list_top_recommendations(self):
+        """It should list the highest scoring Recommendations of a product"""
+        for index, score in enumerate([0.2, 0.9, 0.5, 0.9, 0.1]):
+            self.client.post(BASE_URL, json=RecommendationFactory(
+                name="shirt" if index < 4 else "shoes", recommendation_type=EnumRecommendationType.UP_SELL, score=score
+            ).serialize())
+        response = self.client.get(BASE_URL, query_string="name=shirt&recommendation_type=UP_SELL&top=3")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([row["score"] for row in data], [0.9, 0.9, 0.5])
+        self.assertGreater(data[0]["id"], data[1]["id"])
+        self.assertNotIn("Link", response.headers)
+
+        # top takes precedence over the sort and the page size and is capped
+        response = self.client.get(BASE_URL, query_string="top=2000&sort=name&limit=1")
+        self.assertEqual([row["score"] for row in response.get_json()], [0.9, 0.9, 0.5, 0.2, 0.1])
+        for query in ["top=0", "top=x", "top=2&cursor=abc"]:
+            response = self.client.get(BASE_URL, query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_list_recommendations_sorted_by_score(self):
+        """It should page through Recommendations sorted by score descending"""
+        for score in [0.3, 0.7, 0.3, 0.1, 0.7]:
+            self.client.post(BASE_URL, json=RecommendationFactory(score=score).serialize())
+        scores = []
+        query = {"limit": 2, "sort": "-score"}
+        while True:
+            response = self.client.get(BASE_URL, query_string=query)
+            scores.extend(row["score"] for row in response.get_json())
+            if "X-Next-Cursor" not in response.headers:
+                break
+            query["cursor"] = response.headers["X-Next-Cursor"]
+        self.assertEqual(scores, [0.7, 0.7, 0.3, 0.3, 0.1])
+
+    def test_list_recommendations_sorted_by_name(self):
+        """It should page through Recommendations sorted by name descending"""
+        for name in ["b", "d", "a", "c", "b"]:
+            self.client.post(BASE_URL, json=RecommendationFactory(name=name).serialize())
+        names = []
+        query = {"limit": 2, "sort": "-name"}
+        while True:
+            response = self.client.get(BASE_URL, query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names.extend(row["name"] for row in response.get_json())
+            if "X-Next-Cursor" not in response.headers:
+                break
+            query["cursor"] = response.headers["X-Next-Cursor"]
+        self.assertEqual(names, ["d", "c", "b", "b", "a"])
+
+    def test_list_recommendations_page_size_capped(self):
+        """It should never return more than the maximum page size"""
+        self._create_recommendations(3)
+        page_max = app.config["PAGE_SIZE_MAX"]
+        app.config["PAGE_SIZE_MAX"] = 2
+        try:
+            response = self.client.get(BASE_URL, query_string="limit=500")
+        finally:
+            app.config["PAGE_SIZE_MAX"] = page_max
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 2)
+
+    def test_list_recommendations_bad_page_arguments(self):
+        """It should not list Recommendations with a bad limit, sort or cursor"""
+        self._create_recommendations(3)
+        response = self.client.get(BASE_URL, query_string="limit=1")
+        cursor = response.headers["X-Next-Cursor"]
+        for query in [
+            "limit=0",
+            "limit=ten",
+            "sort=recommendation_type",
+            "cursor=not-a-cursor",
+            f"sort=-id&cursor={cursor}",
+            f"sort=name&cursor={encode_cursor('name', [1, 2], 3)}",
+        ]:
+            response = self.client.get(BASE_URL, query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_list_recommendations_cached(self):
+        """It should serve repeat list queries from the cache until a write"""
+        self._create_recommendations(3)
+        self.client.post(BASE_URL, json=RecommendationFactory(name="a").serialize())
+        self.client.post(BASE_URL, json=RecommendationFactory(name="b").serialize())
+        first = self.client.get(BASE_URL, query_string="name=a&name=b&limit=1")
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        with patch("service.models.Recommendation.paginate") as paginate_mock:
+            # the same filters in a different order are the same query
+            second = self.client.get(BASE_URL, query_string="name=b&name=a&limit=1")
+            paginate_mock.assert_not_called()
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(second.headers["X-Next-Cursor"], first.headers["X-Next-Cursor"])
+
+        for write in [
+            lambda: self.client.post(BASE_URL, json=RecommendationFactory(name="a").serialize()),
+            lambda: self.client.post(f"{BASE_URL}/batch", json=[RecommendationFactory(name="b").serialize()]),
+            lambda: self.client.patch(BASE_URL, query_string="name=b", json={"name": "a"}),
+            lambda: self.client.delete(BASE_URL, query_string="name=a"),
+        ]:
+            before = self.client.get(BASE_URL, query_string="name=a&name=b").get_json()
+            write()
+            after = self.client.get(BASE_URL, query_string="name=a&name=b").get_json()
+            self.assertNotEqual(after, before)
+
+    def test_list_recommendations_conditionally(self):
+        """It should return 304 Not Modified until a page of Recommendations changes"""
+        recommendations = self._create_recommendations(3)
+        response = self.client.get(BASE_URL, query_string="limit=2")
+        etag = response.headers["ETag"]
+        self.assertEqual(response.headers["Vary"], "Accept")
+        for _ in range(2):
+            # once from the database and once from the cache
+            cache.clear()
+            with patch("service.models.Recommendation.serialize_rows") as serialize_mock:
+                response = self.client.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+                serialize_mock.assert_not_called()
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.headers["ETag"], etag)
+            response = self.client.get(BASE_URL, query_string="limit=2")
+
+        # a change to a row on another page keeps the page
+        self.client.patch(BASE_URL, query_string=f"id={recommendations[2].id}", json={"name": "other"})
+        response = self.client.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.patch(BASE_URL, query_string=f"id={recommendations[0].id}", json={"name": "renamed"})
+        response = self.client.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_list_last_page_gains_next_page(self):
+        """It should change the ETag of the last page when a next page appears"""
+        self._create_recommendations(2)
+        response = self.client.get(BASE_URL, query_string="limit=2")
+        self.assertNotIn("Link", response.headers)
+        etag = response.headers["ETag"]
+        self._create_recommendations(1)
+        response = self.client.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Link", response.headers)
+
+    def test_etag_of_reused_id(self):
+        """It should not match the ETag of a deleted row to a new row with its id"""
+        old = self._create_recommendations(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{old.id}").headers["ETag"]
+        self.client.delete(f"{BASE_URL}/{old.id}")
+        data = RecommendationFactory(name=old.name + "-new").serialize()
+        recommendation = Recommendation().deserialize(data)
+        recommendation.id = old.id
+        db.session.add(recommendation)
+        db.session.commit()
+        response = self.client.get(f"{BASE_URL}/{old.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    # ----------------------------------------------------------
+    # TEST STREAMING
+    # ----------------------------------------------------------
+    def test_stream_recommendations_as_ndjson(self):
+        """It should stream every Recommendation as NDJSON"""
+        recommendations = self._create_recommendations(5)
+        app.config["STREAM_BATCH_SIZE"] = 2
+        try:
+            response = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        finally:
+            app.config["STREAM_BATCH_SIZE"] = 1000
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 5)
+        data = [json.loads(line) for line in lines]
+        self.assertEqual([row["id"] for row in data], [rec.id for rec in recommendations])
+
+    def test_stream_recommendations_as_json_array(self):
+        """It should stream every Recommendation as a JSON array"""
+        for name in ["b", "a", "c"]:
+            self.client.post(BASE_URL, json=RecommendationFactory(name=name).serialize())
+        app.config["STREAM_BATCH_SIZE"] = 2
+        try:
+            response = self.client.get(BASE_URL, query_string="stream=true&sort=name&limit=1")
+        finally:
+            app.config["STREAM_BATCH_SIZE"] = 1000
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["name"] for row in response.get_json()], ["a", "b", "c"])
+
+        response = self.client.get(BASE_URL, query_string="stream=true&name=x")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [])
+
+    def test_stream_recommendations_bad_sort(self):
+        """It should not stream Recommendations with a bad sort column"""
+        response = self.client.get(BASE_URL, query_string="stream=true&sort=bogus")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     # ----------------------------------------------------------
     # TEST ACTIONS
     # ----------------------------------------------------------
@@ -320,6 +848,11 @@ class TestRecommendationService(TestCase):
         logging.debug("Response data: %s", data)
         self.assertEqual(data["recommendation_in_stock"], True)
 
+    def test_restock_not_found(self):
+        """It should not restock a Recommendation that is not found"""
+        response = self.client.put(f"{BASE_URL}/0/restock")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_restock_not_available(self):
         """It should not restock a Recommendation that is not available"""
         recommendations = self._create_recommendations(15)